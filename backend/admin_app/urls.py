@@ -4,7 +4,15 @@ from . import views
 urlpatterns = [
     path('dashboard/', views.admin_dashboard, name='admin-dashboard'),
     path('users/', views.manage_users, name='manage-users'),
+    path('users/import/', views.import_users_csv, name='import-users'),
     path('users/<int:user_id>/', views.manage_single_user, name='manage-single-user'),
     path('departments/', views.manage_departments, name='manage-departments'),
     path('departments/<int:dept_id>/', views.manage_single_department, name='manage-single-department'),
+    path('deletion-jobs/<int:job_id>/', views.deletion_job, name='deletion-job'),
+    path('attendance/export/', views.export_attendance, name='export-attendance'),
+    path('attendance/alerts/', views.attendance_alerts, name='attendance-alerts'),
+    path('notifications/', views.send_notification, name='send-notification'),
+    path('notifications/<int:notification_id>/deliveries/', views.notification_deliveries, name='notification-deliveries'),
+    path('audit/', views.audit_logs, name='audit-logs'),
+    path('metrics/', views.performance_metrics, name='performance-metrics'),
 ]
\ No newline at end of file
@@ -1,10 +1,26 @@
+import datetime
+import io
+
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 from django.contrib.auth import get_user_model
-from users.models import Department, Semester, Section, Subject, Attendance
-from users.serializers import UserSerializer
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from users import audit, dashboard, metrics
+from users.deletion import job_status, schedule_deletion
+from users.email_delivery import delivery_status
+from users.alerts import run_attendance_alerts
+from users.audit_partitions import audit_log_page
+from users.exports import EXPORT_FORMATS, iter_attendance_rows, iter_export
+from users.imports import UserImportError, import_users
+from users.notifications import send
+from users.models import Department, Semester, Section, Subject, Attendance, DeletionJob, Notification
+from users.directory import directory_page
+from users.pagination import InvalidCursor, page_size_param
+from users.serializers import DepartmentSerializer, NotificationSerializer, UserSerializer
 
 User = get_user_model()
 
@@ -13,28 +29,22 @@ User = get_user_model()
 @permission_classes([IsAuthenticated])
 def admin_dashboard(request):
     """
-    Admin dashboard endpoint
+    Admin dashboard endpoint. Admins get system-wide counts; HODs (this view
+    is also mounted under hod/) get the counts for their department.
+    Counts come from the cached dashboard counters.
     """
-    if not request.user.is_admin:
-        return Response({'error': 'Only admins can access this endpoint'}, 
+    if request.user.is_admin:
+        data = dashboard.totals()
+    elif request.user.is_hod and request.user.department_id:
+        data = {
+            'department_id': request.user.department_id,
+            **dashboard.department_stats(request.user.department_id),
+        }
+    else:
+        return Response({'error': 'Only admins and HODs can access this endpoint'}, 
                        status=status.HTTP_403_FORBIDDEN)
     
-    # Count various entities
-    user_count = User.objects.count()
-    dept_count = Department.objects.count()
-    semester_count = Semester.objects.count()
-    section_count = Section.objects.count()
-    subject_count = Subject.objects.count()
-    
-    data = {
-        'user_count': user_count,
-        'department_count': dept_count,
-        'semester_count': semester_count,
-        'section_count': section_count,
-        'subject_count': subject_count,
-        'message': f'Welcome, {request.user.username}!'
-    }
-    
+    data['message'] = f'Welcome, {request.user.username}!'
     return Response(data)
 
 
@@ -49,9 +59,16 @@ def manage_users(request):
                        status=status.HTTP_403_FORBIDDEN)
     
     if request.method == 'GET':
-        users = User.objects.all()
-        serializer = UserSerializer(users, many=True)
-        return Response(serializer.data)
+        # Filters: role, department_id, semester_id, section_id, is_active, q (search)
+        try:
+            users, next_cursor = directory_page(
+                User.objects.filter(pending_delete=False), request.query_params,
+                cursor=request.query_params.get('cursor'),
+                page_size=page_size_param(request),
+            )
+        except (InvalidCursor, ValueError):
+            return Response({'error': 'Invalid cursor or filter'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'results': users, 'next_cursor': next_cursor})
     
     elif request.method == 'POST':
         # Admin can create users with specific roles
@@ -62,6 +79,38 @@ def manage_users(request):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def import_users_csv(request):
+    """
+    Create users from an uploaded CSV ('file'). Rows that fail validation are
+    skipped and listed in the report; ?dry_run=1 only validates.
+    """
+    if not request.user.is_admin:
+        return Response({'error': 'Only admins can access this endpoint'}, 
+                       status=status.HTTP_403_FORBIDDEN)
+    
+    upload = request.FILES.get('file')
+    if upload is None:
+        return Response({'error': 'Upload the CSV as the "file" field'}, 
+                       status=status.HTTP_400_BAD_REQUEST)
+    
+    dry_run = request.query_params.get('dry_run') in ('1', 'true')
+    try:
+        report = import_users(io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline=''), dry_run=dry_run)
+    except UnicodeDecodeError:
+        return Response({'error': 'CSV must be UTF-8 encoded'}, status=status.HTTP_400_BAD_REQUEST)
+    except UserImportError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    if report.created and not dry_run:
+        audit.record_action(request.user, 'import_users', 'user', request.user.pk, request=request, details={
+            'file': upload.name, 'rows': report.rows, 'created': report.created, 'failed': report.failed,
+        })
+    
+    return Response(report.as_dict(), status=status.HTTP_200_OK if dry_run else status.HTTP_201_CREATED)
+
+
 @api_view(['GET', 'PUT', 'DELETE'])
 @permission_classes([IsAuthenticated])
 def manage_single_user(request, user_id):
@@ -73,7 +122,7 @@ def manage_single_user(request, user_id):
                        status=status.HTTP_403_FORBIDDEN)
     
     try:
-        user = User.objects.get(id=user_id)
+        user = User.objects.get(id=user_id, pending_delete=False)
     except User.DoesNotExist:
         return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
     
@@ -89,8 +138,7 @@ def manage_single_user(request, user_id):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     elif request.method == 'DELETE':
-        user.delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return _schedule_deletion(request, user, 'user')
 
 
 @api_view(['GET', 'POST'])
@@ -104,13 +152,11 @@ def manage_departments(request):
                        status=status.HTTP_403_FORBIDDEN)
     
     if request.method == 'GET':
-        depts = Department.objects.all()
-        from users.serializers import DepartmentSerializer
+        depts = Department.objects.filter(pending_delete=False)
         serializer = DepartmentSerializer(depts, many=True)
         return Response(serializer.data)
     
     elif request.method == 'POST':
-        from users.serializers import DepartmentSerializer
         serializer = DepartmentSerializer(data=request.data)
         if serializer.is_valid():
             dept = serializer.save()
@@ -129,17 +175,15 @@ def manage_single_department(request, dept_id):
                        status=status.HTTP_403_FORBIDDEN)
     
     try:
-        dept = Department.objects.get(id=dept_id)
+        dept = Department.objects.get(id=dept_id, pending_delete=False)
     except Department.DoesNotExist:
         return Response({'error': 'Department not found'}, status=status.HTTP_404_NOT_FOUND)
     
     if request.method == 'GET':
-        from users.serializers import DepartmentSerializer
         serializer = DepartmentSerializer(dept)
         return Response(serializer.data)
     
     elif request.method == 'PUT':
-        from users.serializers import DepartmentSerializer
         serializer = DepartmentSerializer(dept, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
@@ -147,5 +191,228 @@ def manage_single_department(request, dept_id):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     elif request.method == 'DELETE':
-        dept.delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+        return _schedule_deletion(request, dept, 'department')
+
+
+def _schedule_deletion(request, obj, resource_type):
+    """
+    Hide `obj` and queue its deletion. Progress is read from
+    deletion-jobs/<id>/ (see users/deletion.py).
+    """
+    job = schedule_deletion(obj, requested_by=request.user)
+    audit.record_action(request.user, f'delete_{resource_type}', resource_type, obj.pk, request=request,
+                        details={'job': job.pk, 'name': str(obj)})
+    return Response(job_status(job), status=status.HTTP_202_ACCEPTED)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def deletion_job(request, job_id):
+    """
+    Progress of a background department or user deletion.
+    """
+    if not request.user.is_admin:
+        return Response({'error': 'Only admins can access this endpoint'}, 
+                       status=status.HTTP_403_FORBIDDEN)
+    
+    try:
+        job = DeletionJob.objects.get(id=job_id)
+    except DeletionJob.DoesNotExist:
+        return Response({'error': 'Deletion job not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    return Response(job_status(job))
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_attendance(request):
+    """
+    Stream attendance as CSV (default) or NDJSON with ?output=ndjson.
+    Filters: department_id, semester_id, section_id, subject_id, date_from, date_to.
+    HODs are limited to their own department.
+    """
+    if not (request.user.is_admin or request.user.is_hod):
+        return Response({'error': 'Only admins and HODs can access this endpoint'}, 
+                       status=status.HTTP_403_FORBIDDEN)
+    
+    export_format = request.query_params.get('output', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return Response({'error': f'output must be one of {sorted(EXPORT_FORMATS)}'}, 
+                       status=status.HTTP_400_BAD_REQUEST)
+    
+    params = request.query_params
+    try:
+        filters = {
+            'department_id': params.get('department_id'),
+            'semester_id': params.get('semester_id'),
+            'section_id': params.get('section_id'),
+            'subject_id': params.get('subject_id'),
+            'date_from': parse_date(params['date_from']) if params.get('date_from') else None,
+            'date_to': parse_date(params['date_to']) if params.get('date_to') else None,
+        }
+    except ValueError:
+        return Response({'error': 'Dates must be in YYYY-MM-DD format'}, 
+                       status=status.HTTP_400_BAD_REQUEST)
+    
+    if request.user.is_hod:
+        if not request.user.department_id:
+            return Response({'error': 'HOD is not assigned to a department'}, 
+                           status=status.HTTP_403_FORBIDDEN)
+        filters['department_id'] = request.user.department_id
+    
+    response = StreamingHttpResponse(
+        iter_export(export_format, iter_attendance_rows(**filters)),
+        content_type=EXPORT_FORMATS[export_format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="attendance.{export_format}"'
+    return response
+
+
+@api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticated])
+def attendance_alerts(request):
+    """
+    Low-attendance alerts for a semester of the HOD's department.
+    GET is a dry run that only reports; POST also notifies the flagged students.
+    Params: semester_id (required), threshold, term_classes.
+    """
+    if not request.user.is_hod:
+        return Response({'error': 'Only HODs can access this endpoint'}, 
+                       status=status.HTTP_403_FORBIDDEN)
+    
+    params = request.query_params if request.method == 'GET' else request.data
+    try:
+        semester = Semester.objects.select_related('department').get(
+            id=params.get('semester_id'), department_id=request.user.department_id
+        )
+    except (Semester.DoesNotExist, ValueError, TypeError):
+        return Response({'error': 'Semester not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    try:
+        threshold = float(params['threshold']) if params.get('threshold') else None
+        term_classes = int(params['term_classes']) if params.get('term_classes') else None
+    except (TypeError, ValueError):
+        return Response({'error': 'threshold and term_classes must be numbers'}, 
+                       status=status.HTTP_400_BAD_REQUEST)
+    
+    report = run_attendance_alerts(
+        semester.department, semester, request.user,
+        threshold=threshold, term_classes=term_classes,
+        dry_run=request.method == 'GET',
+    )
+    if request.method == 'POST' and report:
+        audit.record_action(request.user, 'send_attendance_alerts', 'semester', semester.id, request=request,
+                            details={'flagged_students': len(report)})
+    return Response({'dry_run': request.method == 'GET', 'flagged_students': len(report), 'alerts': report})
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def send_notification(request):
+    """
+    Send a notification to every user of a role ('all' for everyone). Admins
+    may narrow it to a department; an HOD's always goes to their own. It is
+    stored once, whatever the size of its audience.
+    """
+    if not (request.user.is_admin or request.user.is_hod):
+        return Response({'error': 'Only admins and HODs can access this endpoint'}, 
+                       status=status.HTTP_403_FORBIDDEN)
+    
+    serializer = NotificationSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    department = serializer.validated_data.get('department')
+    if request.user.is_hod:
+        if not request.user.department_id:
+            return Response({'error': 'HOD is not assigned to a department'}, 
+                           status=status.HTTP_403_FORBIDDEN)
+        department = Department.objects.get(id=request.user.department_id)
+    
+    notification = send(
+        request.user, serializer.validated_data['title'], serializer.validated_data['message'],
+        serializer.validated_data['recipient_role'], department=department,
+        expires_at=serializer.validated_data.get('expires_at'),
+    )
+    audit.record_action(request.user, 'send_notification', 'notification', notification.id, request=request,
+                        details={'recipient_role': notification.recipient_role, 'department': notification.department_id})
+    return Response(NotificationSerializer(notification).data, status=status.HTTP_201_CREATED)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def notification_deliveries(request, notification_id):
+    """
+    Email delivery of a notification: deliveries by status and the latest
+    failures. Admins see any notification, HODs the ones they sent.
+    """
+    if not (request.user.is_admin or request.user.is_hod):
+        return Response({'error': 'Only admins and HODs can access this endpoint'}, 
+                       status=status.HTTP_403_FORBIDDEN)
+    
+    notifications = Notification.objects.all()
+    if request.user.is_hod:
+        notifications = notifications.filter(sender=request.user)
+    try:
+        notification = notifications.get(id=notification_id)
+    except Notification.DoesNotExist:
+        return Response({'error': 'Notification not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    return Response(delivery_status(notification))
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def performance_metrics(request):
+    """
+    Per-endpoint latency percentiles, query counts and response sizes since
+    each worker started, by view and role, plus the audit pipeline of the
+    worker answering. ?output=prometheus returns the Prometheus text
+    exposition instead of JSON.
+    """
+    if not request.user.is_admin:
+        return Response({'error': 'Only admins can access this endpoint'}, 
+                       status=status.HTTP_403_FORBIDDEN)
+    
+    collected = metrics.recorder.collect()
+    if request.query_params.get('output') == 'prometheus':
+        return HttpResponse(metrics.prometheus_text(collected) + audit.prometheus_text(),
+                            content_type='text/plain; version=0.0.4')
+    return Response({'endpoints': metrics.summarize(collected), 'audit': audit.audit_writer.stats()})
+
+
+def _parse_moment(value):
+    """
+    An aware datetime from an ISO date (midnight UTC) or datetime.
+    """
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        moment = datetime.datetime.combine(day, datetime.time())
+    return timezone.make_aware(moment, datetime.timezone.utc) if timezone.is_naive(moment) else moment
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def audit_logs(request):
+    """
+    Audit logs newest first, one keyset page at a time. Params: from, to
+    (ISO date or datetime; to is exclusive), action, resource_type, user_id,
+    ip_address, cursor, page_size. Only the months in [from, to) are read.
+    """
+    if not request.user.is_admin:
+        return Response({'error': 'Only admins can access this endpoint'}, 
+                       status=status.HTTP_403_FORBIDDEN)
+    
+    params = {key: request.query_params.get(key) for key in ('action', 'resource_type', 'user_id', 'ip_address')}
+    try:
+        params['date_from'] = _parse_moment(request.query_params['from']) if request.query_params.get('from') else None
+        params['date_to'] = _parse_moment(request.query_params['to']) if request.query_params.get('to') else None
+        rows, next_cursor = audit_log_page(
+            params, cursor=request.query_params.get('cursor'), page_size=page_size_param(request),
+        )
+    except (InvalidCursor, ValueError):
+        return Response({'error': 'Invalid cursor, date or filter'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({'results': rows, 'next_cursor': next_cursor})
@@ -0,0 +1,49 @@
+import datetime
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from users.attendance import bulk_mark_attendance
+from users.benchmarking import seed_section
+from users.tokens import ClaimsRefreshToken
+
+# Statements one page of attendance records may take: the token state check
+# (when not cached), the page, and with session storage its students.
+RECORDS_QUERY_BUDGET = 3
+
+
+class AttendanceRecordsQueryBudgetTests(TestCase):
+    def setUp(self):
+        # The first page then pays for the token state check.
+        cache.clear()
+
+    def _client(self):
+        seeded = seed_section(20, prefix='budget')
+        for day in range(5):
+            bulk_mark_attendance(
+                seeded.subject, seeded.section, datetime.date(2024, 1, 1) + datetime.timedelta(days=day),
+                seeded.student_ids[::2], seeded.faculty,
+            )
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {ClaimsRefreshToken.for_user(seeded.faculty).access_token}')
+        return client
+
+    def _assert_within_budget(self, client):
+        cursor = None
+        for _ in range(3):
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get('/api/v1/faculty/attendance/', {'page_size': 30, 'cursor': cursor or ''})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), 30)
+            self.assertLessEqual(len(queries.captured_queries), RECORDS_QUERY_BUDGET)
+            cursor = response.data['next_cursor']
+
+    def test_row_storage(self):
+        self._assert_within_budget(self._client())
+
+    @override_settings(ATTENDANCE_STORAGE='sessions')
+    def test_session_storage(self):
+        self._assert_within_budget(self._client())
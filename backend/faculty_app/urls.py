@@ -5,5 +5,10 @@ urlpatterns = [
     path('dashboard/', views.faculty_dashboard, name='faculty-dashboard'),
     path('students/', views.my_students, name='my-students'),
     path('attendance/mark/', views.mark_attendance, name='mark-attendance'),
+    path('attendance/sync/', views.sync_attendance, name='sync-attendance'),
     path('attendance/', views.get_attendance_records, name='get-attendance-records'),
+    path('attendance/summary/', views.attendance_summary, name='attendance-summary'),
+    path('attendance/trends/', views.attendance_trends, name='attendance-trends'),
+    path('attendance/sessions/', views.attendance_sessions, name='attendance-sessions'),
+    path('attendance/sessions/<int:session_id>/', views.attendance_session_detail, name='attendance-session-detail'),
 ]
\ No newline at end of file
@@ -3,8 +3,18 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 from django.contrib.auth import get_user_model
-from users.models import Department, Semester, Section, Subject, Attendance
-from users.serializers import UserSerializer
+from django.core.exceptions import ValidationError
+from django.utils.dateparse import parse_date
+from users.models import Department, Semester, Section, Subject, Attendance, AttendanceRollup, AttendanceSession
+from users.attendance import (
+    ATTENDANCE_ORDERING, bulk_mark_attendance, can_mark_attendance, faculty_attendance_page, faculty_rollup_rows,
+    session_attendance_rate, RosterError,
+)
+from users.audit import record_action
+from users.attendance_sync import sync_attendance_batch, SyncBatchError
+from users.pagination import InvalidCursor, page_size_param, paginate_keyset
+from users.trends import section_trend
+from users.serializers import UserValuesSerializer
 
 User = get_user_model()
 
@@ -44,12 +54,12 @@ def my_students(request):
         return Response({'error': 'Only faculty members can access this endpoint'}, 
                        status=status.HTTP_403_FORBIDDEN)
     
-    # Get sections assigned to this faculty through subjects
-    sections = Section.objects.filter(subjects__faculty=request.user).distinct()
-    students = User.objects.filter(section__in=sections, role='student')
+    # Students in sections of the semesters whose subjects this faculty teaches
+    students = User.objects.filter(
+        role='student', section__semester__subject__faculty_assigned=request.user, pending_delete=False,
+    ).distinct().order_by('id')
     
-    serializer = UserSerializer(students, many=True)
-    return Response(serializer.data)
+    return Response(UserValuesSerializer(students).data)
 
 
 @api_view(['POST'])
@@ -73,50 +83,83 @@ def mark_attendance(request):
                        status=status.HTTP_400_BAD_REQUEST)
     
     try:
-        from datetime import datetime
-        from django.utils.dateparse import parse_date
-        
-        attendance_date = parse_date(date)
+        attendance_date = parse_date(str(date))
+    except ValueError:
+        attendance_date = None
+    if attendance_date is None:
+        return Response({'error': 'Date must be in YYYY-MM-DD format'}, 
+                       status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
         section = Section.objects.get(id=section_id)
         subject = Subject.objects.get(id=subject_id)
-        
-        # Verify that the faculty teaches this subject in this section
-        if subject.faculty != request.user or subject not in section.subjects.all():
-            return Response({'error': 'You are not authorized to mark attendance for this class'}, 
-                           status=status.HTTP_403_FORBIDDEN)
-        
-        # Get all students in the section
-        students = User.objects.filter(section=section, role='student')
-        
-        # Mark attendance for each student
-        for student in students:
-            is_present = student.id in present_student_ids
-            attendance, created = Attendance.objects.get_or_create(
-                student=student,
-                subject=subject,
-                date=attendance_date,
-                defaults={'is_present': is_present, 'marked_by': request.user}
-            )
-            if not created:
-                attendance.is_present = is_present
-                attendance.marked_by = request.user
-                attendance.save()
-        
-        return Response({'message': f'Attendance marked for {len(students)} students'})
-    
     except Section.DoesNotExist:
         return Response({'error': 'Section not found'}, status=status.HTTP_404_NOT_FOUND)
     except Subject.DoesNotExist:
         return Response({'error': 'Subject not found'}, status=status.HTTP_404_NOT_FOUND)
-    except Exception as e:
+    
+    # Verify that the faculty teaches this subject in this section
+    if not can_mark_attendance(request.user, subject, section):
+        return Response({'error': 'You are not authorized to mark attendance for this class'}, 
+                       status=status.HTTP_403_FORBIDDEN)
+    
+    try:
+        result = bulk_mark_attendance(subject, section, attendance_date, present_student_ids, request.user)
+    except RosterError as e:
+        return Response({'error': str(e), 'unknown_student_ids': e.unknown_ids}, 
+                       status=status.HTTP_400_BAD_REQUEST)
+    except (TypeError, ValueError):
+        return Response({'error': 'present_student_ids must be a list of student ids'}, 
+                       status=status.HTTP_400_BAD_REQUEST)
+    
+    if result.changes:
+        record_action(request.user, 'mark_attendance', 'subject', subject.id, request=request, details={
+            'section_id': section.id, 'date': attendance_date,
+            'created': result.created, 'updated': result.updated,
+        })
+    
+    return Response({
+        'message': f'Attendance marked for {result.roster_size} students',
+        'created': result.created,
+        'updated': result.updated,
+        'unchanged': result.unchanged,
+        'changes': [diff.as_dict() for diff in result.changes],
+    })
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def sync_attendance(request):
+    """
+    Apply a batch of attendance sessions captured offline. Each session carries
+    an idempotency_key; resending a key already applied replays its stored
+    result instead of marking attendance again.
+    """
+    if not request.user.is_faculty:
+        return Response({'error': 'Only faculty members can access this endpoint'}, 
+                       status=status.HTTP_403_FORBIDDEN)
+    
+    # Expected data: { 'sessions': [{ 'idempotency_key': str, 'date': 'YYYY-MM-DD', 'section_id': id,
+    #                                 'subject_id': id, 'present_student_ids': [1, 2, 3] }, ...] }
+    try:
+        results = sync_attendance_batch(request.user, request.data.get('sessions'))
+    except SyncBatchError as e:
         return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    applied = [result['idempotency_key'] for result in results if result['status'] == 'applied']
+    if applied:
+        record_action(request.user, 'sync_attendance', 'user', request.user.pk, request=request,
+                      details={'applied': applied})
+    
+    return Response({'results': results})
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_attendance_records(request):
     """
-    Get attendance records for faculty's subjects
+    Get attendance records for faculty's subjects, one keyset page at a time.
+    Pass the returned next_cursor back as ?cursor= to fetch the next page.
     """
     if not request.user.is_faculty:
         return Response({'error': 'Only faculty members can access this endpoint'}, 
@@ -127,30 +170,189 @@ def get_attendance_records(request):
     date_from = request.query_params.get('date_from')
     date_to = request.query_params.get('date_to')
     
-    attendances = Attendance.objects.filter(subject__faculty=request.user)
+    try:
+        attendances, next_cursor = faculty_attendance_page(
+            request.user,
+            subject_id=subject_id,
+            section_id=section_id,
+            date_from=parse_date(date_from) if date_from else None,
+            date_to=parse_date(date_to) if date_to else None,
+            cursor=request.query_params.get('cursor'),
+            page_size=page_size_param(request),
+        )
+    except (InvalidCursor, ValidationError, ValueError):
+        return Response({'error': 'Invalid cursor or filter'}, status=status.HTTP_400_BAD_REQUEST)
     
-    if subject_id:
-        attendances = attendances.filter(subject_id=subject_id)
-    if section_id:
-        attendances = attendances.filter(student__section_id=section_id)
-    if date_from:
-        from django.utils.dateparse import parse_date
-        attendances = attendances.filter(date__gte=parse_date(date_from))
-    if date_to:
-        from django.utils.dateparse import parse_date
-        attendances = attendances.filter(date__lte=parse_date(date_to))
-    
-    # This would typically return aggregated data
     attendance_data = []
-    for attendance in attendances[:50]:  # Limit for performance
+    for attendance in attendances:
         attendance_data.append({
             'id': attendance.id,
-            'student': attendance.student.username,
-            'student_name': attendance.student.get_full_name(),
+            'student': attendance.student.username if attendance.student else None,
+            'student_name': attendance.student.get_full_name() if attendance.student else None,
             'subject': attendance.subject.name,
             'date': attendance.date,
             'is_present': attendance.is_present,
-            'marked_by': attendance.marked_by.username
+            'marked_by': attendance.marked_by.username if attendance.marked_by else None
+        })
+    
+    return Response({'results': attendance_data, 'next_cursor': next_cursor})
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def attendance_summary(request):
+    """
+    Per-student attendance percentages for the faculty's subjects, read from
+    the attendance rollup (one row per student and subject)
+    """
+    if not request.user.is_faculty:
+        return Response({'error': 'Only faculty members can access this endpoint'}, 
+                       status=status.HTTP_403_FORBIDDEN)
+    
+    subject_id = request.query_params.get('subject_id')
+    section_id = request.query_params.get('section_id')
+    
+    rows = faculty_rollup_rows(request.user, subject_id=subject_id, section_id=section_id)
+    
+    summary_data = []
+    for row in rows:
+        total = row['total']
+        summary_data.append({
+            'subject_id': row['subject_id'],
+            'subject': row['subject__name'],
+            'student_id': row['student_id'],
+            'student': row['student__username'],
+            'student_name': f"{row['student__first_name']} {row['student__last_name']}".strip(),
+            'total_classes': total,
+            'present_classes': row['present'],
+            'attendance_percentage': round(row['present'] / total * 100, 2) if total else 0,
+            'last_date': row['last_date'],
         })
     
-    return Response(attendance_data)
\ No newline at end of file
+    return Response(summary_data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def attendance_sessions(request):
+    """
+    Stored attendance sessions for the faculty's subjects, newest first, with
+    presence counted from the session bitmaps. The sessions are paginated;
+    pass the returned next_cursor back as ?cursor= to fetch the next page.
+    The totals cover every matching session.
+    """
+    if not request.user.is_faculty:
+        return Response({'error': 'Only faculty members can access this endpoint'}, 
+                       status=status.HTTP_403_FORBIDDEN)
+    
+    sessions = AttendanceSession.objects.filter(subject__faculty_assigned=request.user)
+    
+    subject_id = request.query_params.get('subject_id')
+    section_id = request.query_params.get('section_id')
+    if subject_id:
+        sessions = sessions.filter(subject_id=subject_id)
+    if section_id:
+        sessions = sessions.filter(section_id=section_id)
+    
+    try:
+        page, next_cursor = paginate_keyset(
+            sessions.select_related('subject', 'section'), ATTENDANCE_ORDERING,
+            cursor=request.query_params.get('cursor'),
+            page_size=page_size_param(request),
+        )
+    except (InvalidCursor, ValidationError, ValueError):
+        return Response({'error': 'Invalid cursor or filter'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    present, total = session_attendance_rate(sessions)
+    
+    session_data = []
+    for session in page:
+        session_data.append({
+            'id': session.id,
+            'subject': session.subject.name,
+            'section': session.section.name,
+            'date': session.date,
+            'roster_size': session.roster_size,
+            'present_count': session.present_count,
+            'attendance_percentage': session.percentage,
+        })
+    
+    return Response({
+        'sessions': session_data,
+        'next_cursor': next_cursor,
+        'present_marks': present,
+        'total_marks': total,
+        'attendance_percentage': round(present / total * 100, 2) if total else 0,
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def attendance_session_detail(request, session_id):
+    """
+    Per-student view of one stored attendance session
+    """
+    if not request.user.is_faculty:
+        return Response({'error': 'Only faculty members can access this endpoint'}, 
+                       status=status.HTTP_403_FORBIDDEN)
+    
+    try:
+        session = AttendanceSession.objects.select_related('subject', 'section').get(
+            id=session_id, subject__faculty_assigned=request.user
+        )
+    except AttendanceSession.DoesNotExist:
+        return Response({'error': 'Session not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    view = session.student_view()
+    students = User.objects.in_bulk(list(view))
+    
+    return Response({
+        'id': session.id,
+        'subject': session.subject.name,
+        'section': session.section.name,
+        'date': session.date,
+        'present_count': session.present_count,
+        'roster_size': session.roster_size,
+        'students': [
+            {
+                'student_id': student_id,
+                'student': students[student_id].username if student_id in students else None,
+                'is_present': is_present,
+            }
+            for student_id, is_present in view.items()
+        ],
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def attendance_trends(request):
+    """
+    Attendance trend for the faculty's subjects from the precomputed buckets.
+    Params: granularity (day|month), subject_id, section_id, date_from, date_to.
+    """
+    if not request.user.is_faculty:
+        return Response({'error': 'Only faculty members can access this endpoint'}, 
+                       status=status.HTTP_403_FORBIDDEN)
+    
+    granularity = request.query_params.get('granularity', 'day')
+    if granularity not in ('day', 'month'):
+        return Response({'error': 'granularity must be day or month'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    subjects = Subject.objects.filter(faculty_assigned=request.user)
+    subject_id = request.query_params.get('subject_id')
+    if subject_id:
+        subjects = subjects.filter(id=subject_id)
+    
+    try:
+        date_from = parse_date(request.query_params.get('date_from') or '')
+        date_to = parse_date(request.query_params.get('date_to') or '')
+    except ValueError:
+        return Response({'error': 'Dates must be in YYYY-MM-DD format'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    series = section_trend(
+        subjects, granularity=granularity,
+        section_id=request.query_params.get('section_id'),
+        date_from=date_from, date_to=date_to,
+    )
+    return Response({'granularity': granularity, 'series': series})
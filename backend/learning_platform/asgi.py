@@ -13,4 +13,12 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'learning_platform.settings')
 
-application = get_asgi_application()
\ No newline at end of file
+application = get_asgi_application()
+
+from users.blacklist import jti_blacklist  # noqa: E402
+from users.streams import route  # noqa: E402
+
+# Serves the notification event stream; everything else goes to Django.
+application = route(application)
+
+jti_blacklist.warm()
\ No newline at end of file
@@ -5,6 +5,7 @@ Generated by 'django-admin startproject' using Django 4.2.
 """
 
 import os
+import tempfile
 from pathlib import Path
 from datetime import timedelta
 
@@ -35,6 +36,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'rest_framework',
     'rest_framework_simplejwt',
+    'rest_framework_simplejwt.token_blacklist',
     'corsheaders',
     'users',
     'admin_app',
@@ -43,12 +45,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'users.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'users.audit.AuditContextMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -137,10 +141,121 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Custom User Model
 AUTH_USER_MODEL = 'users.User'
 
+# Attendance storage: 'rows' keeps one Attendance row per student per class,
+# 'sessions' keeps one AttendanceSession (roster + presence bitmap) per class.
+ATTENDANCE_STORAGE = 'rows'
+
+# Students below this attendance percentage in any subject get an alert.
+ATTENDANCE_ALERT_THRESHOLD = 75
+
+# Seconds a user's token state and full User row are cached for
+# claims-based authentication (see users/claims.py).
+CLAIMS_USER_CACHE_TTL = 60
+
+# Refresh-token blacklist filter (see users/blacklist.py): how often each
+# process picks up tokens blacklisted elsewhere, the filter's target
+# false positive rate, and how long an id skipped by a sync is looked for
+# again in case its transaction commits late.
+JTI_BLACKLIST_SYNC_INTERVAL = 2
+JTI_BLACKLIST_ERROR_RATE = 0.001
+JTI_BLACKLIST_GAP_TIMEOUT = 60
+
+# Login password hashing (see users/login.py): pool threads and queued
+# attempts before logins get 503, seconds a login waits for its hash, and
+# attempts allowed in flight per username and per client IP. Set
+# LOGIN_HASH_WORKERS = 0 to hash on the request thread.
+LOGIN_HASH_WORKERS = 2
+LOGIN_HASH_QUEUE = 16
+LOGIN_HASH_TIMEOUT = 10
+LOGIN_MAX_CONCURRENT_PER_USERNAME = 2
+LOGIN_MAX_CONCURRENT_PER_IP = 20
+
+# Processes hashing passwords during bulk user import; None uses every CPU.
+USER_IMPORT_HASH_WORKERS = None
+
+# Seconds the admin/HOD dashboard counters are cached before a recount.
+DASHBOARD_STATS_TTL = 300
+
+# Request metrics (see users/metrics.py): directory where each process
+# writes its totals for the metrics endpoint to merge, seconds between
+# writes, and seconds before the file of an exited process is dropped.
+METRICS_DIR = os.path.join(tempfile.gettempdir(), 'learning_platform-metrics')
+METRICS_FLUSH_INTERVAL = 5
+METRICS_RETENTION = 24 * 60 * 60
+
+# Audit logging (see users/audit.py): entries per bulk insert, seconds an
+# entry may wait for its batch, queue capacity, and seconds to drain the
+# queue at exit. A write slower than AUDIT_SLOW_WRITE seconds, or a failed
+# one, sends entries to spill files in AUDIT_SPILL_DIR for
+# AUDIT_SPILL_BACKOFF seconds. Spill files of processes that stopped writing
+# them AUDIT_SPILL_ORPHAN_AGE seconds ago are replayed by any worker.
+# AUDIT_ASYNC = False writes each entry on commit instead.
+AUDIT_ASYNC = True
+AUDIT_BATCH_SIZE = 200
+AUDIT_FLUSH_INTERVAL = 1.0
+AUDIT_QUEUE_SIZE = 10000
+AUDIT_DRAIN_TIMEOUT = 10
+AUDIT_SLOW_WRITE = 0.5
+AUDIT_SPILL_BACKOFF = 30
+AUDIT_SPILL_DIR = BASE_DIR / 'audit_spill'
+AUDIT_SPILL_ORPHAN_AGE = 600
+
+# Month-partitioned audit log tables (see users/audit_partitions.py):
+# months kept before a month table is dropped, where dropped months are
+# archived as gzipped JSON lines (None drops them without an archive), and
+# PostgreSQL partitions created ahead of time.
+AUDIT_RETENTION_MONTHS = 24
+AUDIT_ARCHIVE_DIR = BASE_DIR / 'audit_archive'
+AUDIT_PARTITIONS_AHEAD = 3
+
+# Background deletion of departments and users (see users/deletion.py):
+# rows removed per transaction, an optional pause between chunks to let
+# other writers in, seconds without a heartbeat before a running job is
+# taken over, seconds an idle worker thread waits before exiting, and
+# attempts before a failing job gives up, with the first retry delay
+# (doubled per attempt). DELETION_ASYNC = False runs the job on commit, in
+# the request.
+DELETION_ASYNC = True
+DELETION_CHUNK_SIZE = 500
+DELETION_CHUNK_PAUSE = 0
+DELETION_STALE_AFTER = 300
+DELETION_IDLE_TIMEOUT = 60
+DELETION_MAX_ATTEMPTS = 5
+DELETION_RETRY_DELAY = 60
+
+# Notification read receipts (see users/notifications.py): notices read one
+# at a time past a user's high-water mark are kept as exceptions; beyond
+# this many, the mark is moved up and the exceptions it covers dropped.
+NOTIFICATION_READ_EXCEPTIONS = 64
+# Seconds the unread counters (audience totals and per-user read counts)
+# stay in the cache before they are read from the database again.
+NOTIFICATION_COUNTER_TTL = 300
+# Expired notification sweep (see users/expiry.py): notifications deleted
+# per transaction, pause between batches, seconds before a sweep stops for
+# the next run to carry on, and where swept notifications are archived as
+# gzipped JSON lines (None deletes them without an archive).
+NOTIFICATION_SWEEP_BATCH_SIZE = 500
+NOTIFICATION_SWEEP_PAUSE = 0.05
+NOTIFICATION_SWEEP_MAX_SECONDS = 300
+NOTIFICATION_ARCHIVE_DIR = BASE_DIR / 'notification_archive'
+
+# Notification push over Server-Sent Events (see users/push.py and
+# users/streams.py; served by the ASGI application only). FileBackend
+# carries events between worker processes through PUSH_DIR;
+# 'users.push.LocalBackend' is enough for a single ASGI process.
+PUSH_PATH = '/api/v1/notifications/stream/'
+PUSH_BACKEND = 'users.push.FileBackend'
+PUSH_DIR = os.path.join(tempfile.gettempdir(), 'learning_platform-push')
+PUSH_POLL_INTERVAL = 0.25
+PUSH_RETENTION = 3600
+PUSH_KEEPALIVE = 15
+PUSH_QUEUE_SIZE = 100
+PUSH_REPLAY_LIMIT = 100
+
 # REST Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.ClaimsJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -167,4 +282,21 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 # Email settings (for notifications)
-EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
\ No newline at end of file
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+
+# Notification email delivery (see users/email_delivery.py): whether
+# notifications are mailed at all, recipients resolved per transaction,
+# deliveries claimed per batch, messages per second per worker (0 for no
+# limit), attempts before a delivery fails and the first retry delay
+# (doubled per attempt), seconds before a claimed delivery of a stopped
+# worker is released, and seconds an idle worker thread waits before
+# exiting. EMAIL_DELIVERY_ASYNC = False sends on commit, in the request.
+NOTIFICATION_EMAIL = True
+EMAIL_DELIVERY_ASYNC = True
+EMAIL_DELIVERY_RESOLVE_CHUNK = 1000
+EMAIL_DELIVERY_BATCH_SIZE = 100
+EMAIL_DELIVERY_RATE = 0
+EMAIL_DELIVERY_MAX_ATTEMPTS = 5
+EMAIL_DELIVERY_RETRY_DELAY = 60
+EMAIL_DELIVERY_STALE_AFTER = 600
+EMAIL_DELIVERY_IDLE_TIMEOUT = 60
@@ -13,4 +13,8 @@ from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'learning_platform.settings')
 
-application = get_wsgi_application()
\ No newline at end of file
+application = get_wsgi_application()
+
+from users.blacklist import jti_blacklist  # noqa: E402
+
+jti_blacklist.warm()
\ No newline at end of file
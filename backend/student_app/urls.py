@@ -4,7 +4,9 @@ from . import views
 urlpatterns = [
     path('dashboard/', views.student_dashboard, name='student-dashboard'),
     path('attendance/', views.my_attendance, name='my-attendance'),
+    path('attendance/trends/', views.my_attendance_trends, name='my-attendance-trends'),
     path('subjects/', views.my_subjects, name='my-subjects'),
     path('notifications/', views.my_notifications, name='my-notifications'),
+    path('notifications/read/', views.mark_all_notifications_as_read, name='mark-all-notifications-read'),
     path('notifications/<int:notification_id>/read/', views.mark_notification_as_read, name='mark-notification-read'),
 ]
\ No newline at end of file
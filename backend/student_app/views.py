@@ -3,7 +3,13 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 from django.contrib.auth import get_user_model
-from users.models import Department, Semester, Section, Subject, Attendance, Notification
+from django.db.models import Sum
+from django.utils.dateparse import parse_date
+from users.models import Department, Semester, Section, Subject, Attendance, AttendanceRollup
+from users.notifications import inbox_page, mark_all_read, mark_read
+from users.pagination import InvalidCursor, page_size_param
+from users.attendance import student_attendance, student_rollups
+from users.trends import student_trend
 from users.serializers import UserSerializer
 
 User = get_user_model()
@@ -21,14 +27,15 @@ def student_dashboard(request):
     
     # Get student-specific data
     student_section = request.user.section
-    student_subjects = Subject.objects.filter(semesters=student_section.semester) if student_section else []
+    student_semester = student_section.semester if student_section else None
+    student_subjects = Subject.objects.filter(semester=student_semester) if student_semester else Subject.objects.none()
     
     data = {
         'student_name': request.user.get_full_name(),
         'department': request.user.department.name if request.user.department else None,
-        'semester': student_section.semester.name if student_section else None,
+        'semester': student_semester.number if student_semester else None,
         'section': student_section.name if student_section else None,
-        'enrolled_subjects': len(student_subjects),
+        'enrolled_subjects': student_subjects.count(),
         'message': f'Welcome, {request.user.username}!'
     }
     
@@ -47,14 +54,13 @@ def my_attendance(request):
     
     subject_id = request.query_params.get('subject_id')
     
-    attendances = Attendance.objects.filter(student=request.user)
+    attendances = student_attendance(request.user, subject_id)
+    rollups = student_rollups(request.user, subject_id)
     
-    if subject_id:
-        attendances = attendances.filter(subject_id=subject_id)
-    
-    # Calculate attendance percentage
-    total_classes = attendances.count()
-    present_classes = attendances.filter(is_present=True).count()
+    # Totals come from the per-subject rollup rows, not from counting raw rows
+    totals = rollups.aggregate(total=Sum('total'), present=Sum('present'))
+    total_classes = totals['total'] or 0
+    present_classes = totals['present'] or 0
     attendance_percentage = (present_classes / total_classes * 100) if total_classes > 0 else 0
     
     attendance_data = []
@@ -64,7 +70,7 @@ def my_attendance(request):
             'subject': attendance.subject.name,
             'date': attendance.date,
             'is_present': attendance.is_present,
-            'marked_by': attendance.marked_by.username
+            'marked_by': attendance.marked_by.username if attendance.marked_by else None
         })
     
     response_data = {
@@ -93,59 +99,72 @@ def my_subjects(request):
         return Response({'error': 'Student is not assigned to a section'}, 
                        status=status.HTTP_400_BAD_REQUEST)
     
-    subjects = Subject.objects.filter(semesters=student_section.semester)
+    subjects = Subject.objects.filter(semester_id=student_section.semester_id).select_related('faculty_assigned')
+    rollups = {
+        rollup.subject_id: rollup
+        for rollup in student_rollups(request.user).filter(subject__in=subjects)
+    }
     
     subject_data = []
     for subject in subjects:
-        # Calculate attendance for each subject
-        subject_attendance = Attendance.objects.filter(
-            student=request.user,
-            subject=subject
-        )
-        total_classes = subject_attendance.count()
-        present_classes = subject_attendance.filter(is_present=True).count()
-        attendance_percentage = (present_classes / total_classes * 100) if total_classes > 0 else 0
+        rollup = rollups.get(subject.id) or AttendanceRollup(student=request.user, subject=subject)
         
         subject_data.append({
             'id': subject.id,
             'name': subject.name,
             'code': subject.code,
-            'faculty': subject.faculty.get_full_name() if subject.faculty else None,
-            'total_classes': total_classes,
-            'present_classes': present_classes,
-            'attendance_percentage': round(attendance_percentage, 2)
+            'faculty': subject.faculty_assigned.get_full_name() if subject.faculty_assigned else None,
+            'total_classes': rollup.total,
+            'present_classes': rollup.present,
+            'attendance_percentage': rollup.percentage
         })
     
     return Response(subject_data)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def my_attendance_trends(request):
+    """
+    Monthly attendance trend for the logged-in student
+    """
+    if not request.user.is_student:
+        return Response({'error': 'Only students can access this endpoint'}, 
+                       status=status.HTTP_403_FORBIDDEN)
+    
+    try:
+        date_from = parse_date(request.query_params.get('date_from') or '')
+        date_to = parse_date(request.query_params.get('date_to') or '')
+    except ValueError:
+        return Response({'error': 'Dates must be in YYYY-MM-DD format'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    series = student_trend(
+        request.user,
+        subject_id=request.query_params.get('subject_id'),
+        date_from=date_from, date_to=date_to,
+    )
+    return Response({'granularity': 'month', 'series': series})
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def my_notifications(request):
     """
-    Get notifications for the logged-in student
+    Get notifications for the logged-in student, newest first, one keyset
+    page at a time.
     """
     if not request.user.is_student:
         return Response({'error': 'Only students can access this endpoint'}, 
                        status=status.HTTP_403_FORBIDDEN)
     
-    notifications = Notification.objects.filter(
-        recipient=request.user
-    ).order_by('-created_at')
-    
-    notification_data = []
-    for notification in notifications:
-        notification_data.append({
-            'id': notification.id,
-            'title': notification.title,
-            'message': notification.message,
-            'notification_type': notification.notification_type,
-            'is_read': notification.is_read,
-            'created_at': notification.created_at,
-            'sender': notification.sender.get_full_name() if notification.sender else None
-        })
+    try:
+        notifications, next_cursor = inbox_page(
+            request.user, cursor=request.query_params.get('cursor'), page_size=page_size_param(request),
+        )
+    except InvalidCursor:
+        return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
     
-    return Response(notification_data)
+    return Response({'results': notifications, 'next_cursor': next_cursor})
 
 
 @api_view(['POST'])
@@ -158,10 +177,20 @@ def mark_notification_as_read(request, notification_id):
         return Response({'error': 'Only students can access this endpoint'}, 
                        status=status.HTTP_403_FORBIDDEN)
     
-    try:
-        notification = Notification.objects.get(id=notification_id, recipient=request.user)
-        notification.is_read = True
-        notification.save()
-        return Response({'message': 'Notification marked as read'})
-    except Notification.DoesNotExist:
-        return Response({'error': 'Notification not found'}, status=status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+    if not mark_read(request.user, [notification_id]):
+        return Response({'error': 'Notification not found'}, status=status.HTTP_404_NOT_FOUND)
+    return Response({'message': 'Notification marked as read'})
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def mark_all_notifications_as_read(request):
+    """
+    Mark every notification in the student's inbox as read
+    """
+    if not request.user.is_student:
+        return Response({'error': 'Only students can access this endpoint'}, 
+                       status=status.HTTP_403_FORBIDDEN)
+    
+    mark_all_read(request.user)
+    return Response({'message': 'All notifications marked as read'})
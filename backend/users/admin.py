@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.forms import UserCreationForm, UserChangeForm
-from .models import User, Department, Semester, Section, Subject, Notification, AuditLog, Attendance
+from .models import User, Department, Semester, Section, Subject, Notification, AuditLog, Attendance, AttendanceRollup, AttendanceSession, DeletionJob, EmailDelivery
 
 
 class CustomUserCreationForm(UserCreationForm):
@@ -74,8 +74,8 @@ class SubjectAdmin(admin.ModelAdmin):
 
 @admin.register(Notification)
 class NotificationAdmin(admin.ModelAdmin):
-    list_display = ('title', 'sender', 'recipient_role', 'department', 'is_read', 'sent_at')
-    list_filter = ('recipient_role', 'department', 'is_read', 'sent_at')
+    list_display = ('title', 'sender', 'recipient_role', 'department', 'recipient', 'sent_at')
+    list_filter = ('recipient_role', 'department', 'sent_at')
     search_fields = ('title', 'message')
     ordering = ('-sent_at',)
 
@@ -86,6 +86,10 @@ class AuditLogAdmin(admin.ModelAdmin):
     list_filter = ('action', 'resource_type', 'timestamp', 'ip_address')
     search_fields = ('user__username', 'action', 'resource_type', 'resource_id')
     ordering = ('-timestamp',)
+    # No COUNT(*) over the whole table on every page. On SQLite this table
+    # only holds the current month; older months are in month tables read
+    # through the admin audit endpoint (see users/audit_partitions.py).
+    show_full_result_count = False
 
 
 @admin.register(Attendance)
@@ -96,5 +100,38 @@ class AttendanceAdmin(admin.ModelAdmin):
     ordering = ('-date',)
 
 
+@admin.register(AttendanceRollup)
+class AttendanceRollupAdmin(admin.ModelAdmin):
+    list_display = ('student', 'subject', 'total', 'present', 'last_date', 'updated_at')
+    list_filter = ('subject',)
+    search_fields = ('student__username', 'subject__name')
+    ordering = ('student', 'subject')
+
+
+@admin.register(AttendanceSession)
+class AttendanceSessionAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'section', 'date', 'roster_size', 'present_count', 'marked_by', 'marked_at')
+    list_filter = ('date', 'subject')
+    exclude = ('roster', 'presence')
+    ordering = ('-date',)
+
+
+@admin.register(DeletionJob)
+class DeletionJobAdmin(admin.ModelAdmin):
+    list_display = ('model', 'object_repr', 'status', 'rows_done', 'total_rows', 'requested_by', 'created_at', 'finished_at')
+    list_filter = ('status', 'model')
+    search_fields = ('object_repr',)
+    ordering = ('-created_at',)
+
+
+@admin.register(EmailDelivery)
+class EmailDeliveryAdmin(admin.ModelAdmin):
+    list_display = ('notification', 'email', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('email',)
+    raw_id_fields = ('notification', 'recipient')
+    ordering = ('-created_at',)
+
+
 # Register the custom User model with the custom admin
 admin.site.register(User, CustomUserAdmin)
\ No newline at end of file
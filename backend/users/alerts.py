@@ -0,0 +1,181 @@
+"""
+Low-attendance alert engine.
+
+Attendance for a whole department semester is loaded into dense
+(students x subjects) NumPy arrays and every percentage, projection and
+threshold test is computed in one vectorized pass, instead of a Python loop
+per student.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from . import email_delivery, push
+from .models import User, Subject, Attendance, AttendanceRollup, Notification
+from .notifications import count_sent, notification_event
+
+
+@dataclass
+class AttendanceMatrix:
+    student_ids: np.ndarray  # (S,)
+    subject_ids: np.ndarray  # (J,)
+    total: np.ndarray        # (S, J) classes held
+    present: np.ndarray      # (S, J) classes attended
+
+
+@dataclass
+class AlertResult:
+    percentage: np.ndarray      # (S, J) current attendance %
+    max_achievable: np.ndarray  # (S, J) % if every remaining class is attended
+    below: np.ndarray           # (S, J) currently under threshold
+    ineligible: np.ndarray      # (S, J) cannot reach threshold by end of term
+
+
+def _index(ids, values):
+    return np.searchsorted(ids, values)
+
+
+def load_attendance_matrix(department, semester, source='rollup'):
+    """
+    Build the attendance matrix for students in sections of `semester` and
+    the department's subjects in that semester.
+
+    source='rollup' reads one AttendanceRollup row per student and subject;
+    source='raw' reads (student, subject, is_present) for every Attendance row
+    and accumulates with np.add.at, for use when the rollup is being rebuilt.
+    """
+    student_ids = np.fromiter(
+        User.objects.filter(role='student', section__semester=semester, pending_delete=False)
+        .order_by('id').values_list('id', flat=True),
+        dtype=np.int64,
+    )
+    subject_ids = np.fromiter(
+        Subject.objects.filter(department=department, semester=semester)
+        .order_by('id').values_list('id', flat=True),
+        dtype=np.int64,
+    )
+    # The data queries below select the same students, so every student id
+    # they return has a row here.
+    shape = (len(student_ids), len(subject_ids))
+    total = np.zeros(shape, dtype=np.int32)
+    present = np.zeros(shape, dtype=np.int32)
+
+    if source == 'raw':
+        rows = Attendance.objects.filter(
+            subject_id__in=subject_ids.tolist(), student__section__semester=semester,
+            student__role='student', student__pending_delete=False,
+        ).order_by().values_list('student_id', 'subject_id', 'is_present')
+        data = np.array(list(rows.iterator(chunk_size=20000)), dtype=np.int64).reshape(-1, 3)
+        if len(data):
+            si, ji = _index(student_ids, data[:, 0]), _index(subject_ids, data[:, 1])
+            np.add.at(total, (si, ji), 1)
+            np.add.at(present, (si, ji), data[:, 2].astype(np.int32))
+    else:
+        rows = AttendanceRollup.objects.filter(
+            subject_id__in=subject_ids.tolist(), student__section__semester=semester,
+            student__role='student', student__pending_delete=False,
+        ).values_list('student_id', 'subject_id', 'total', 'present')
+        data = np.array(list(rows), dtype=np.int64).reshape(-1, 4)
+        if len(data):
+            si, ji = _index(student_ids, data[:, 0]), _index(subject_ids, data[:, 1])
+            total[si, ji] = data[:, 2]
+            present[si, ji] = data[:, 3]
+
+    return AttendanceMatrix(student_ids, subject_ids, total, present)
+
+
+def compute_alerts(total, present, term_classes=None, threshold=None):
+    """
+    Vectorized percentages and end-of-term projection.
+
+    `term_classes` is the number of classes planned per subject for the term
+    (scalar or (J,) array); when omitted the classes held so far are taken as
+    the whole term. A student is ineligible in a subject when even attending
+    every remaining class would leave them below `threshold`.
+    """
+    threshold = settings.ATTENDANCE_ALERT_THRESHOLD if threshold is None else threshold
+    total = np.asarray(total, dtype=np.float64)
+    present = np.asarray(present, dtype=np.float64)
+
+    if term_classes is None:
+        planned = total.max(axis=0, initial=0)
+    else:
+        planned = np.broadcast_to(np.asarray(term_classes, dtype=np.float64), total.shape[1:])
+    planned = np.maximum(planned[np.newaxis, :], total)
+    remaining = planned - total
+
+    percentage = np.divide(present * 100, total, out=np.zeros_like(total), where=total > 0)
+    max_achievable = np.divide((present + remaining) * 100, planned, out=np.full_like(total, 100.0), where=planned > 0)
+
+    return AlertResult(
+        percentage=percentage,
+        max_achievable=max_achievable,
+        below=(total > 0) & (percentage < threshold),
+        ineligible=max_achievable < threshold,
+    )
+
+
+def alert_report(matrix, result, subject_names=None):
+    """
+    One entry per student with at least one subject below threshold.
+    """
+    subject_names = subject_names or {}
+    report = []
+    flagged = np.flatnonzero(result.below.any(axis=1))
+    for row in flagged:
+        columns = np.flatnonzero(result.below[row])
+        report.append({
+            'student_id': int(matrix.student_ids[row]),
+            'subjects': [
+                {
+                    'subject_id': int(matrix.subject_ids[col]),
+                    'subject': subject_names.get(int(matrix.subject_ids[col])),
+                    'attendance_percentage': round(float(result.percentage[row, col]), 2),
+                    'max_achievable': round(float(result.max_achievable[row, col]), 2),
+                    'eligible': not bool(result.ineligible[row, col]),
+                }
+                for col in columns
+            ],
+        })
+    return report
+
+
+def run_attendance_alerts(department, semester, sender, threshold=None, term_classes=None,
+                          dry_run=False, source='rollup'):
+    """
+    Compute alerts for a department semester and, unless `dry_run`, create one
+    Notification per flagged student with a single bulk insert.
+    """
+    threshold = settings.ATTENDANCE_ALERT_THRESHOLD if threshold is None else threshold
+    matrix = load_attendance_matrix(department, semester, source=source)
+    result = compute_alerts(matrix.total, matrix.present, term_classes=term_classes, threshold=threshold)
+    subject_names = dict(Subject.objects.filter(id__in=matrix.subject_ids.tolist()).values_list('id', 'name'))
+    report = alert_report(matrix, result, subject_names)
+
+    if not dry_run and report:
+        notifications = []
+        for entry in report:
+            lines = [
+                f"{subject['subject']}: {subject['attendance_percentage']}%"
+                + ('' if subject['eligible'] else ' (cannot reach the minimum this term)')
+                for subject in entry['subjects']
+            ]
+            notifications.append(Notification(
+                title='Low attendance warning',
+                message=f'Your attendance is below {threshold}% in:\n' + '\n'.join(lines),
+                sender=sender,
+                recipient_role='student',
+                department=department,
+                recipient_id=entry['student_id'],
+            ))
+        with transaction.atomic():
+            Notification.objects.bulk_create(notifications, batch_size=1000)
+            # bulk_create sends no post_save.
+            count_sent(notifications)
+            for notification in notifications:
+                push.publish(notification_event(notification))
+            email_delivery.queue(notifications)
+
+    return report
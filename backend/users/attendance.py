@@ -0,0 +1,523 @@
+"""
+Bulk attendance write path.
+
+A class session is written with a fixed number of statements (roster read,
+existing-row read, chunked upsert) instead of one get_or_create/save pair per
+student. The same transaction keeps the AttendanceRollup totals and the
+trend buckets (SectionAttendanceBucket, StudentMonthlyAttendance) current.
+
+With settings.ATTENDANCE_STORAGE = 'sessions' a class is stored as a single
+AttendanceSession row instead, and the read helpers at the bottom of this
+module expand sessions into Attendance-like records for the views.
+"""
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .bitsets import popcount, unpack_bits, unpack_ids
+from .models import (
+    User, Attendance, AttendanceRollup, AttendanceSession,
+    SectionAttendanceBucket, StudentMonthlyAttendance,
+)
+from .pagination import decode_cursor, encode_cursor, keyset_after, paginate_keyset
+
+
+class RosterError(ValueError):
+    """
+    Raised when the submitted student ids do not belong to the section roster.
+    """
+    def __init__(self, unknown_ids):
+        self.unknown_ids = sorted(unknown_ids)
+        super().__init__(f"Students not in section roster: {self.unknown_ids}")
+
+
+@dataclass(frozen=True)
+class AttendanceDiff:
+    """
+    Change applied to one student's attendance for a session.
+    `previous` is None when the row did not exist before.
+    """
+    student_id: int
+    previous: Optional[bool]
+    current: bool
+
+    @property
+    def created(self):
+        return self.previous is None
+
+    @property
+    def changed(self):
+        return self.previous != self.current
+
+    @property
+    def delta(self):
+        """
+        (total, present) change this diff makes to the student's rollup.
+        """
+        if self.created:
+            return 1, int(self.current)
+        if self.changed:
+            return 0, 1 if self.current else -1
+        return 0, 0
+
+    def as_dict(self):
+        return {
+            'student_id': self.student_id,
+            'previous': self.previous,
+            'current': self.current,
+        }
+
+
+@dataclass
+class AttendanceResult:
+    """
+    Outcome of marking one session: every roster student gets a diff entry.
+    """
+    roster_size: int
+    diffs: List[AttendanceDiff] = field(default_factory=list)
+
+    @property
+    def created(self):
+        return sum(1 for diff in self.diffs if diff.created)
+
+    @property
+    def updated(self):
+        return sum(1 for diff in self.diffs if diff.changed and not diff.created)
+
+    @property
+    def unchanged(self):
+        return self.roster_size - self.created - self.updated
+
+    @property
+    def changes(self):
+        return [diff for diff in self.diffs if diff.changed]
+
+
+def uses_session_storage():
+    return getattr(settings, 'ATTENDANCE_STORAGE', 'rows') == 'sessions'
+
+
+def roster_ids(section):
+    """
+    The ids of all students in the section, in id order, as a queryset.
+    """
+    return User.objects.filter(section=section, role='student', pending_delete=False).order_by('id').values_list(
+        'id', flat=True,
+    )
+
+
+def get_roster(section):
+    """
+    Return the ids of all students in the section, in id order.
+    """
+    return list(roster_ids(section))
+
+
+def existing_marks(subject, section, date):
+    """
+    (student id, is_present) of the marks a class already has in row storage.
+    """
+    return Attendance.objects.filter(
+        subject=subject,
+        date=date,
+        student__section=section,
+        student__role='student',
+    ).values_list('student_id', 'is_present')
+
+
+def can_mark_attendance(user, subject, section):
+    """
+    A faculty member may mark attendance for a subject they are assigned to,
+    in a section of the same semester.
+    """
+    return (
+        user.is_faculty
+        and subject.faculty_assigned_id == user.id
+        and subject.semester_id == section.semester_id
+    )
+
+
+def lock_class(subject, section, date):
+    """
+    Hold the class (subject, section, date) until the transaction ends, so
+    concurrent or retried marks of it read the existing marks one after the
+    other and each diff only holds what its own write changes. The lock is
+    the class's day trend bucket, created if it does not exist yet; on
+    SQLite, the insert alone takes the database write lock.
+    """
+    key = {'section': section, 'subject': subject, 'granularity': 'day', 'period_start': date}
+    SectionAttendanceBucket.objects.bulk_create([SectionAttendanceBucket(**key)], ignore_conflicts=True)
+    list(SectionAttendanceBucket.objects.select_for_update().filter(**key).values_list('pk', flat=True))
+
+
+def bulk_mark_attendance(subject, section, date, present_student_ids: Iterable[int], marked_by, roster=None):
+    """
+    Upsert attendance for every student in `section` for `subject` on `date`.
+
+    Students listed in `present_student_ids` are marked present, the rest of the
+    roster absent. Only rows that are new or whose presence flips are written,
+    through a single INSERT ... ON CONFLICT (student, subject, date) DO UPDATE
+    (chunked by the backend's parameter limit), so the statement count does not
+    grow with the number of unchanged students. Marks of the same class are
+    taken one at a time (lock_class()). Pass `roster` when the section roster
+    has already been loaded.
+    """
+    present = {int(student_id) for student_id in present_student_ids}
+    if roster is None:
+        roster = get_roster(section)
+
+    unknown = present.difference(roster)
+    if unknown:
+        raise RosterError(unknown)
+
+    if uses_session_storage():
+        return _mark_session(subject, section, date, roster, present, marked_by)
+
+    with transaction.atomic():
+        lock_class(subject, section, date)
+        existing = dict(existing_marks(subject, section, date))
+
+        result = AttendanceResult(roster_size=len(roster))
+        now = timezone.now()
+        rows = []
+        for student_id in roster:
+            diff = AttendanceDiff(
+                student_id=student_id,
+                previous=existing.get(student_id),
+                current=student_id in present,
+            )
+            result.diffs.append(diff)
+            if diff.changed:
+                rows.append(Attendance(
+                    student_id=student_id,
+                    subject=subject,
+                    date=date,
+                    is_present=diff.current,
+                    marked_by=marked_by,
+                    marked_at=now,
+                ))
+
+        if rows:
+            Attendance.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=['student', 'subject', 'date'],
+                update_fields=['is_present', 'marked_by', 'marked_at'],
+            )
+            apply_attendance_deltas(subject, section, date, result.changes)
+
+    return result
+
+
+def _mark_session(subject, section, date, roster, present, marked_by):
+    """
+    Session-storage counterpart of bulk_mark_attendance: one row per class,
+    written with a single upsert.
+    """
+    with transaction.atomic():
+        # The session row cannot be locked before it exists.
+        lock_class(subject, section, date)
+        session = (
+            AttendanceSession.objects
+            .filter(subject=subject, section=section, date=date)
+            .first()
+        )
+        existing = session.student_view() if session else {}
+
+        result = AttendanceResult(roster_size=len(roster))
+        for student_id in roster:
+            result.diffs.append(AttendanceDiff(
+                student_id=student_id,
+                previous=existing.get(student_id),
+                current=student_id in present,
+            ))
+
+        if result.changes:
+            # Students who have left the section keep their earlier mark, the
+            # same way their Attendance rows would survive in row storage.
+            roster_ids = set(roster)
+            departed = [sid for sid in existing if sid not in roster_ids]
+            stored_roster = roster + departed
+            stored_present = present | {sid for sid in departed if existing[sid]}
+
+            AttendanceSession.objects.bulk_create(
+                [AttendanceSession.build(
+                    stored_roster, stored_present,
+                    subject=subject, section=section, date=date,
+                    marked_by=marked_by, marked_at=timezone.now(),
+                )],
+                update_conflicts=True,
+                unique_fields=['subject', 'section', 'date'],
+                update_fields=['roster', 'presence', 'marked_by', 'marked_at'],
+            )
+            apply_attendance_deltas(subject, section, date, result.changes)
+
+    return result
+
+
+def apply_attendance_deltas(subject, section, date, diffs: Iterable[AttendanceDiff]):
+    """
+    Fold attendance diffs for one class into the rollup and trend buckets.
+    Must run inside the transaction that wrote the attendance, with diffs
+    read under lock_class(): a diff taken before another mark of the class
+    committed would count that mark's changes a second time.
+    """
+    diffs = list(diffs)
+    _apply_grouped_deltas(
+        AttendanceRollup, {'subject': subject}, diffs,
+        updates={'updated_at': timezone.now()},
+        new_class_updates={'last_date': Greatest(Coalesce('last_date', Value(date)), Value(date))},
+    )
+    _apply_grouped_deltas(StudentMonthlyAttendance, {'subject': subject, 'month': date.replace(day=1)}, diffs)
+
+    total = sum(diff.delta[0] for diff in diffs)
+    present = sum(diff.delta[1] for diff in diffs)
+    if total or present:
+        for granularity, period_start in (('day', date), ('month', date.replace(day=1))):
+            key = {'section': section, 'subject': subject, 'granularity': granularity, 'period_start': period_start}
+            SectionAttendanceBucket.objects.bulk_create([SectionAttendanceBucket(**key)], ignore_conflicts=True)
+            SectionAttendanceBucket.objects.filter(**key).update(
+                total=F('total') + total, present=F('present') + present,
+            )
+
+
+def _apply_grouped_deltas(model, key, diffs, updates=None, new_class_updates=None):
+    """
+    Apply per-student (total, present) deltas to `model` rows identified by
+    `key` plus the student. `updates` are set on every touched row,
+    `new_class_updates` only on rows gaining a class.
+
+    Diffs are grouped by their delta, of which there are at most four kinds,
+    so this costs one insert plus at most four UPDATE statements however many
+    students changed.
+    """
+    groups = defaultdict(list)
+    created = []
+    for diff in diffs:
+        delta = diff.delta
+        if delta != (0, 0):
+            groups[delta].append(diff.student_id)
+        if diff.created:
+            created.append(diff.student_id)
+
+    if created:
+        model.objects.bulk_create(
+            [model(student_id=student_id, **key) for student_id in created],
+            ignore_conflicts=True,
+        )
+
+    for (total, present), student_ids in groups.items():
+        changes = {
+            'total': F('total') + total,
+            'present': F('present') + present,
+            **(updates or {}),
+        }
+        if total:
+            changes.update(new_class_updates or {})
+        model.objects.filter(student_id__in=student_ids, **key).update(**changes)
+
+
+class SessionAttendance:
+    """
+    Read-only stand-in for an Attendance row, expanded from an AttendanceSession
+    so code written against Attendance keeps working in session storage mode.
+    """
+    __slots__ = ('id', 'session_id', 'student', 'student_id', 'subject', 'subject_id',
+                 'date', 'is_present', 'marked_by', 'marked_at')
+
+    def __init__(self, session, student_id, is_present, student=None):
+        self.id = None
+        self.session_id = session.id
+        self.student_id = student_id
+        self.student = student
+        self.subject = session.subject
+        self.subject_id = session.subject_id
+        self.date = session.date
+        self.is_present = is_present
+        self.marked_by = session.marked_by
+        self.marked_at = session.marked_at
+
+
+def expand_sessions(sessions, student_id=None):
+    """
+    Yield SessionAttendance records for `sessions`, either for every roster
+    entry (students loaded with one query per session) or for one student.
+    """
+    for session in sessions:
+        if student_id is not None:
+            is_present = session.is_present(student_id)
+            if is_present is not None:
+                yield SessionAttendance(session, student_id, is_present)
+            continue
+
+        view = session.student_view()
+        students = User.objects.in_bulk(list(view))
+        for sid, is_present in view.items():
+            yield SessionAttendance(session, sid, is_present, student=students.get(sid))
+
+
+def student_records(student, subject_id=None):
+    """
+    One student's Attendance rows (row storage).
+    """
+    records = Attendance.objects.filter(student=student).select_related('subject', 'marked_by')
+    if subject_id:
+        records = records.filter(subject_id=subject_id)
+    return records
+
+
+def student_rollups(student, subject_id=None):
+    """
+    One student's AttendanceRollup rows.
+    """
+    rollups = AttendanceRollup.objects.filter(student=student)
+    if subject_id:
+        rollups = rollups.filter(subject_id=subject_id)
+    return rollups
+
+
+def student_attendance(student, subject_id=None):
+    """
+    Attendance records for one student in either storage mode.
+    """
+    if not uses_session_storage():
+        return student_records(student, subject_id)
+
+    sessions = AttendanceSession.objects.filter(section_id=student.section_id).select_related('subject', 'marked_by')
+    if subject_id:
+        sessions = sessions.filter(subject_id=subject_id)
+    return list(expand_sessions(sessions, student_id=student.id))
+
+
+# Matches Attendance.Meta.ordering and AttendanceSession.Meta.ordering; the
+# trailing id makes the key unique so it can drive keyset pagination.
+ATTENDANCE_ORDERING = ['-date', '-marked_at', '-id']
+
+
+def _filter_by_faculty(queryset, faculty, subject_id, section_id, date_from, date_to, section_field):
+    queryset = queryset.filter(subject__faculty_assigned=faculty)
+    if subject_id:
+        queryset = queryset.filter(subject_id=subject_id)
+    if section_id:
+        queryset = queryset.filter(**{section_field: section_id})
+    if date_from:
+        queryset = queryset.filter(date__gte=date_from)
+    if date_to:
+        queryset = queryset.filter(date__lte=date_to)
+    return queryset
+
+
+def faculty_records(faculty, subject_id=None, section_id=None, date_from=None, date_to=None):
+    """
+    Attendance rows of the faculty's subjects with their student, subject
+    and marker (row storage).
+    """
+    return _filter_by_faculty(
+        Attendance.objects.select_related('student', 'subject', 'marked_by'),
+        faculty, subject_id, section_id, date_from, date_to, 'student__section_id',
+    )
+
+
+def faculty_rollup_rows(faculty, subject_id=None, section_id=None):
+    """
+    Rollup rows of the faculty's subjects with subject and student names, by
+    subject and student username.
+    """
+    rollups = AttendanceRollup.objects.filter(subject__faculty_assigned=faculty)
+    if subject_id:
+        rollups = rollups.filter(subject_id=subject_id)
+    if section_id:
+        rollups = rollups.filter(student__section_id=section_id)
+    return rollups.order_by('subject_id', 'student__username').values(
+        'subject_id', 'subject__name', 'student_id', 'student__username',
+        'student__first_name', 'student__last_name', 'total', 'present', 'last_date'
+    )
+
+
+def faculty_attendance_page(faculty, subject_id=None, section_id=None, date_from=None, date_to=None,
+                            cursor=None, page_size=50):
+    """
+    One keyset page of attendance records for the faculty's subjects, newest
+    first, as (records, next_cursor).
+
+    Row storage reads the page and its student/subject/marker in a single
+    joined query. Session storage reads the sessions covering the page plus
+    one query for their students; its cursor also records the roster position
+    inside the last session.
+    """
+    if not uses_session_storage():
+        records = faculty_records(faculty, subject_id, section_id, date_from, date_to)
+        return paginate_keyset(records, ATTENDANCE_ORDERING, cursor, page_size)
+
+    sessions = _filter_by_faculty(
+        AttendanceSession.objects.select_related('subject', 'marked_by'),
+        faculty, subject_id, section_id, date_from, date_to, 'section_id',
+    ).order_by(*ATTENDANCE_ORDERING)
+
+    cursor_session, position = None, -1
+    if cursor:
+        date, marked_at, cursor_session, position = decode_cursor(cursor, 4)
+        sessions = sessions.filter(
+            Q(id=cursor_session) | keyset_after(ATTENDANCE_ORDERING, [date, marked_at, cursor_session])
+        )
+
+    # Every session contributes at least one record, so page_size + 1 records
+    # never need more than page_size + 2 sessions (the cursor's own one included).
+    entries = []
+    for session in sessions[:page_size + 2]:
+        start = position + 1 if session.id == cursor_session else 0
+        for index, (student_id, is_present) in enumerate(list(session.student_view().items())[start:], start):
+            entries.append((session, index, student_id, is_present))
+            if len(entries) > page_size:
+                break
+        if len(entries) > page_size:
+            break
+
+    page = entries[:page_size]
+    students = User.objects.in_bulk([student_id for _, _, student_id, _ in page])
+    records = [
+        SessionAttendance(session, student_id, is_present, student=students.get(student_id))
+        for session, _, student_id, is_present in page
+    ]
+
+    next_cursor = None
+    if len(entries) > page_size:
+        session, index, _, _ = page[-1]
+        next_cursor = encode_cursor([session.date, session.marked_at, session.id, index])
+    return records, next_cursor
+
+
+def session_rollup_counts():
+    """
+    (student, subject) -> (total, present, last_date) computed from every
+    stored session; used to verify the rollup in session storage mode.
+    """
+    counts = {}
+    sessions = AttendanceSession.objects.order_by().values_list('subject_id', 'date', 'roster', 'presence')
+    for subject_id, date, roster, presence in sessions.iterator():
+        student_ids = unpack_ids(roster)
+        for student_id, is_present in zip(student_ids, unpack_bits(presence, len(student_ids))):
+            total, present, last_date = counts.get((student_id, subject_id), (0, 0, None))
+            counts[(student_id, subject_id)] = (
+                total + 1,
+                present + int(is_present),
+                date if last_date is None or date > last_date else last_date,
+            )
+    return counts
+
+
+def session_attendance_rate(sessions):
+    """
+    (present, total) over the given sessions, counted with bitmap popcounts.
+    """
+    present = total = 0
+    for roster, presence in sessions.values_list('roster', 'presence').iterator():
+        total += len(roster) // 8
+        present += popcount(presence)
+    return present, total
@@ -0,0 +1,168 @@
+"""
+Idempotent batch attendance sync for clients that capture attendance offline.
+
+A batch carries several sessions, each with a client-chosen idempotency key.
+Keys already seen are answered from AttendanceSyncReceipt without touching
+attendance; the rest are authorized with the same rule as mark_attendance and
+applied in one transaction, with rosters, subjects and sections loaded once per
+batch.
+"""
+import hashlib
+import json
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.utils.dateparse import parse_date
+
+from .attendance import bulk_mark_attendance, can_mark_attendance, RosterError
+from .models import User, Section, Subject, AttendanceSyncReceipt
+
+MAX_BATCH_SESSIONS = 100
+
+
+class SyncBatchError(ValueError):
+    pass
+
+
+def _payload_hash(session):
+    present = session.get('present_student_ids') or []
+    try:
+        present = sorted({int(student_id) for student_id in present})
+    except (TypeError, ValueError):
+        present = repr(present)
+    canonical = {
+        'subject_id': session.get('subject_id'),
+        'section_id': session.get('section_id'),
+        'date': session.get('date'),
+        'present_student_ids': present,
+    }
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _as_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _replay(receipt, payload_hash):
+    if receipt.payload_hash != payload_hash:
+        return {
+            'idempotency_key': receipt.idempotency_key,
+            'status': 'conflict',
+            'error': 'Idempotency key was already used for a different session',
+        }
+    return {**receipt.result, 'status': 'replayed'}
+
+
+def _error(key, message, code, **extra):
+    return {'idempotency_key': key, 'status': 'error', 'code': code, 'error': message, **extra}
+
+
+def sync_attendance_batch(faculty, sessions):
+    """
+    Apply a batch of sessions for `faculty` and return one result per session,
+    in request order. Each session is a dict with idempotency_key, subject_id,
+    section_id, date and present_student_ids.
+    """
+    if not isinstance(sessions, list) or not sessions:
+        raise SyncBatchError('sessions must be a non-empty list')
+    if len(sessions) > MAX_BATCH_SESSIONS:
+        raise SyncBatchError(f'A batch may contain at most {MAX_BATCH_SESSIONS} sessions')
+
+    keys = []
+    for session in sessions:
+        key = session.get('idempotency_key') if isinstance(session, dict) else None
+        if not key or not isinstance(key, str) or len(key) > 100:
+            raise SyncBatchError('Every session needs an idempotency_key of at most 100 characters')
+        keys.append(key)
+    if len(set(keys)) != len(keys):
+        raise SyncBatchError('idempotency_key values must be unique within a batch')
+
+    hashes = {session['idempotency_key']: _payload_hash(session) for session in sessions}
+    receipts = {
+        receipt.idempotency_key: receipt
+        for receipt in AttendanceSyncReceipt.objects.filter(faculty=faculty, idempotency_key__in=keys)
+    }
+    pending = [session for session in sessions if session['idempotency_key'] not in receipts]
+
+    results = {key: _replay(receipt, hashes[key]) for key, receipt in receipts.items()}
+    if pending:
+        try:
+            results.update(_apply(faculty, pending, hashes))
+        except IntegrityError:
+            # A concurrent replay of the same batch stored its receipts first;
+            # answer from those instead.
+            for receipt in AttendanceSyncReceipt.objects.filter(
+                faculty=faculty, idempotency_key__in=[session['idempotency_key'] for session in pending]
+            ):
+                results[receipt.idempotency_key] = _replay(receipt, hashes[receipt.idempotency_key])
+
+    return [
+        results.get(key, _error(key, 'Session was not applied, retry the batch', 'retry'))
+        for key in keys
+    ]
+
+
+def _apply(faculty, sessions, hashes):
+    subjects = Subject.objects.in_bulk({_as_id(session.get('subject_id')) for session in sessions} - {None})
+    sections = Section.objects.in_bulk({_as_id(session.get('section_id')) for session in sessions} - {None})
+    rosters = defaultdict(list)
+    for section_id, student_id in (
+        User.objects.filter(section__in=list(sections), role='student', pending_delete=False)
+        .order_by('id').values_list('section_id', 'id')
+    ):
+        rosters[section_id].append(student_id)
+
+    results = {}
+    receipts = []
+    with transaction.atomic():
+        for session in sessions:
+            key = session['idempotency_key']
+            subject = subjects.get(_as_id(session.get('subject_id')))
+            section = sections.get(_as_id(session.get('section_id')))
+            try:
+                date = parse_date(str(session.get('date')))
+            except ValueError:
+                date = None
+
+            if subject is None or section is None:
+                results[key] = _error(key, 'Subject or section not found', 'not_found')
+                continue
+            if date is None:
+                results[key] = _error(key, 'Date must be in YYYY-MM-DD format', 'invalid')
+                continue
+            if not can_mark_attendance(faculty, subject, section):
+                results[key] = _error(key, 'You are not authorized to mark attendance for this class', 'forbidden')
+                continue
+
+            try:
+                with transaction.atomic():
+                    outcome = bulk_mark_attendance(
+                        subject, section, date, session.get('present_student_ids') or [], faculty,
+                        roster=rosters[section.id],
+                    )
+            except RosterError as e:
+                results[key] = _error(key, str(e), 'invalid', unknown_student_ids=e.unknown_ids)
+                continue
+            except (TypeError, ValueError):
+                results[key] = _error(key, 'present_student_ids must be a list of student ids', 'invalid')
+                continue
+
+            result = {
+                'idempotency_key': key,
+                'status': 'applied',
+                'created': outcome.created,
+                'updated': outcome.updated,
+                'unchanged': outcome.unchanged,
+            }
+            results[key] = result
+            receipts.append(AttendanceSyncReceipt(
+                faculty=faculty, idempotency_key=key, payload_hash=hashes[key],
+                result={k: v for k, v in result.items() if k != 'status'},
+            ))
+
+        AttendanceSyncReceipt.objects.bulk_create(receipts)
+
+    return results
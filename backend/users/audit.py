@@ -0,0 +1,453 @@
+"""
+Asynchronous, batched audit logging.
+
+record_action() runs on the request path. It puts the entry on an
+in-process queue once the surrounding transaction commits, so a rolled-back
+change leaves no audit row. A flusher thread writes the queue to AuditLog
+with one bulk_create per batch. A batch is written when it reaches
+AUDIT_BATCH_SIZE entries or when its oldest entry has waited
+AUDIT_FLUSH_INTERVAL seconds.
+
+When the database is slow or failing, batches are appended to a local
+JSON-lines spill file in AUDIT_SPILL_DIR instead. This happens when a write
+raises or takes longer than AUDIT_SLOW_WRITE seconds, and lasts for
+AUDIT_SPILL_BACKOFF seconds. The same applies to entries that find the queue
+full. Once writes are fast again, the flusher replays its spill file, along
+with files left by processes that exited. Delivery is at least once: a
+crash during a replay can write some entries twice. A line that cannot be
+read back, such as the torn last line of a process killed mid-spill, is
+moved to a `.bad` file next to the spill files instead of being replayed.
+
+The queue is drained at interpreter exit. lag() is the age of the oldest
+entry not yet written, and the metrics endpoint reports it along with
+stats().
+
+Mutations of departments, semesters, sections, subjects and users are
+recorded from signals (see users/signals.py), attributed to the user of the
+current request through AuditContextMiddleware. Bulk operations that send no
+signals are recorded from their views.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .login import client_ip
+from .models import User, AuditLog
+
+logger = logging.getLogger(__name__)
+
+AUDITED_ROLES = {'admin', 'hod', 'faculty'}
+SPILL_SUFFIX = '.jsonl'
+QUARANTINE_SUFFIX = '.bad'
+_STOP = object()
+
+_current_request = contextvars.ContextVar('audit_request', default=None)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class AuditContextMiddleware:
+    """
+    Make the current request available to audit signal handlers.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        token = _current_request.set(request)
+        try:
+            return self.get_response(request)
+        finally:
+            _current_request.reset(token)
+
+    async def __acall__(self, request):
+        # sync_to_async copies the context, so sync views still see it.
+        token = _current_request.set(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            _current_request.reset(token)
+
+
+def current_actor():
+    """
+    (user, request) for the current request if its user is audited, else
+    (None, None). DRF sets the authenticated user on the underlying request.
+    """
+    request = _current_request.get()
+    if request is None:
+        return None, None
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated or getattr(user, 'role', None) not in AUDITED_ROLES:
+        return None, None
+    return user, request
+
+
+class AuditWriter:
+    def __init__(self):
+        self._queue = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._pid = None
+        self._spill_name = None
+        self._spill_until = 0.0
+        self._in_flight = None
+        self._stats = dict.fromkeys(('written', 'spilled', 'replayed', 'dropped', 'quarantined'), 0)
+
+    # Request side
+
+    def record(self, user, action, resource_type, resource_id, request=None, details=''):
+        """
+        Queue an audit entry for after the current transaction commits.
+        """
+        entry = {
+            'user_id': user.pk,
+            'action': action,
+            'resource_type': resource_type,
+            'resource_id': resource_id,
+            'timestamp': timezone.now().isoformat(),
+            'ip_address': client_ip(request) or None,
+            'details': details if isinstance(details, str) else json.dumps(details, default=str),
+        }
+        transaction.on_commit(lambda: self.enqueue(entry))
+
+    def enqueue(self, entry):
+        if not _setting('AUDIT_ASYNC', True):
+            self._write([entry])
+            return
+        self._ensure_started()
+        entry['_queued_at'] = time.monotonic()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self._spill([entry])
+
+    # Flusher thread
+
+    def _running(self):
+        return self._thread is not None and self._pid == os.getpid() and self._thread.is_alive()
+
+    def _ensure_started(self):
+        if self._running():
+            return
+        with self._start_lock:
+            if self._running():
+                return
+            if self._thread is None or self._pid != os.getpid():
+                # Fresh state after a fork: the parent's thread did not survive it.
+                self._pid = os.getpid()
+                self._spill_name = f'{self._pid}-{uuid.uuid4().hex[:8]}{SPILL_SUFFIX}'
+                self._queue = queue.Queue(maxsize=_setting('AUDIT_QUEUE_SIZE', 10000))
+            else:
+                # The flusher died; a new one picks up its queue.
+                logger.error('Audit flusher thread died; restarting it')
+            self._thread = threading.Thread(target=self._run, name='audit-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        batch_size = _setting('AUDIT_BATCH_SIZE', 200)
+        interval = _setting('AUDIT_FLUSH_INTERVAL', 1.0)
+        stopping = False
+        while not stopping:
+            try:
+                first = self._queue.get(timeout=interval)
+            except queue.Empty:
+                self._maybe_replay()
+                continue
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = first['_queued_at'] + interval
+            while len(batch) < batch_size:
+                try:
+                    entry = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if entry is _STOP:
+                    stopping = True
+                    break
+                batch.append(entry)
+            self._in_flight = first['_queued_at']
+            try:
+                self._write(batch)
+            except Exception:
+                # Spilling failed too, e.g. on a full disk.
+                logger.exception('Audit flusher lost %d entries', len(batch))
+                self._stats['dropped'] += len(batch)
+            finally:
+                self._in_flight = None
+            if not stopping:
+                self._maybe_replay()
+
+        # Drain whatever was queued before the stop marker.
+        rest = []
+        while True:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is not _STOP:
+                rest.append(entry)
+        if rest:
+            self._write(rest)
+        connection.close()
+
+    def _write(self, batch):
+        if time.monotonic() < self._spill_until:
+            self._spill(batch)
+            return
+        start = time.monotonic()
+        try:
+            self._insert(batch)
+        except Exception:
+            # Not only DatabaseError: anything escaping here would stop the
+            # flusher thread with the batch lost.
+            logger.exception('Audit log write failed; spilling %d entries to disk', len(batch))
+            self._spill_until = time.monotonic() + _setting('AUDIT_SPILL_BACKOFF', 30)
+            self._spill(batch)
+            return
+        self._stats['written'] += len(batch)
+        if time.monotonic() - start > _setting('AUDIT_SLOW_WRITE', 0.5):
+            logger.warning('Audit log write took %.2fs; spilling to disk for a while', time.monotonic() - start)
+            self._spill_until = time.monotonic() + _setting('AUDIT_SPILL_BACKOFF', 30)
+
+    def _insert(self, batch):
+        connection.close_if_unusable_or_obsolete()
+        rows = [self._row(entry) for entry in batch]
+        try:
+            with transaction.atomic():
+                AuditLog.objects.bulk_create(rows)
+        except IntegrityError:
+            # Entries of users deleted since they were queued; their logs
+            # would have been removed with them.
+            existing = set(User.objects.filter(id__in={row.user_id for row in rows}).values_list('id', flat=True))
+            kept = [row for row in rows if row.user_id in existing]
+            self._stats['dropped'] += len(rows) - len(kept)
+            with transaction.atomic():
+                AuditLog.objects.bulk_create(kept)
+
+    @staticmethod
+    def _row(entry):
+        return AuditLog(
+            user_id=entry['user_id'], action=entry['action'],
+            resource_type=entry['resource_type'], resource_id=entry['resource_id'],
+            timestamp=parse_datetime(entry['timestamp']), ip_address=entry['ip_address'],
+            details=entry['details'],
+        )
+
+    # Spill files
+
+    def _spill_dir(self):
+        return str(_setting('AUDIT_SPILL_DIR', None) or os.path.join(settings.BASE_DIR, 'audit_spill'))
+
+    def _spill(self, batch):
+        directory = self._spill_dir()
+        lines = ''.join(
+            json.dumps({key: value for key, value in entry.items() if not key.startswith('_')}) + '\n'
+            for entry in batch
+        )
+        with self._spill_lock:
+            if self._spill_name is None:
+                self._spill_name = f'{os.getpid()}-{uuid.uuid4().hex[:8]}{SPILL_SUFFIX}'
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, self._spill_name), 'a') as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+        self._stats['spilled'] += len(batch)
+
+    def _claimable(self, directory, orphan_age=None):
+        """
+        This process's spill file and those of processes that stopped
+        writing theirs `orphan_age` (AUDIT_SPILL_ORPHAN_AGE) seconds ago.
+        """
+        orphan_age = _setting('AUDIT_SPILL_ORPHAN_AGE', 600) if orphan_age is None else orphan_age
+        now = time.time()
+        try:
+            names = sorted(os.listdir(directory))
+        except FileNotFoundError:
+            return []
+        own_replay = f'.replaying-{os.getpid()}'
+        claimable = []
+        for name in names:
+            if not name.endswith(SPILL_SUFFIX) and '.replaying-' not in name:
+                continue
+            try:
+                if (name == self._spill_name or name.endswith(own_replay)
+                        or now - os.path.getmtime(os.path.join(directory, name)) > orphan_age):
+                    claimable.append(name)
+            except FileNotFoundError:
+                continue
+        return claimable
+
+    def _read_spill(self, path, quarantine):
+        """
+        The entries in spill file `path`. Lines that are not a complete entry
+        are appended to `quarantine` and left out.
+        """
+        entries, bad = [], []
+        with open(path, errors='replace') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                    self._row(entry)
+                except (ValueError, TypeError, KeyError, AttributeError):
+                    bad.append(line if line.endswith('\n') else line + '\n')
+                else:
+                    entries.append(entry)
+        if bad:
+            logger.error('Quarantining %d unreadable audit spill lines from %s to %s', len(bad), path, quarantine)
+            with open(quarantine, 'a') as f:
+                f.writelines(bad)
+            self._stats['quarantined'] += len(bad)
+        return entries
+
+    def _maybe_replay(self):
+        if time.monotonic() < self._spill_until:
+            return
+        try:
+            self.replay()
+        except Exception:
+            logger.exception('Audit spill replay failed')
+            self._spill_until = time.monotonic() + _setting('AUDIT_SPILL_BACKOFF', 30)
+
+    def replay(self, orphan_age=None):
+        """
+        Write claimable spill files to the database. Returns the number of
+        entries written.
+        """
+        directory = self._spill_dir()
+        replayed = 0
+        for name in self._claimable(directory, orphan_age):
+            path = os.path.join(directory, name)
+            claimed = path if '.replaying-' in name else f'{path}.replaying-{os.getpid()}'
+            # Renaming claims the file; new spills go to a fresh file.
+            with self._spill_lock:
+                try:
+                    if claimed != path:
+                        os.rename(path, claimed)
+                except FileNotFoundError:
+                    continue
+            entries = self._read_spill(claimed, os.path.join(directory, name.split('.replaying-')[0] + QUARANTINE_SUFFIX))
+            batch_size = _setting('AUDIT_BATCH_SIZE', 200)
+            for start in range(0, len(entries), batch_size):
+                self._insert(entries[start:start + batch_size])
+            os.remove(claimed)
+            replayed += len(entries)
+        self._stats['replayed'] += replayed
+        return replayed
+
+    # Shutdown and metrics
+
+    def close(self, timeout=None):
+        """
+        Write out everything queued, waiting up to `timeout` seconds
+        (AUDIT_DRAIN_TIMEOUT by default). Entries still queued after that
+        are spilled.
+        """
+        if self._thread is None or self._pid != os.getpid():
+            return
+        timeout = _setting('AUDIT_DRAIN_TIMEOUT', 10) if timeout is None else timeout
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            left = []
+            while True:
+                try:
+                    entry = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is not _STOP:
+                    left.append(entry)
+            if left:
+                self._spill(left)
+        self._thread = None
+
+    def lag(self):
+        """
+        Seconds the oldest entry not yet written has been waiting.
+        """
+        oldest = self._in_flight
+        if self._queue is not None:
+            try:
+                head = self._queue.queue[0]
+            except IndexError:
+                head = None
+            if head is not None and head is not _STOP:
+                oldest = head['_queued_at'] if oldest is None else min(oldest, head['_queued_at'])
+        return 0.0 if oldest is None else max(0.0, time.monotonic() - oldest)
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+            'lag_seconds': round(self.lag(), 3),
+            'spilling': time.monotonic() < self._spill_until,
+            **self._stats,
+        }
+
+
+audit_writer = AuditWriter()
+atexit.register(audit_writer.close)
+
+
+def record_action(user, action, resource_type, resource_id, request=None, details=''):
+    """
+    Audit `action` by `user` on a resource, if the user's role is audited.
+    """
+    if user is None or getattr(user, 'role', None) not in AUDITED_ROLES:
+        return
+    audit_writer.record(user, action, resource_type, resource_id, request=request, details=details)
+
+
+def prometheus_text():
+    """
+    This process's audit pipeline as Prometheus gauges and counters.
+    """
+    stats = audit_writer.stats()
+    lines = [
+        '# HELP audit_pipeline_lag_seconds Age of the oldest audit entry not yet written.',
+        '# TYPE audit_pipeline_lag_seconds gauge',
+        f"audit_pipeline_lag_seconds {stats['lag_seconds']}",
+        '# HELP audit_queue_depth Audit entries waiting to be written.',
+        '# TYPE audit_queue_depth gauge',
+        f"audit_queue_depth {stats['queued']}",
+    ]
+    for name, help_text in (
+        ('written', 'Audit entries written to the database.'),
+        ('spilled', 'Audit entries appended to the spill file.'),
+        ('replayed', 'Spilled audit entries written to the database.'),
+        ('dropped', 'Audit entries dropped because their user was deleted.'),
+        ('quarantined', 'Spilled audit lines that could not be read back.'),
+    ):
+        lines.append(f'# HELP audit_entries_{name}_total {help_text}')
+        lines.append(f'# TYPE audit_entries_{name}_total counter')
+        lines.append(f'audit_entries_{name}_total {stats[name]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,402 @@
+"""
+Month-partitioned audit log storage.
+
+AuditLog rows are kept in one table per calendar month (UTC), listed in the
+AuditLogPartition catalog, so a time-range query reads only the months it
+covers and retention drops whole tables instead of deleting rows.
+
+- PostgreSQL: users_auditlog is a native table partitioned by range on
+  timestamp (migration 0011). Month partitions are created
+  AUDIT_PARTITIONS_AHEAD months in advance, and a DEFAULT partition catches
+  anything else. The planner prunes partitions itself.
+- SQLite: users_auditlog is the live table that receives inserts. When a
+  month is over, rotate() renames the live table to users_auditlog_YYYYMM
+  and recreates an empty live table. The rename costs the same however many
+  rows the month has. Rows of other months, such as the new month's first
+  writes or late audit entries replayed from a spill file, are then moved
+  to their own month's table. audit_log_page() reads the live table plus
+  the month tables overlapping the requested range in one UNION ALL.
+
+`manage.py maintain_audit_partitions` runs rotation or partition creation,
+then retention. It should run at least daily.
+"""
+import datetime
+import gzip
+import json
+import os
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import User, AuditLog, AuditLogPartition
+from .pagination import InvalidCursor, decode_cursor, encode_cursor, keyset_page, keyset_values
+
+LIVE_TABLE = AuditLog._meta.db_table
+DEFAULT_PARTITION = f'{LIVE_TABLE}_default'
+ORDERING = ['-timestamp', '-id']
+COLUMNS = [field.column for field in AuditLog._meta.concrete_fields]
+FILTERS = ('action', 'resource_type', 'user_id', 'ip_address')
+
+
+def month_start(value):
+    value = value.astimezone(datetime.timezone.utc)
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(start, months):
+    index = start.year * 12 + start.month - 1 + months
+    return start.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(start):
+    return f'{LIVE_TABLE}_{start:%Y%m}'
+
+
+def _quote(name):
+    return connection.ops.quote_name(name)
+
+
+def _adapt(value):
+    return connection.ops.adapt_datetimefield_value(value)
+
+
+def _register(table, start):
+    AuditLogPartition.objects.get_or_create(
+        table_name=table, defaults={'period_start': start, 'period_end': add_months(start, 1)},
+    )
+
+
+# SQLite rolling tables
+
+def _sqlite_schema(cursor, table):
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s", [table])
+    table_sql = cursor.fetchone()[0]
+    cursor.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL", [table]
+    )
+    return table_sql, cursor.fetchall()
+
+
+def _sqlite_index_month_table(cursor, table):
+    cursor.execute(f'CREATE INDEX {_quote(table + "_ts_idx")} ON {_quote(table)} ("timestamp")')
+    # For removing a deleted user's rows (see delete_for_users()).
+    cursor.execute(f'CREATE INDEX {_quote(table + "_user_idx")} ON {_quote(table)} ("user_id")')
+
+
+def _sqlite_create_month_table(cursor, table_sql, table):
+    # The live table's CREATE statement names the table once, at the start.
+    cursor.execute(table_sql.replace(_quote(LIVE_TABLE), _quote(table), 1))
+    _sqlite_index_month_table(cursor, table)
+
+
+def _move(cursor, source, target, start, end):
+    where = '"timestamp" >= %s AND "timestamp" < %s'
+    params = [_adapt(start), _adapt(end)]
+    cursor.execute(f'INSERT INTO {_quote(target)} SELECT * FROM {_quote(source)} WHERE {where}', params)
+    cursor.execute(f'DELETE FROM {_quote(source)} WHERE {where}', params)
+
+
+def rotate(now=None):
+    """
+    Move every finished month out of the SQLite live table into its month
+    table. Returns the names of the month tables written to.
+    """
+    current = month_start(now or timezone.now())
+    with transaction.atomic():
+        months = [
+            datetime.datetime(day.year, day.month, 1, tzinfo=datetime.timezone.utc)
+            for day in AuditLog.objects.filter(timestamp__lt=current).dates('timestamp', 'month')
+        ]
+        if not months:
+            return []
+        existing = set(AuditLogPartition.objects.values_list('table_name', flat=True))
+        touched = []
+        source = LIVE_TABLE
+        with connection.cursor() as cursor:
+            table_sql, indexes = _sqlite_schema(cursor, LIVE_TABLE)
+            latest = months[-1]
+            if partition_name(latest) not in existing:
+                # Rename the live table to the latest finished month and start
+                # a new live table with the same schema and id sequence.
+                # Index names are global in SQLite, so the renamed table's
+                # indexes are dropped and recreated under the month's name.
+                source = partition_name(latest)
+                cursor.execute(f'ALTER TABLE {_quote(LIVE_TABLE)} RENAME TO {_quote(source)}')
+                for name, _ in indexes:
+                    cursor.execute(f'DROP INDEX {_quote(name)}')
+                _sqlite_index_month_table(cursor, source)
+                cursor.execute(table_sql)
+                for _, sql in indexes:
+                    cursor.execute(sql)
+                cursor.execute(
+                    'INSERT INTO sqlite_sequence (name, seq) SELECT %s, seq FROM sqlite_sequence WHERE name = %s',
+                    [LIVE_TABLE, source],
+                )
+                _register(source, latest)
+                touched.append(source)
+                # Rows written since the month turned go back to the live table.
+                _move(cursor, source, LIVE_TABLE, current, datetime.datetime.max.replace(tzinfo=datetime.timezone.utc))
+                months = months[:-1]
+            # Earlier months: late rows, or the whole history on the first run.
+            for start in months:
+                table = partition_name(start)
+                if table not in existing:
+                    _sqlite_create_month_table(cursor, table_sql, table)
+                    _register(table, start)
+                _move(cursor, source, table, start, add_months(start, 1))
+                touched.append(table)
+    return touched
+
+
+def _sqlite_user_rows(user_ids, statement, limit=None):
+    if connection.vendor != 'sqlite' or not user_ids:
+        return 0
+    user_ids = list(user_ids)
+    placeholders = ','.join(['%s'] * len(user_ids))
+    total = 0
+    with connection.cursor() as cursor:
+        for table in AuditLogPartition.objects.values_list('table_name', flat=True):
+            # LIMIT -1 is no limit in SQLite.
+            remaining = -1 if limit is None else limit - total
+            cursor.execute(statement.format(table=_quote(table), ids=placeholders), [*user_ids, remaining])
+            total += cursor.fetchone()[0] if cursor.description else cursor.rowcount
+            if limit is not None and total >= limit:
+                break
+    return total
+
+
+def count_for_users(user_ids):
+    """
+    Number of rows of `user_ids` in the SQLite month tables.
+    """
+    return _sqlite_user_rows(
+        user_ids, 'SELECT count(*) FROM (SELECT 1 FROM {table} WHERE "user_id" IN ({ids}) LIMIT %s)',
+    )
+
+
+def delete_for_users(user_ids, limit=None):
+    """
+    Delete up to `limit` rows of `user_ids` from the SQLite month tables and
+    return how many were deleted. Their foreign key to users_user would
+    otherwise stop the users from being deleted; the live table and
+    PostgreSQL partitions are reached by the ORM's cascade.
+    """
+    return _sqlite_user_rows(
+        user_ids,
+        'DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE "user_id" IN ({ids}) LIMIT %s)',
+        limit,
+    )
+
+
+# PostgreSQL partitions
+
+def _pg_attach_month(cursor, start):
+    """
+    Create the partition for the month starting at `start`, moving any of
+    its rows out of the DEFAULT partition first (PostgreSQL refuses to
+    attach a range the DEFAULT partition holds rows for).
+    """
+    table, end = partition_name(start), add_months(start, 1)
+    cursor.execute(
+        f'CREATE TABLE {_quote(table)} (LIKE {_quote(LIVE_TABLE)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+    )
+    _move(cursor, DEFAULT_PARTITION, table, start, end)
+    cursor.execute(
+        f'ALTER TABLE {_quote(LIVE_TABLE)} ATTACH PARTITION {_quote(table)} '
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    )
+    _register(table, start)
+
+
+def ensure_partitions(now=None, ahead=None):
+    """
+    Create PostgreSQL partitions for this month, the next `ahead` months and
+    any month with rows in the DEFAULT partition. Returns the tables created.
+    """
+    ahead = getattr(settings, 'AUDIT_PARTITIONS_AHEAD', 3) if ahead is None else ahead
+    current = month_start(now or timezone.now())
+    wanted = {add_months(current, n) for n in range(ahead + 1)}
+    created = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT DISTINCT date_trunc('month', \"timestamp\" AT TIME ZONE 'UTC') FROM {_quote(DEFAULT_PARTITION)}"
+        )
+        wanted |= {month.replace(tzinfo=datetime.timezone.utc) for (month,) in cursor.fetchall()}
+        existing = set(AuditLogPartition.objects.values_list('table_name', flat=True))
+        for start in sorted(wanted):
+            if partition_name(start) not in existing:
+                _pg_attach_month(cursor, start)
+                created.append(partition_name(start))
+    return created
+
+
+# Retention
+
+def _archive(table, directory):
+    """
+    Write every row of `table` to DIRECTORY/<table>.jsonl.gz.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{table}.jsonl.gz')
+    with connection.cursor() as cursor, gzip.open(path, 'wt', encoding='utf-8') as f:
+        cursor.execute(f'SELECT {", ".join(_quote(c) for c in COLUMNS)} FROM {_quote(table)} ORDER BY "id"')
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            for row in rows:
+                f.write(json.dumps(dict(zip(COLUMNS, row)), default=str) + '\n')
+    return path
+
+
+def apply_retention(now=None, months=None, archive_dir=None):
+    """
+    Drop the month tables that ended more than `months`
+    (AUDIT_RETENTION_MONTHS) months before the current one, writing each to
+    `archive_dir` (AUDIT_ARCHIVE_DIR) first unless it is empty. Returns the
+    dropped table names.
+    """
+    months = getattr(settings, 'AUDIT_RETENTION_MONTHS', 24) if months is None else months
+    archive_dir = getattr(settings, 'AUDIT_ARCHIVE_DIR', None) if archive_dir is None else archive_dir
+    cutoff = add_months(month_start(now or timezone.now()), -months)
+    dropped = []
+    for partition in AuditLogPartition.objects.filter(period_end__lte=cutoff).order_by('period_start'):
+        table = partition.table_name
+        if archive_dir:
+            _archive(table, str(archive_dir))
+        with transaction.atomic(), connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(f'ALTER TABLE {_quote(LIVE_TABLE)} DETACH PARTITION {_quote(table)}')
+            cursor.execute(f'DROP TABLE {_quote(table)}')
+            partition.delete()
+        dropped.append(table)
+    return dropped
+
+
+def maintain(now=None):
+    """
+    Rotate (SQLite) or create partitions (PostgreSQL), then apply retention.
+    Returns {'rotated': [...], 'created': [...], 'dropped': [...]}.
+    """
+    result = {'rotated': [], 'created': [], 'dropped': []}
+    if connection.vendor == 'sqlite':
+        result['rotated'] = rotate(now)
+    elif connection.vendor == 'postgresql':
+        result['created'] = ensure_partitions(now)
+    else:
+        return result
+    result['dropped'] = apply_retention(now)
+    return result
+
+
+# Queries
+
+def _filters(params):
+    filters = {}
+    for name in FILTERS:
+        if params.get(name):
+            filters[name] = int(params[name]) if name == 'user_id' else params[name]
+    return filters
+
+
+def _sqlite_page_sql(date_from, date_to, filters, cursor_values, page_size):
+    """
+    (sql, params) of one page from the live table and the month tables
+    overlapping [date_from, date_to), merged by a single UNION ALL.
+    """
+    partitions = AuditLogPartition.objects.all()
+    if date_from:
+        partitions = partitions.filter(period_end__gt=date_from)
+    if date_to:
+        partitions = partitions.filter(period_start__lt=date_to)
+    tables = [LIVE_TABLE] + list(partitions.values_list('table_name', flat=True))
+
+    where, params = [], []
+    if date_from:
+        where.append('"timestamp" >= %s')
+        params.append(_adapt(date_from))
+    if date_to:
+        where.append('"timestamp" < %s')
+        params.append(_adapt(date_to))
+    for name, value in filters.items():
+        where.append(f'{_quote(name)} = %s')
+        params.append(value)
+    if cursor_values:
+        timestamp, last_id = _adapt(cursor_values[0]), cursor_values[1]
+        where.append('("timestamp" < %s OR ("timestamp" = %s AND "id" < %s))')
+        params += [timestamp, timestamp, last_id]
+
+    columns = ', '.join(_quote(c) for c in COLUMNS)
+    order = 'ORDER BY "timestamp" DESC, "id" DESC'
+    limit = f'LIMIT {int(page_size) + 1}'
+    branch = (f'SELECT * FROM (SELECT {columns} FROM {{table}} '
+              f'{"WHERE " + " AND ".join(where) if where else ""} {order} {limit})')
+    sql = ' UNION ALL '.join(branch.format(table=_quote(table)) for table in tables) + f' {order} {limit}'
+    return sql, params * len(tables)
+
+
+def _sqlite_rows(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = [dict(zip(COLUMNS, row)) for row in cursor.fetchall()]
+    for row in rows:
+        value = row['timestamp']
+        if isinstance(value, str):
+            value = parse_datetime(value)
+        row['timestamp'] = timezone.make_aware(value, datetime.timezone.utc) if timezone.is_naive(value) else value
+    return rows
+
+
+def audit_page_query(params, cursor_values=None, page_size=50):
+    """
+    The query one audit log page runs: on SQLite the (sql, params) of the
+    UNION over the live and month tables, elsewhere a queryset (partitions
+    are transparent to it). Both read page_size + 1 rows.
+    """
+    date_from, date_to = params.get('date_from'), params.get('date_to')
+    filters = _filters(params)
+    if connection.vendor == 'sqlite':
+        return _sqlite_page_sql(date_from, date_to, filters, cursor_values, page_size)
+    queryset = AuditLog.objects.filter(**filters)
+    if date_from:
+        queryset = queryset.filter(timestamp__gte=date_from)
+    if date_to:
+        queryset = queryset.filter(timestamp__lt=date_to)
+    return keyset_page(queryset.values(*COLUMNS), ORDERING, cursor_values, page_size)
+
+
+def _decode_cursor(cursor):
+    """
+    The (timestamp, id) a page cursor holds. Raises InvalidCursor unless
+    they are an ISO datetime string and an integer.
+    """
+    timestamp, last_id = decode_cursor(cursor, len(ORDERING))
+    try:
+        timestamp = parse_datetime(timestamp) if isinstance(timestamp, str) else None
+    except ValueError:
+        timestamp = None
+    if timestamp is None or type(last_id) is not int:
+        raise InvalidCursor('Invalid cursor')
+    return timestamp, last_id
+
+
+def audit_log_page(params, cursor=None, page_size=50):
+    """
+    Return (rows, next_cursor) for one page of audit logs, newest first.
+    params: date_from and date_to (datetimes; the range is [from, to)) and
+    the FILTERS. Raises ValueError for a malformed user_id and InvalidCursor
+    for a malformed cursor.
+    """
+    cursor_values = _decode_cursor(cursor) if cursor else None
+    query = audit_page_query(params, cursor_values, page_size)
+    rows = _sqlite_rows(*query) if connection.vendor == 'sqlite' else list(query)
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(keyset_values(rows[-1], ORDERING))
+    usernames = dict(User.objects.filter(id__in={row['user_id'] for row in rows}).values_list('id', 'username'))
+    for row in rows:
+        row['username'] = usernames.get(row['user_id'])
+    return rows, next_cursor
@@ -0,0 +1,111 @@
+"""
+Helpers shared by the benchmark management commands.
+
+Benchmarks seed their own data inside a transaction that is rolled back at the
+end, so they can be pointed at a development database without leaving rows
+behind.
+"""
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import List
+
+from django.db import connection, transaction
+
+from .models import User, Department, Semester, Section, Subject
+
+
+class QueryCounter:
+    """
+    connection.execute_wrapper hook that counts executed statements.
+    """
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class _Rollback(Exception):
+    pass
+
+
+@contextmanager
+def rolled_back():
+    """
+    Run the block in a transaction and always roll it back.
+    """
+    try:
+        with transaction.atomic():
+            yield
+            raise _Rollback
+    except _Rollback:
+        pass
+
+
+def measure(func, *args, **kwargs):
+    """
+    Call `func` and return (result, elapsed seconds, number of SQL statements).
+    """
+    # Counted with an execute wrapper rather than connection.queries, whose
+    # log is capped at 9000 entries.
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+    return result, elapsed, counter.count
+
+
+def percentile(samples, pct):
+    """
+    Nearest-rank percentile of a list of numbers.
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+@dataclass
+class SeededSection:
+    department: Department
+    semester: Semester
+    section: Section
+    subject: Subject
+    faculty: User
+    student_ids: List[int]
+
+
+def seed_section(size, prefix='bench'):
+    """
+    Create a department with one semester, section, subject, faculty member and
+    `size` students. Passwords are left unusable to keep seeding cheap.
+    """
+    department = Department.objects.create(name=f'{prefix} department', code=f'{prefix}-D')
+    semester = Semester.objects.create(number=1, academic_year='2099-00', department=department)
+    section = Section.objects.create(name='A', semester=semester, student_count=size)
+    faculty = User.objects.create(
+        username=f'{prefix}-faculty', role='faculty', department=department, password='!'
+    )
+    subject = Subject.objects.create(
+        name=f'{prefix} subject', code=f'{prefix}-S', credits=4,
+        semester=semester, department=department, faculty_assigned=faculty,
+    )
+    students = User.objects.bulk_create([
+        User(
+            username=f'{prefix}-student-{i}', role='student', password='!',
+            department=department, semester=semester, section=section,
+        )
+        for i in range(size)
+    ])
+    return SeededSection(
+        department=department,
+        semester=semester,
+        section=section,
+        subject=subject,
+        faculty=faculty,
+        student_ids=[student.id for student in students],
+    )
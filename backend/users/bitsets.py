@@ -0,0 +1,49 @@
+"""
+Packing helpers for the compact AttendanceSession storage mode.
+
+A roster is stored as little-endian signed 64-bit ids and presence as a
+little-endian bitmap where bit i belongs to roster[i].
+"""
+import sys
+from array import array
+
+
+def pack_ids(ids):
+    packed = array('q', ids)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack_ids(data):
+    unpacked = array('q')
+    unpacked.frombytes(bytes(data))
+    if sys.byteorder == 'big':
+        unpacked.byteswap()
+    return unpacked.tolist()
+
+
+def pack_bits(flags):
+    flags = list(flags)
+    packed = bytearray((len(flags) + 7) // 8)
+    for index, flag in enumerate(flags):
+        if flag:
+            packed[index >> 3] |= 1 << (index & 7)
+    return bytes(packed)
+
+
+def unpack_bits(data, size):
+    data = bytes(data)
+    return [bool(data[index >> 3] & (1 << (index & 7))) for index in range(size)]
+
+
+def test_bit(data, index):
+    data = bytes(data)
+    return index >> 3 < len(data) and bool(data[index >> 3] & (1 << (index & 7)))
+
+
+def popcount(data):
+    value = int.from_bytes(bytes(data), 'little')
+    if hasattr(value, 'bit_count'):
+        return value.bit_count()
+    return bin(value).count('1')
@@ -0,0 +1,199 @@
+"""
+Per-process filter in front of the refresh-token blacklist.
+
+Every refresh and logout checks whether a token's JTI is blacklisted. The
+filter answers "definitely not" from a Bloom filter of all blacklisted JTIs,
+so the database is only queried when the filter reports a possible hit
+(a real hit or a false positive at roughly JTI_BLACKLIST_ERROR_RATE).
+
+The filter is loaded on first use (or by warm() at startup) and kept current
+by reading BlacklistedToken rows newer than the last one seen, at most once
+every JTI_BLACKLIST_SYNC_INTERVAL seconds. Tokens blacklisted by this process
+are added immediately; one blacklisted by another process can be missed for up
+to the sync interval.
+
+Ids are handed out when a row is inserted, not when it commits, so under
+concurrent logouts a row can become visible after one with a higher id (on
+PostgreSQL; SQLite has a single writer). Ids skipped by a sync are kept as
+gaps and read again by later syncs until they turn up, or for
+JTI_BLACKLIST_GAP_TIMEOUT seconds: long enough for the transaction that
+holds one to commit, after which the gap is taken for a rollback.
+
+The database is read outside the lock that checks use, by one thread at a
+time; the others carry on with the current filter meanwhile.
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import Q
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+logger = logging.getLogger(__name__)
+
+MIN_CAPACITY = 10000
+# Most ids tracked as gaps, counting back from the newest id seen.
+MAX_GAPS = 10000
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class JTIBlacklist:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._filter = None
+        self._last_id = 0
+        self._gaps = {}  # id -> monotonic time it was first found missing
+        self._synced_at = 0.0
+        self._added = None  # JTIs added while a new filter is built
+
+    @property
+    def sync_interval(self):
+        return getattr(settings, 'JTI_BLACKLIST_SYNC_INTERVAL', 2)
+
+    def _rows(self, after_id, gap_ids=()):
+        condition = Q(id__gt=after_id)
+        if gap_ids:
+            condition |= Q(id__in=list(gap_ids))
+        return (
+            BlacklistedToken.objects.filter(condition)
+            .order_by('id').values_list('id', 'token__jti')
+            .iterator(chunk_size=10000)
+        )
+
+    @staticmethod
+    def _find_gaps(gaps, seen, low, high, now):
+        """
+        `gaps` updated with the ids in (low, high] missing from `seen`, less
+        the ids seen and the gaps older than JTI_BLACKLIST_GAP_TIMEOUT.
+        """
+        timeout = getattr(settings, 'JTI_BLACKLIST_GAP_TIMEOUT', 60)
+        gaps = {gap: since for gap, since in gaps.items() if gap not in seen and now - since < timeout}
+        # A jump in the id sequence is not worth tracking id by id.
+        for gap in range(max(low, high - MAX_GAPS) + 1, high):
+            if gap not in seen:
+                gaps.setdefault(gap, now)
+        return gaps
+
+    def _build(self):
+        """
+        A new (filter, last id, gaps) from every blacklisted token.
+        """
+        capacity = max(MIN_CAPACITY, 2 * BlacklistedToken.objects.count())
+        bloom = BloomFilter(capacity, getattr(settings, 'JTI_BLACKLIST_ERROR_RATE', 0.001))
+        last_id, recent = 0, deque(maxlen=MAX_GAPS)
+        for last_id, jti in self._rows(0):
+            bloom.add(jti)
+            recent.append(last_id)
+        return bloom, last_id, self._find_gaps({}, set(recent), 0, last_id, time.monotonic())
+
+    def _load(self):
+        with self._lock:
+            self._added = []
+        try:
+            bloom, last_id, gaps = self._build()
+        finally:
+            with self._lock:
+                added, self._added = self._added, None
+        with self._lock:
+            # Blacklisted here while the rows were being read.
+            for jti in added:
+                bloom.add(jti)
+            self._filter, self._last_id, self._gaps = bloom, last_id, gaps
+            self._synced_at = time.monotonic()
+
+    def _sync(self):
+        with self._lock:
+            loaded = self._filter is not None
+            if loaded and time.monotonic() - self._synced_at < self.sync_interval:
+                return
+        # Without a filter every check has to wait for one.
+        if not self._sync_lock.acquire(blocking=not loaded):
+            return
+        try:
+            with self._lock:
+                # Another thread may have synced, or reset(), in the meantime.
+                loaded = self._filter is not None
+                due = not loaded or time.monotonic() - self._synced_at >= self.sync_interval
+                last_id, gaps = self._last_id, self._gaps
+            if not loaded:
+                self._load()
+                return
+            if not due:
+                return
+            rows = list(self._rows(last_id, gaps))
+            seen = {row_id for row_id, jti in rows}
+            high = max(seen | {last_id})
+            gaps = self._find_gaps(gaps, seen, last_id, high, time.monotonic())
+            with self._lock:
+                if self._filter is None:
+                    return
+                for row_id, jti in rows:
+                    self._filter.add(jti)
+                self._last_id, self._gaps = high, gaps
+                self._synced_at = time.monotonic()
+                # Past capacity the false positive rate climbs; resize.
+                resize = self._filter.count > self._filter.capacity
+            if resize:
+                self._load()
+        finally:
+            self._sync_lock.release()
+
+    def warm(self):
+        """
+        Load the filter now rather than on the first check. A database that is
+        not reachable or migrated yet is logged and left for the first check.
+        """
+        with self._sync_lock:
+            try:
+                self._load()
+            except DatabaseError:
+                logger.warning('JTI blacklist filter not warmed', exc_info=True)
+
+    def reset(self):
+        with self._lock:
+            self._filter = None
+
+    def add(self, jti):
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(jti)
+            if self._added is not None:
+                self._added.append(jti)
+
+    def is_blacklisted(self, jti):
+        self._sync()
+        with self._lock:
+            # No filter after a concurrent reset(): ask the database.
+            possible = self._filter is None or jti in self._filter
+        return possible and BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+
+jti_blacklist = JTIBlacklist()
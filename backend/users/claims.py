@@ -0,0 +1,140 @@
+"""
+State behind claims-based authentication.
+
+Access tokens carry the user's role, department, semester and section, so
+authentication does not read the User row. What cannot be signed into a token
+is whether it is still valid: User.token_version is bumped whenever a claim
+(or is_active) changes, and the current (token_version, is_active) pair is kept
+in Django's cache for CLAIMS_USER_CACHE_TTL seconds. With a per-process cache
+backend such as LocMemCache, other processes see a bump once their entry
+expires; use a shared backend to make revocation immediate.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+ROLE_CLAIM = 'role'
+DEPARTMENT_CLAIM = 'department_id'
+SEMESTER_CLAIM = 'semester_id'
+SECTION_CLAIM = 'section_id'
+USERNAME_CLAIM = 'username'
+TOKEN_VERSION_CLAIM = 'ver'
+
+
+def _ttl():
+    return getattr(settings, 'CLAIMS_USER_CACHE_TTL', 60)
+
+
+class TTLCache:
+    """
+    Small thread-safe LRU mapping whose entries expire after `ttl` seconds.
+    A ttl of 0 disables it.
+    """
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if not self.ttl:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# Full User rows for the rare code paths that need more than the claims.
+user_cache = TTLCache(
+    maxsize=getattr(settings, 'CLAIMS_USER_CACHE_SIZE', 1024),
+    ttl=_ttl(),
+)
+
+
+def _state_key(user_id):
+    return f'users:token-state:{user_id}'
+
+
+def token_state(user_id, refresh=False):
+    """
+    (token_version, is_active) for `user_id`, or None if the user does not
+    exist. Served from the cache unless `refresh`.
+    """
+    key = _state_key(user_id)
+    state = None if refresh else cache.get(key)
+    if state is None:
+        row = get_user_model().objects.filter(pk=user_id).values_list('token_version', 'is_active').first()
+        if row is None:
+            return None
+        state = tuple(row)
+        cache.set(key, state, _ttl())
+    return state
+
+
+def publish_token_state(user):
+    """
+    Record a saved user's current token state, so tokens carrying an older
+    version are refused from the next request on.
+    """
+    cache.set(_state_key(user.pk), (user.token_version, user.is_active), _ttl())
+    user_cache.pop(user.pk)
+
+
+def forget_token_state(user_ids):
+    """
+    Drop the cached token state of users updated without save(), so their
+    next request reads it from the database.
+    """
+    user_ids = list(user_ids)
+    cache.delete_many([_state_key(user_id) for user_id in user_ids])
+    for user_id in user_ids:
+        user_cache.pop(user_id)
+
+
+def cached_user(user_id):
+    """
+    The full User row for `user_id`, read through the process-local TTL cache.
+    """
+    user = user_cache.get(user_id)
+    if user is None:
+        user = get_user_model().objects.filter(pk=user_id).first()
+        if user is not None:
+            user_cache.set(user_id, user)
+    return user
+
+
+def user_claims(user):
+    return {
+        USERNAME_CLAIM: user.username,
+        ROLE_CLAIM: user.role,
+        DEPARTMENT_CLAIM: user.department_id,
+        SEMESTER_CLAIM: user.semester_id,
+        SECTION_CLAIM: user.section_id,
+        TOKEN_VERSION_CLAIM: user.token_version,
+    }
@@ -0,0 +1,192 @@
+"""
+Cached counters for the admin and HOD dashboards.
+
+Each counter is its own cache key. Creates and deletes adjust it with
+cache.incr()/decr() once the transaction commits (see users/signals.py), so a
+dashboard read is one get_many(). A key that is missing is recounted from
+the database on the next read. Keys expire after DASHBOARD_STATS_TTL seconds,
+and `manage.py reconcile_dashboard_stats` recounts everything on demand, which
+bounds any drift from writes that bypass signals (QuerySet.update, bulk_create,
+raw SQL).
+
+Per-department keys carry a generation number. Changes whose effect on the
+breakdown is not known from the signal alone, such as a subject moved between
+departments or a department deleted with users SET_NULL, bump the generation.
+Every breakdown is then recounted lazily.
+
+Increments land in the configured cache. With a per-process backend such as
+LocMemCache, other processes only see them after their own keys expire, so
+production should point CACHES at a shared backend.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import User, Department, Semester, Section, Subject
+
+TOTALS = {
+    'user_count': User,
+    'department_count': Department,
+    'semester_count': Semester,
+    'section_count': Section,
+    'subject_count': Subject,
+}
+ROLES = [role for role, _ in User.ROLE_CHOICES]
+DEPARTMENT_COUNTERS = [f'{role}_count' for role in ROLES] + ['semester_count', 'section_count', 'subject_count']
+
+GENERATION_KEY = 'dashboard:generation'
+
+
+def _ttl():
+    return getattr(settings, 'DASHBOARD_STATS_TTL', 300)
+
+
+def _total_key(name):
+    return f'dashboard:total:{name}'
+
+
+def _generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, 0, None)
+        generation = cache.get(GENERATION_KEY, 0)
+    return generation
+
+
+def _department_key(generation, department_id, name):
+    return f'dashboard:dept:{generation}:{department_id}:{name}'
+
+
+def _count_totals():
+    return {name: model.objects.count() for name, model in TOTALS.items()}
+
+
+def _count_departments(department_ids=None):
+    """
+    {department_id: {counter: value}} for `department_ids` (all when None).
+    """
+    departments = Department.objects.all()
+    if department_ids is not None:
+        departments = departments.filter(id__in=department_ids)
+    counts = {department_id: dict.fromkeys(DEPARTMENT_COUNTERS, 0)
+              for department_id in departments.values_list('id', flat=True)}
+
+    def add(rows, name=None):
+        for row in rows:
+            department_id = row['department_id']
+            if department_id in counts:
+                counts[department_id][name or f"{row['role']}_count"] = row['n']
+
+    ids = list(counts)
+    add(User.objects.filter(department_id__in=ids).order_by()
+        .values('department_id', 'role').annotate(n=Count('id')))
+    add(Semester.objects.filter(department_id__in=ids).order_by()
+        .values('department_id').annotate(n=Count('id')), 'semester_count')
+    add(Section.objects.filter(semester__department_id__in=ids).order_by()
+        .values(department_id=F('semester__department_id')).annotate(n=Count('id')), 'section_count')
+    add(Subject.objects.filter(department_id__in=ids).order_by()
+        .values('department_id').annotate(n=Count('id')), 'subject_count')
+    return counts
+
+
+def totals():
+    """
+    System-wide counters, recounting any that are not cached.
+    """
+    keys = {_total_key(name): name for name in TOTALS}
+    cached = cache.get_many(keys)
+    result = {keys[key]: value for key, value in cached.items()}
+    missing = [name for name in TOTALS if name not in result]
+    if missing:
+        counted = {name: TOTALS[name].objects.count() for name in missing}
+        for name, value in counted.items():
+            cache.add(_total_key(name), value, _ttl())
+        result.update(counted)
+    return {name: result[name] for name in TOTALS}
+
+
+def department_stats(department_id):
+    """
+    Counters for one department, recounted in one pass if any is missing.
+    """
+    generation = _generation()
+    keys = {_department_key(generation, department_id, name): name for name in DEPARTMENT_COUNTERS}
+    cached = cache.get_many(keys)
+    if len(cached) == len(keys):
+        return {keys[key]: value for key, value in cached.items()}
+    counted = _count_departments([department_id]).get(department_id, dict.fromkeys(DEPARTMENT_COUNTERS, 0))
+    for name, value in counted.items():
+        cache.add(_department_key(generation, department_id, name), value, _ttl())
+    return counted
+
+
+def _apply(key, delta):
+    try:
+        if delta > 0:
+            cache.incr(key, delta)
+        else:
+            cache.decr(key, -delta)
+    except ValueError:
+        # Not cached: the next read recounts it.
+        pass
+
+
+def adjust(total=None, department_id=None, counter=None, delta=1):
+    """
+    Add `delta` to a total and/or a department counter after commit.
+    """
+    def apply():
+        if total:
+            _apply(_total_key(total), delta)
+        if department_id and counter:
+            _apply(_department_key(_generation(), department_id, counter), delta)
+    transaction.on_commit(apply)
+
+
+def invalidate_departments():
+    """
+    Drop every department breakdown at once, after commit.
+    """
+    def bump():
+        _generation()
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            pass
+    transaction.on_commit(bump)
+
+
+def invalidate():
+    """
+    Drop all counters, after writes that bypassed the signals.
+    """
+    transaction.on_commit(lambda: cache.delete_many([_total_key(name) for name in TOTALS]))
+    invalidate_departments()
+
+
+def reconcile():
+    """
+    Recount everything from the database and overwrite the cache. Returns
+    {counter: (cached, actual)} for the counters that had drifted.
+    """
+    drift = {}
+    counted = _count_totals()
+    keys = {name: _total_key(name) for name in counted}
+    cached = cache.get_many(keys.values())
+    for name, value in counted.items():
+        previous = cached.get(keys[name])
+        if previous is not None and previous != value:
+            drift[name] = (previous, value)
+    cache.set_many({keys[name]: value for name, value in counted.items()}, _ttl())
+
+    generation = _generation()
+    for department_id, values in _count_departments().items():
+        dept_keys = {name: _department_key(generation, department_id, name) for name in values}
+        cached = cache.get_many(dept_keys.values())
+        for name, value in values.items():
+            previous = cached.get(dept_keys[name])
+            if previous is not None and previous != value:
+                drift[f'department {department_id} {name}'] = (previous, value)
+        cache.set_many({dept_keys[name]: value for name, value in values.items()}, _ttl())
+    return drift
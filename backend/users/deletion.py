@@ -0,0 +1,362 @@
+"""
+Background deletion of departments and users.
+
+Deleting a department cascades to its semesters, sections and subjects and
+from there to every attendance row, session and rollup recorded against
+them. Deleting a user cascades to their attendance, notifications and audit
+entries. Done in one dept.delete() that is a single long transaction. It
+holds the write lock for its whole length, which on SQLite blocks every
+other writer.
+
+schedule_deletion() instead marks the object pending_delete (a user is also
+deactivated, which revokes their tokens) and creates a DeletionJob. Reads
+leave pending objects out from then on. A worker thread, started when the
+job commits, removes the dependents bottom-up in chunks of
+DELETION_CHUNK_SIZE rows, each chunk in its own transaction:
+
+1. Rows that reference the doomed ones through a SET_NULL foreign key are
+   detached. Users detached this way get a new token version, since their
+   department, semester or section is signed into their tokens.
+2. Rows that cascade from the object are deleted, children before parents,
+   and the object itself last. Each chunk goes through QuerySet.delete(), so
+   signals are sent and anything added since the plan was made still
+   cascades.
+
+Progress (total_rows, rows_done, current_step) is saved with every chunk.
+A running job whose heartbeat is older than DELETION_STALE_AFTER seconds,
+because its process died, is taken over by the next worker or by
+`manage.py run_deletion_jobs`. Every step re-reads what is left, so resuming
+repeats nothing.
+
+A job that raises is retried after DELETION_RETRY_DELAY seconds, doubled
+after each attempt, until DELETION_MAX_ATTEMPTS attempts have been made.
+It then stays failed and its object is shown again, with whatever is left
+of it (a user stays deactivated), rather than hidden for good;
+`manage.py run_deletion_jobs --retry-failed` queues it again.
+"""
+import datetime
+import logging
+import os
+import threading
+import time
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.db.models.deletion import CASCADE, SET_NULL, get_candidate_relations_to_delete
+from django.utils import timezone
+
+from . import audit_partitions, claims
+from .models import User, Department, AuditLog, DeletionJob
+
+logger = logging.getLogger(__name__)
+
+DELETABLE = {model._meta.label: model for model in (User, Department)}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class _LostClaim(Exception):
+    """
+    Another worker took the job over after its heartbeat went stale.
+    """
+
+
+# Planning
+
+class Step:
+    """
+    One pass over the rows of `model` matching any of `lookups`, each a
+    filter path from the model to the primary key of the object being
+    deleted. kind is 'set_null' (with `field`), 'audit_partitions' or
+    'delete'.
+    """
+    def __init__(self, kind, model, lookups, field=None):
+        self.kind = kind
+        self.model = model
+        self.lookups = lookups
+        self.field = field
+
+    def __str__(self):
+        if self.kind == 'set_null':
+            return f'detach {self.model._meta.label}.{self.field.name}'
+        if self.kind == 'audit_partitions':
+            return 'delete audit log month tables'
+        return f'delete {self.model._meta.label}'
+
+    def queryset(self, object_id):
+        condition = reduce(or_, (Q(**{lookup: object_id}) for lookup in self.lookups))
+        return self.model._base_manager.filter(condition).order_by()
+
+
+def plan(model):
+    """
+    The steps that delete an instance of `model` and everything cascading
+    from it, in execution order.
+    """
+    cascade = {}  # model -> lookups, children first, in first-finished order
+    detach = {}  # (model, field) -> lookups
+
+    def visit(model, lookup, stack):
+        for relation in get_candidate_relations_to_delete(model._meta):
+            field = relation.field
+            related = relation.related_model._meta.concrete_model
+            child_lookup = f'{field.name}__{lookup}'
+            on_delete = field.remote_field.on_delete
+            if on_delete is SET_NULL:
+                detach.setdefault((related, field), []).append(child_lookup)
+            elif on_delete is CASCADE and related not in stack:
+                visit(related, child_lookup, stack | {related})
+            # PROTECT, RESTRICT and the rest are left to QuerySet.delete().
+        cascade.setdefault(model, []).append(lookup)
+
+    model = model._meta.concrete_model
+    visit(model, 'pk', {model})
+    steps = [Step('set_null', related, lookups, field) for (related, field), lookups in detach.items()]
+    if AuditLog in cascade:
+        steps.append(Step('audit_partitions', User, cascade[User]))
+    steps += [Step('delete', related, lookups) for related, lookups in cascade.items()]
+    return steps
+
+
+def _remaining(step, object_id):
+    if step.kind == 'audit_partitions':
+        return audit_partitions.count_for_users(step.queryset(object_id).values_list('pk', flat=True))
+    return step.queryset(object_id).values('pk').distinct().count()
+
+
+# Execution
+
+def _chunk(step, object_id, size):
+    """
+    Run one chunk of `step` and return the number of rows it touched.
+    """
+    if step.kind == 'audit_partitions':
+        user_ids = list(step.queryset(object_id).values_list('pk', flat=True))
+        return audit_partitions.delete_for_users(user_ids, limit=size)
+    ids = list(step.queryset(object_id).values_list('pk', flat=True).distinct()[:size])
+    if not ids:
+        return 0
+    rows = step.model._base_manager.filter(pk__in=ids)
+    if step.kind == 'delete':
+        rows.delete()
+        return len(ids)
+    changes = {step.field.attname: None}
+    if step.model is User:
+        changes['token_version'] = F('token_version') + 1
+        transaction.on_commit(lambda: claims.forget_token_state(ids))
+    rows.update(**changes)
+    return len(ids)
+
+
+def _heartbeat(job, beat, **changes):
+    now = timezone.now()
+    # Filtering on the previous heartbeat makes the update a claim check.
+    if not DeletionJob.objects.filter(pk=job.pk, heartbeat_at=beat).update(heartbeat_at=now, **changes):
+        raise _LostClaim()
+    return now
+
+
+def run_job(job):
+    """
+    Carry out a claimed job. Returns False if another worker took it over.
+    """
+    model = DELETABLE[job.model]
+    steps = plan(model)
+    size = _setting('DELETION_CHUNK_SIZE', 500)
+    pause = _setting('DELETION_CHUNK_PAUSE', 0)
+    beat = job.heartbeat_at
+    try:
+        remaining = sum(_remaining(step, job.object_id) for step in steps)
+        beat = _heartbeat(job, beat, total_rows=F('rows_done') + remaining)
+        for step in steps:
+            beat = _heartbeat(job, beat, current_step=str(step))
+            while True:
+                with transaction.atomic():
+                    done = _chunk(step, job.object_id, size)
+                    if not done:
+                        break
+                    beat = _heartbeat(job, beat, rows_done=F('rows_done') + done)
+                if pause:
+                    time.sleep(pause)
+        _heartbeat(job, beat, status='done', current_step='', finished_at=timezone.now())
+    except _LostClaim:
+        logger.warning('Deletion job %s was taken over by another worker', job.pk)
+        return False
+    except Exception as e:
+        logger.exception('Deletion job %s failed', job.pk)
+        _fail(job, beat, e)
+    return True
+
+
+def _fail(job, beat, error):
+    now = timezone.now()
+    retry = job.attempts < _setting('DELETION_MAX_ATTEMPTS', 5)
+    delay = datetime.timedelta(seconds=_setting('DELETION_RETRY_DELAY', 60) * 2 ** max(job.attempts - 1, 0))
+    with transaction.atomic():
+        failed = DeletionJob.objects.filter(pk=job.pk, heartbeat_at=beat).update(
+            status='failed', error=repr(error), finished_at=now, retry_at=now + delay if retry else None,
+        )
+        if failed and not retry:
+            DELETABLE[job.model]._base_manager.filter(pk=job.object_id).update(pending_delete=False)
+
+
+def requeue_failed():
+    """
+    Queue every failed job again with its attempts reset, hiding its object
+    once more. Returns how many were queued.
+    """
+    count = 0
+    for job in DeletionJob.objects.filter(status='failed'):
+        with transaction.atomic():
+            if DeletionJob.objects.filter(pk=job.pk, status='failed').update(
+                status='pending', error='', finished_at=None, heartbeat_at=None, retry_at=None, attempts=0,
+            ):
+                DELETABLE[job.model]._base_manager.filter(pk=job.object_id).update(pending_delete=True)
+                count += 1
+    if count:
+        transaction.on_commit(deletion_worker.wake)
+    return count
+
+
+def claim_next():
+    """
+    Claim the oldest pending job, a running one whose worker stopped, or a
+    failed one due for a retry, and return it; None if there is none.
+    """
+    now = timezone.now()
+    stale = now - datetime.timedelta(seconds=_setting('DELETION_STALE_AFTER', 300))
+    claimable = (
+        Q(status='pending') | Q(status='running', heartbeat_at__lt=stale) | Q(status='failed', retry_at__lte=now)
+    )
+    for job in DeletionJob.objects.filter(claimable).order_by('created_at')[:10]:
+        now = timezone.now()
+        # Conditional on the row being unchanged, so two workers cannot both win.
+        claimed = DeletionJob.objects.filter(claimable, pk=job.pk, heartbeat_at=job.heartbeat_at).update(
+            status='running', started_at=job.started_at or now, heartbeat_at=now, retry_at=None,
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def _seconds_to_next_retry():
+    due = DeletionJob.objects.filter(status='failed', retry_at__isnull=False).order_by('retry_at').values_list(
+        'retry_at', flat=True,
+    ).first()
+    return None if due is None else max((due - timezone.now()).total_seconds(), 0.1)
+
+
+def run_pending():
+    """
+    Run jobs until none is left to claim. Returns how many were run.
+    """
+    count = 0
+    while True:
+        job = claim_next()
+        if job is None:
+            return count
+        run_job(job)
+        count += 1
+
+
+class DeletionWorker:
+    """
+    Per-process thread that runs deletion jobs. It starts when a job is
+    scheduled, waits for retries that are due, and stops after
+    DELETION_IDLE_TIMEOUT seconds without one.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def wake(self):
+        if not _setting('DELETION_ASYNC', True):
+            run_pending()
+            return
+        with self._lock:
+            self._wake.set()
+            # A thread inherited across a fork is not running in this process.
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='deletion-worker', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        idle = _setting('DELETION_IDLE_TIMEOUT', 60)
+        try:
+            while True:
+                self._wake.clear()
+                try:
+                    ran = run_pending()
+                    due = _seconds_to_next_retry()
+                except Exception:
+                    logger.exception('Deletion worker failed to claim a job')
+                    ran, due = 0, None
+                if ran:
+                    continue
+                if due is not None:
+                    self._wake.wait(due)
+                    continue
+                if self._wake.wait(idle):
+                    continue
+                with self._lock:
+                    # wake() sets the event under the lock, so a job scheduled
+                    # from here on starts a new thread.
+                    if not self._wake.is_set():
+                        self._thread = None
+                        return
+        finally:
+            connection.close()
+
+
+deletion_worker = DeletionWorker()
+
+
+def schedule_deletion(obj, requested_by=None):
+    """
+    Hide `obj` (a User or Department) from reads and queue a job deleting it
+    with everything that cascades from it. Returns the DeletionJob.
+    """
+    model = obj._meta.concrete_model
+    changes = {'pending_delete': True}
+    if model is User:
+        changes.update(is_active=False, token_version=F('token_version') + 1)
+    with transaction.atomic():
+        model._base_manager.filter(pk=obj.pk).update(**changes)
+        job = DeletionJob.objects.create(
+            model=model._meta.label, object_id=obj.pk, object_repr=str(obj)[:200],
+            requested_by_id=getattr(requested_by, 'pk', None),
+        )
+        if model is User:
+            transaction.on_commit(lambda: claims.forget_token_state([obj.pk]))
+        transaction.on_commit(deletion_worker.wake)
+    return job
+
+
+def job_status(job):
+    return {
+        'id': job.pk,
+        'model': job.model,
+        'object_id': job.object_id,
+        'object_repr': job.object_repr,
+        'status': job.status,
+        'total_rows': job.total_rows,
+        'rows_done': job.rows_done,
+        'current_step': job.current_step,
+        'error': job.error,
+        'attempts': job.attempts,
+        'retry_at': job.retry_at,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+    }
@@ -0,0 +1,149 @@
+"""
+User directory: filters, text search and keyset pagination over users.
+
+Search matches every whitespace-separated term against username, first and
+last name and email, through a text index rather than a LIKE scan:
+
+- SQLite: an FTS5 table (SEARCH_TABLE) keyed by user id, queried with prefix
+  terms. It is kept in sync by the User post_save/post_delete signals (see
+  users/signals.py); bulk writes that skip signals call index_users().
+- PostgreSQL: a pg_trgm GIN index on the concatenated fields, queried with
+  ILIKE '%term%'. The database maintains it, so nothing needs syncing.
+
+Other backends fall back to icontains filters.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import User
+from .pagination import paginate_keyset
+from .serializers import UserValuesSerializer
+
+SEARCH_TABLE = 'users_user_search'
+SEARCH_FIELDS = ('username', 'first_name', 'last_name', 'email')
+# Must match the expression of the trigram index in migration 0010.
+PG_SEARCH_EXPRESSION = "(username || ' ' || first_name || ' ' || last_name || ' ' || email)"
+
+DIRECTORY_ORDERING = ['username']
+ID_FILTERS = {
+    'department_id': 'department_id',
+    'semester_id': 'semester_id',
+    'section_id': 'section_id',
+}
+
+
+def _terms(query):
+    return [term for term in re.split(r'\W+', query or '') if term]
+
+
+def search_users(queryset, query):
+    """
+    Restrict `queryset` to users matching every term of `query`.
+    """
+    terms = _terms(query)
+    if not terms:
+        return queryset
+    if connection.vendor == 'sqlite':
+        match = ' AND '.join(f'"{term}"*' for term in terms)
+        return queryset.filter(id__in=RawSQL(
+            f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s', [match]
+        ))
+    if connection.vendor == 'postgresql':
+        where = ' AND '.join([f'{PG_SEARCH_EXPRESSION} ILIKE %s'] * len(terms))
+        return queryset.filter(id__in=RawSQL(
+            f'SELECT id FROM {User._meta.db_table} WHERE {where}',
+            [f'%{term}%' for term in terms],
+        ))
+    for term in terms:
+        condition = Q()
+        for field in SEARCH_FIELDS:
+            condition |= Q(**{f'{field}__icontains': term})
+        queryset = queryset.filter(condition)
+    return queryset
+
+
+def filter_users(queryset, params):
+    """
+    Apply directory filters from request query params: role, department_id,
+    semester_id, section_id, is_active and q (search). Raises ValueError for
+    malformed values.
+    """
+    role = params.get('role')
+    if role:
+        if role not in {choice for choice, _ in User.ROLE_CHOICES}:
+            raise ValueError(f'Unknown role {role!r}')
+        queryset = queryset.filter(role=role)
+    for param, field in ID_FILTERS.items():
+        if params.get(param):
+            queryset = queryset.filter(**{field: int(params[param])})
+    is_active = params.get('is_active')
+    if is_active:
+        if is_active.lower() not in ('true', 'false', '1', '0'):
+            raise ValueError('is_active must be true or false')
+        queryset = queryset.filter(is_active=is_active.lower() in ('true', '1'))
+    return search_users(queryset, params.get('q'))
+
+
+def directory_rows(queryset, params):
+    """
+    The directory's row values for the users of `queryset` matching `params`.
+    """
+    return UserValuesSerializer.values(filter_users(queryset, params))
+
+
+def directory_page(queryset, params, cursor=None, page_size=50):
+    """
+    Return (serialized users, next_cursor) for one page of the directory,
+    ordered by username.
+    """
+    rows, next_cursor = paginate_keyset(directory_rows(queryset, params), DIRECTORY_ORDERING, cursor, page_size)
+    return UserValuesSerializer(rows).data, next_cursor
+
+
+def index_users(user_ids):
+    """
+    Refresh the search rows of `user_ids` from the users table (SQLite only).
+    """
+    if connection.vendor != 'sqlite' or not user_ids:
+        return
+    user_ids = list(user_ids)
+    with connection.cursor() as cursor:
+        for start in range(0, len(user_ids), 500):
+            batch = user_ids[start:start + 500]
+            placeholders = ','.join(['%s'] * len(batch))
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})', batch)
+            cursor.execute(
+                f'INSERT INTO {SEARCH_TABLE} (rowid, {", ".join(SEARCH_FIELDS)}) '
+                f'SELECT id, {", ".join(SEARCH_FIELDS)} FROM {User._meta.db_table} WHERE id IN ({placeholders})',
+                batch,
+            )
+
+
+def unindex_users(user_ids):
+    if connection.vendor != 'sqlite' or not user_ids:
+        return
+    user_ids = list(user_ids)
+    with connection.cursor() as cursor:
+        for start in range(0, len(user_ids), 500):
+            batch = user_ids[start:start + 500]
+            cursor.execute(
+                f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({",".join(["%s"] * len(batch))})', batch
+            )
+
+
+def rebuild_index():
+    """
+    Repopulate the whole search table (SQLite only), e.g. after a bulk
+    QuerySet.update() of names or emails.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {SEARCH_TABLE} (rowid, {", ".join(SEARCH_FIELDS)}) '
+            f'SELECT id, {", ".join(SEARCH_FIELDS)} FROM {User._meta.db_table}'
+        )
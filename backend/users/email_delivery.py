@@ -0,0 +1,365 @@
+"""
+Email delivery of notifications, off the request path.
+
+Sending a notification stores it once (see users/notifications.py). Mailing
+it one recipient at a time from the request that sent it would keep that
+request open for the length of one SMTP conversation per recipient, minutes
+for a department-wide notice. Instead, queue() adds an EmailFanout row next
+to the notification, and a worker thread started when it commits does the
+rest:
+
+1. Recipients are resolved in bulk. The worker walks the notification's
+   audience in user id order, EMAIL_DELIVERY_RESOLVE_CHUNK users per
+   transaction, and inserts an EmailDelivery row for each user with an
+   email address. The (notification, recipient) unique key makes a repeated
+   chunk a no-op.
+2. Due deliveries are claimed EMAIL_DELIVERY_BATCH_SIZE at a time and sent
+   over a single connection, which is opened once and reused until the
+   queue runs dry. Each batch's outcomes are saved together. The worker
+   sends at most EMAIL_DELIVERY_RATE messages per second (0 means no
+   limit).
+
+A message refused with a 5xx reply fails for good, and so does one whose
+notification expired before its turn. Any other error is retried after
+EMAIL_DELIVERY_RETRY_DELAY seconds, doubled after each attempt, until
+EMAIL_DELIVERY_MAX_ATTEMPTS attempts have been made. A connection error
+also closes the connection and puts the rest of its batch back for a
+retry. If a worker dies mid-batch, its claimed deliveries are released
+after EMAIL_DELIVERY_STALE_AFTER seconds. Delivery is at least once: one
+of those may already have been sent.
+
+`manage.py run_email_deliveries` drains the queue outside the web process,
+for example for retries left behind by a restart.
+"""
+import datetime
+import logging
+import os
+import smtplib
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .models import User, EmailDelivery, EmailFanout
+from .push import BROADCAST_ROLE
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def queue(notifications):
+    """
+    Queue `notifications` (saved) for email delivery once the current
+    transaction commits.
+    """
+    if not _setting('NOTIFICATION_EMAIL', True) or not notifications:
+        return
+    EmailFanout.objects.bulk_create(
+        [EmailFanout(notification_id=notification.pk) for notification in notifications], ignore_conflicts=True,
+    )
+    transaction.on_commit(email_worker.wake)
+
+
+# Resolving recipients
+
+def recipients(notification):
+    """
+    Active users in the audience of `notification` who have an email
+    address; the same audience as notifications.audience() selects from
+    the other side.
+    """
+    users = User.objects.filter(is_active=True, pending_delete=False).exclude(email='')
+    if notification.recipient_id is not None:
+        return users.filter(pk=notification.recipient_id)
+    if notification.recipient_role != BROADCAST_ROLE:
+        users = users.filter(role=notification.recipient_role)
+    if notification.department_id is not None:
+        users = users.filter(department_id=notification.department_id)
+    return users
+
+
+def resolve_next():
+    """
+    Queue deliveries for the next chunk of recipients of the oldest
+    unresolved notification. Returns the number of recipients read, 0 when
+    every notification is resolved.
+    """
+    fanout = EmailFanout.objects.filter(resolved=False).select_related('notification').order_by('created_at').first()
+    if fanout is None:
+        return 0
+    size = _setting('EMAIL_DELIVERY_RESOLVE_CHUNK', 1000)
+    rows = list(
+        recipients(fanout.notification).filter(pk__gt=fanout.resolved_through)
+        .order_by('pk').values_list('pk', 'email')[:size]
+    )
+    now = timezone.now()
+    with transaction.atomic():
+        EmailDelivery.objects.bulk_create([
+            EmailDelivery(notification_id=fanout.pk, recipient_id=user_id, email=email, next_attempt_at=now)
+            for user_id, email in rows
+        ], ignore_conflicts=True)
+        through = rows[-1][0] if rows else fanout.resolved_through
+        # Another worker may have resolved further in the meantime.
+        EmailFanout.objects.filter(pk=fanout.pk, resolved_through__lte=through).update(
+            resolved_through=through, resolved=len(rows) < size,
+        )
+    # At least 1: the caller looks again until no fanout is left.
+    return max(len(rows), 1)
+
+
+# Sending
+
+class RateLimiter:
+    """
+    Spaces calls to wait() at least 1 / `rate` seconds apart; a rate of 0
+    does not wait.
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self._next = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self._next > now:
+            time.sleep(self._next - now)
+            now = self._next
+        self._next = now + self.interval
+
+
+def claim_batch(size):
+    """
+    Claim up to `size` due deliveries and return them, oldest due first.
+    """
+    now = timezone.now()
+    stale = now - datetime.timedelta(seconds=_setting('EMAIL_DELIVERY_STALE_AFTER', 600))
+    # Claimed by a worker that stopped before recording the outcome.
+    EmailDelivery.objects.filter(status='sending', claimed_at__lt=stale).update(status='pending', claimed_at=None)
+    ids = list(
+        EmailDelivery.objects.filter(status='pending', next_attempt_at__lte=now)
+        .order_by('next_attempt_at').values_list('pk', flat=True)[:size]
+    )
+    if not ids:
+        return []
+    # Conditional on the status, so a delivery claimed by another worker
+    # in between is left to it.
+    EmailDelivery.objects.filter(pk__in=ids, status='pending').update(
+        status='sending', claimed_at=now, attempts=F('attempts') + 1,
+    )
+    return list(
+        EmailDelivery.objects.filter(pk__in=ids, status='sending', claimed_at=now)
+        .select_related('notification').order_by('next_attempt_at', 'pk')
+    )
+
+
+def _message(delivery, connection):
+    notification = delivery.notification
+    return EmailMessage(
+        subject=notification.title, body=notification.message, to=[delivery.email], connection=connection,
+        headers={'X-Notification-Id': str(notification.pk)},
+    )
+
+
+def _refusal(error):
+    """
+    The SMTP reply code `error` carries, or None for a connection error.
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return min(code for code, message in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code
+    return None
+
+
+def _close(connection):
+    try:
+        connection.close()
+    except (smtplib.SMTPException, OSError):
+        pass  # Closing a broken connection.
+
+
+def send_batch(deliveries, connection, limiter):
+    """
+    Send claimed `deliveries` over `connection` and record the outcomes.
+    Returns a Counter of 'sent', 'retry' and 'failed'.
+    """
+    sent, retry, failed = [], [], []
+    try:
+        # Opened here rather than by send_messages(), which would close it
+        # again after every message. A no-op while it is open.
+        connection.open()
+    except (smtplib.SMTPException, OSError) as e:
+        _record(sent, [(delivery, e) for delivery in deliveries], failed)
+        return Counter(retry=len(deliveries))
+    now = timezone.now()
+    for index, delivery in enumerate(deliveries):
+        expires_at = delivery.notification.expires_at
+        if expires_at is not None and expires_at <= now:
+            failed.append((delivery, 'Notification expired before it was sent'))
+            continue
+        limiter.wait()
+        try:
+            connection.send_messages([_message(delivery, connection)])
+        except (smtplib.SMTPException, OSError) as e:
+            code = _refusal(e)
+            if code is not None and code >= 500:
+                failed.append((delivery, e))
+            elif code is not None and code != 421:
+                retry.append((delivery, e))
+            else:
+                # The connection is gone (421 closes it too): reopen on the
+                # next batch and retry the rest of this one with it.
+                _close(connection)
+                retry.extend((pending, e) for pending in deliveries[index:])
+                break
+        except Exception as e:
+            # A message that cannot be built will not be built next time.
+            logger.exception('Could not send email delivery %s', delivery.pk)
+            failed.append((delivery, e))
+        else:
+            sent.append(delivery)
+    _record(sent, retry, failed)
+    return Counter(sent=len(sent), retry=len(retry), failed=len(failed))
+
+
+def _record(sent, retry, failed):
+    now = timezone.now()
+    max_attempts = _setting('EMAIL_DELIVERY_MAX_ATTEMPTS', 5)
+    delay = _setting('EMAIL_DELIVERY_RETRY_DELAY', 60)
+    changed = []
+    for delivery, error in retry:
+        if delivery.attempts >= max_attempts:
+            failed.append((delivery, error))
+            continue
+        delivery.status = 'pending'
+        delivery.next_attempt_at = now + datetime.timedelta(seconds=delay * 2 ** (delivery.attempts - 1))
+        delivery.error = str(error)[:1000]
+        changed.append(delivery)
+    for delivery, error in failed:
+        delivery.status = 'failed'
+        delivery.error = str(error)[:1000]
+        changed.append(delivery)
+    with transaction.atomic():
+        if sent:
+            EmailDelivery.objects.filter(pk__in=[delivery.pk for delivery in sent]).update(
+                status='sent', sent_at=now, claimed_at=None, error='',
+            )
+        for delivery in changed:
+            delivery.claimed_at = None
+        EmailDelivery.objects.bulk_update(changed, ['status', 'next_attempt_at', 'claimed_at', 'error'])
+
+
+def run_pending(connection=None):
+    """
+    Resolve and send until nothing is due, over one connection (opened from
+    EMAIL_BACKEND unless given). Returns a Counter of outcomes.
+    """
+    size = _setting('EMAIL_DELIVERY_BATCH_SIZE', 100)
+    limiter = RateLimiter(_setting('EMAIL_DELIVERY_RATE', 0))
+    mail = connection or get_connection(fail_silently=False)
+    outcomes = Counter()
+    try:
+        while True:
+            # Resolving a chunk at a time lets the first emails of a large
+            # audience go out before the last recipients are read.
+            resolved = resolve_next()
+            while True:
+                batch = claim_batch(size)
+                if not batch:
+                    break
+                outcomes += send_batch(batch, mail, limiter)
+            if not resolved:
+                return outcomes
+    finally:
+        if connection is None:
+            _close(mail)
+
+
+def _seconds_to_next_due():
+    due = EmailDelivery.objects.filter(status='pending').order_by('next_attempt_at').values_list(
+        'next_attempt_at', flat=True,
+    ).first()
+    return None if due is None else max((due - timezone.now()).total_seconds(), 0.1)
+
+
+class EmailWorker:
+    """
+    Per-process thread that delivers queued emails. It starts when a
+    notification is queued, waits for retries that are due, and stops after
+    EMAIL_DELIVERY_IDLE_TIMEOUT seconds with nothing queued.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def wake(self):
+        if not _setting('EMAIL_DELIVERY_ASYNC', True):
+            run_pending()
+            return
+        with self._lock:
+            self._wake.set()
+            # A thread inherited across a fork is not running in this process.
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='email-worker', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        idle = _setting('EMAIL_DELIVERY_IDLE_TIMEOUT', 60)
+        try:
+            while True:
+                self._wake.clear()
+                try:
+                    run_pending()
+                    due = _seconds_to_next_due()
+                except Exception:
+                    logger.exception('Email worker failed')
+                    due = None
+                if due is not None:
+                    self._wake.wait(due)
+                    continue
+                if self._wake.wait(idle):
+                    continue
+                with self._lock:
+                    # wake() sets the event under the lock, so a notification
+                    # queued from here on starts a new thread.
+                    if not self._wake.is_set():
+                        self._thread = None
+                        return
+        finally:
+            connection.close()
+
+
+email_worker = EmailWorker()
+
+
+def delivery_status(notification, failures=50):
+    """
+    Delivery tracking for one notification: how far its recipients are
+    resolved, deliveries by status, and the latest failures.
+    """
+    fanout = EmailFanout.objects.filter(pk=notification.pk).first()
+    deliveries = EmailDelivery.objects.filter(notification=notification)
+    counts = dict(deliveries.order_by().values_list('status').annotate(count=Count('pk')))
+    failed = deliveries.filter(status='failed').order_by('-pk').values(
+        'recipient_id', 'email', 'attempts', 'error',
+    )[:failures]
+    return {
+        'notification': notification.pk,
+        'queued': fanout is not None,
+        'resolved': fanout is not None and fanout.resolved,
+        'counts': {status: counts.get(status, 0) for status, label in EmailDelivery.STATUS_CHOICES},
+        'failures': list(failed),
+    }
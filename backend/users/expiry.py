@@ -0,0 +1,100 @@
+"""
+Sweeping expired notifications.
+
+Inboxes leave out notifications whose expires_at has passed (see
+users/notifications.py), but the rows stay in the table and in its indexes
+until they are swept. sweep_expired(), run periodically by `manage.py
+sweep_expired_notifications`, deletes them in batches of
+NOTIFICATION_SWEEP_BATCH_SIZE. Each batch is its own short transaction,
+found through notif_expiry_idx, with NOTIFICATION_SWEEP_PAUSE seconds
+between batches so other writers get in. A sweep stops after
+NOTIFICATION_SWEEP_MAX_SECONDS and the next run carries on.
+
+Swept rows are first appended to a gzipped JSON-lines file per month in
+NOTIFICATION_ARCHIVE_DIR, unless it is empty. Deleting cascades to their
+email deliveries, and the unread counters are adjusted once per batch.
+"""
+import gzip
+import json
+import os
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Notification
+from .notifications import deferred_counts
+
+ARCHIVE_FIELDS = (
+    'id', 'title', 'message', 'sender_id', 'recipient_role', 'department_id', 'recipient_id', 'sent_at', 'expires_at',
+)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _archive(ids, directory, now):
+    """
+    Append notifications `ids` to DIRECTORY/notifications-YYYY-MM.jsonl.gz.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'notifications-{now:%Y-%m}.jsonl.gz')
+    rows = Notification.objects.filter(pk__in=ids).order_by('pk').values(*ARCHIVE_FIELDS)
+    # Appending adds a gzip member; readers see one stream.
+    with gzip.open(path, 'at', encoding='utf-8') as f:
+        for row in rows.iterator():
+            f.write(json.dumps(row, default=str) + '\n')
+    return path
+
+
+def expired(now, batch_size):
+    """
+    Ids of the next `batch_size` notifications that expired by `now`, found
+    through notif_expiry_idx.
+    """
+    return (
+        Notification.objects.filter(expires_at__lte=now)
+        .order_by('expires_at').values_list('pk', flat=True)[:batch_size]
+    )
+
+
+def sweep_expired(now=None, batch_size=None, max_seconds=None, pause=None, archive_dir=None):
+    """
+    Delete the notifications that expired by `now`, archiving them first.
+    Returns {'swept', 'batches', 'seconds', 'complete'}, complete being
+    False when the time budget ran out first.
+    """
+    now = now or timezone.now()
+    batch_size = batch_size or _setting('NOTIFICATION_SWEEP_BATCH_SIZE', 500)
+    max_seconds = _setting('NOTIFICATION_SWEEP_MAX_SECONDS', 300) if max_seconds is None else max_seconds
+    pause = _setting('NOTIFICATION_SWEEP_PAUSE', 0.05) if pause is None else pause
+    archive_dir = _setting('NOTIFICATION_ARCHIVE_DIR', None) if archive_dir is None else archive_dir
+    start = time.monotonic()
+    swept = batches = 0
+    complete = False
+    while True:
+        with transaction.atomic():
+            ids = list(expired(now, batch_size))
+            if ids:
+                if archive_dir:
+                    _archive(ids, str(archive_dir), now)
+                with deferred_counts():
+                    Notification.objects.filter(pk__in=ids).delete()
+        if ids:
+            swept += len(ids)
+            batches += 1
+        if len(ids) < batch_size:
+            complete = True
+            break
+        if max_seconds and time.monotonic() - start >= max_seconds:
+            break
+        if pause:
+            time.sleep(pause)
+    return {
+        'swept': swept,
+        'batches': batches,
+        'seconds': time.monotonic() - start,
+        'complete': complete,
+    }
@@ -0,0 +1,132 @@
+"""
+Streaming attendance export.
+
+Rows are read with QuerySet.iterator(chunk_size=...) (a server-side cursor on
+PostgreSQL) and encoded one at a time, so memory use does not depend on how
+many rows match.
+"""
+import csv
+import json
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .attendance import uses_session_storage
+from .models import User, Attendance, AttendanceSession
+
+EXPORT_COLUMNS = [
+    'date', 'student', 'student_name', 'subject_code', 'subject',
+    'section', 'semester', 'department', 'is_present', 'marked_by', 'marked_at',
+]
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+CHUNK_SIZE = 2000
+# Sessions whose students are looked up together.
+SESSION_CHUNK_SIZE = 200
+
+
+def _filter(queryset, filters, section_field):
+    if filters.get('department_id'):
+        queryset = queryset.filter(subject__department_id=filters['department_id'])
+    if filters.get('semester_id'):
+        queryset = queryset.filter(subject__semester_id=filters['semester_id'])
+    if filters.get('section_id'):
+        queryset = queryset.filter(**{section_field: filters['section_id']})
+    if filters.get('subject_id'):
+        queryset = queryset.filter(subject_id=filters['subject_id'])
+    if filters.get('date_from'):
+        queryset = queryset.filter(date__gte=filters['date_from'])
+    if filters.get('date_to'):
+        queryset = queryset.filter(date__lte=filters['date_to'])
+    return queryset
+
+
+def export_rows(filters):
+    """
+    The Attendance rows an export with `filters` reads (row storage).
+    """
+    return _filter(Attendance.objects.all(), filters, 'student__section_id').order_by().values_list(
+        'date', 'student__username', 'student__first_name', 'student__last_name',
+        'subject__code', 'subject__name', 'student__section__name', 'subject__semester__number',
+        'subject__department__code', 'is_present', 'marked_by__username', 'marked_at',
+    )
+
+
+def _iter_row_storage(filters):
+    rows = export_rows(filters)
+    for (date, username, first_name, last_name, subject_code, subject, section,
+         semester, department, is_present, marked_by, marked_at) in rows.iterator(chunk_size=CHUNK_SIZE):
+        yield (date, username, f'{first_name} {last_name}'.strip(), subject_code, subject,
+               section, semester, department, is_present, marked_by, marked_at)
+
+
+def _iter_session_storage(filters):
+    sessions = _filter(AttendanceSession.objects.all(), filters, 'section_id').order_by().values_list(
+        'date', 'roster', 'presence', 'subject__code', 'subject__name', 'section__name',
+        'subject__semester__number', 'subject__department__code', 'marked_by__username', 'marked_at',
+    ).iterator(chunk_size=CHUNK_SIZE)
+    # Student id -> (username, name), kept across chunks: a section's
+    # sessions share one roster, so most chunks need no lookup at all.
+    names = {}
+    while True:
+        chunk = [
+            (row, AttendanceSession(roster=row[1], presence=row[2]).student_view())
+            for row in islice(sessions, SESSION_CHUNK_SIZE)
+        ]
+        if not chunk:
+            return
+        missing = {student_id for row, view in chunk for student_id in view} - names.keys()
+        if missing:
+            names.update(
+                (student_id, (username, f'{first_name} {last_name}'.strip()))
+                for student_id, username, first_name, last_name in User.objects.filter(id__in=missing)
+                .values_list('id', 'username', 'first_name', 'last_name')
+            )
+        for (date, roster, presence, subject_code, subject, section, semester,
+             department, marked_by, marked_at), view in chunk:
+            for student_id, is_present in view.items():
+                username, name = names.get(student_id, (None, None))
+                yield (date, username, name, subject_code, subject,
+                       section, semester, department, is_present, marked_by, marked_at)
+
+
+def iter_attendance_rows(**filters):
+    """
+    Yield one tuple per attendance mark, in EXPORT_COLUMNS order. Accepts
+    department_id, semester_id, section_id, subject_id, date_from and date_to.
+    """
+    if uses_session_storage():
+        return _iter_session_storage(filters)
+    return _iter_row_storage(filters)
+
+
+class _Echo:
+    """
+    File-like object whose write() hands back the value, so csv.writer can
+    format one row at a time for a generator.
+    """
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_ndjson(rows):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(dict(zip(EXPORT_COLUMNS, row))) + '\n'
+
+
+def iter_export(export_format, rows):
+    if export_format == 'ndjson':
+        return iter_ndjson(rows)
+    return iter_csv(rows)
@@ -0,0 +1,276 @@
+"""
+Bulk user import from CSV, for onboarding an intake.
+
+The CSV is read row by row and handled in chunks. Department, semester and
+section references are resolved against lookups loaded once per import.
+Passwords are hashed across a process pool, because PBKDF2 holds a core for
+the whole hash, and each chunk is written with one bulk_create. Rows that
+fail validation are skipped and reported with their line number; the rest
+of the file is still imported.
+
+Rows without a password get an unusable one and cost no hashing, which is
+the fast path for large intakes whose students set a password through reset.
+"""
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from itertools import islice
+from multiprocessing import get_context
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+
+from . import dashboard
+from .directory import index_users
+from .models import User, Department, Semester, Section
+
+IMPORT_COLUMNS = [
+    'username', 'email', 'first_name', 'last_name', 'role',
+    'department', 'semester', 'academic_year', 'section', 'password',
+]
+REQUIRED_COLUMNS = {'username'}
+ROLES = {role for role, _ in User.ROLE_CHOICES}
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+
+class UserImportError(ValueError):
+    pass
+
+
+@dataclass
+class ImportReport:
+    dry_run: bool = False
+    rows: int = 0
+    created: int = 0
+    failed: int = 0
+    errors: list = field(default_factory=list)
+
+    def add_error(self, line, username, messages):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'username': username, 'errors': messages})
+
+    def as_dict(self):
+        return {
+            'dry_run': self.dry_run,
+            'rows': self.rows,
+            'created': self.created,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+class _Lookup:
+    """
+    Department codes, semesters and sections loaded once per import.
+    """
+    def __init__(self):
+        self.departments = dict(Department.objects.filter(pending_delete=False).values_list('code', 'id'))
+        self.semesters = {}
+        active = {}
+        for semester_id, department_id, number, academic_year, is_active in Semester.objects.values_list(
+            'id', 'department_id', 'number', 'academic_year', 'is_active'
+        ):
+            self.semesters[(department_id, number, academic_year)] = semester_id
+            if is_active:
+                # Two active semesters with one number is ambiguous without a year.
+                key = (department_id, number)
+                active[key] = None if key in active else semester_id
+        self.active_semesters = active
+        self.sections = {
+            (semester_id, name): section_id
+            for section_id, semester_id, name in Section.objects.values_list('id', 'semester_id', 'name')
+        }
+
+    def resolve(self, row, errors):
+        department_id = semester_id = section_id = None
+        code = row.get('department')
+        if code:
+            department_id = self.departments.get(code)
+            if department_id is None:
+                errors.append(f'Unknown department code {code!r}')
+                return None, None, None
+
+        number = row.get('semester')
+        if number:
+            if department_id is None:
+                errors.append('semester requires department')
+                return department_id, None, None
+            try:
+                number = int(number)
+            except ValueError:
+                errors.append(f'semester must be a number, got {number!r}')
+                return department_id, None, None
+            year = row.get('academic_year')
+            if year:
+                semester_id = self.semesters.get((department_id, number, year))
+            else:
+                semester_id = self.active_semesters.get((department_id, number))
+            if semester_id is None:
+                errors.append(f'No unique {"" if year else "active "}semester {number} in {code}'
+                              + (f' for {year}' if year else ''))
+                return department_id, None, None
+
+        name = row.get('section')
+        if name:
+            if semester_id is None:
+                errors.append('section requires semester')
+                return department_id, None, None
+            section_id = self.sections.get((semester_id, name))
+            if section_id is None:
+                errors.append(f'Unknown section {name!r} in semester {number}')
+        return department_id, semester_id, section_id
+
+
+def _init_worker(settings_module):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    django.setup()
+
+
+def _hash_pool(workers):
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=get_context('spawn'),
+        initializer=_init_worker,
+        initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'learning_platform.settings'),),
+    )
+
+
+def _clean(row):
+    return {key.strip().lower(): (value or '').strip() for key, value in row.items() if key}
+
+
+def _build_user(row, lookup, errors):
+    username = row.get('username', '')
+    try:
+        User.username_validator(username)
+    except ValidationError as e:
+        errors.extend(e.messages)
+    if not username:
+        errors.append('username is required')
+    elif len(username) > 150:
+        errors.append('username must be at most 150 characters')
+
+    email = row.get('email', '')
+    if email:
+        try:
+            validate_email(email)
+        except ValidationError:
+            errors.append(f'Invalid email {email!r}')
+
+    role = row.get('role') or 'student'
+    if role not in ROLES:
+        errors.append(f'role must be one of {sorted(ROLES)}')
+    department_id, semester_id, section_id = lookup.resolve(row, errors)
+    if role == 'student' and section_id is None and not errors:
+        errors.append('students need department, semester and section')
+
+    return User(
+        username=username, email=email,
+        first_name=row.get('first_name', '')[:150], last_name=row.get('last_name', '')[:150],
+        role=role, department_id=department_id, semester_id=semester_id, section_id=section_id,
+    )
+
+
+def _insert(users, lines, report):
+    """
+    Insert one chunk. If a concurrent writer took a username since the chunk
+    was checked, fall back to per-row savepoints to report just those rows.
+    """
+    try:
+        with transaction.atomic():
+            User.objects.bulk_create(users, batch_size=500)
+            # bulk_create sends no post_save, so index the chunk and drop the
+            # dashboard counters here.
+            index_users([user.pk for user in users])
+            dashboard.invalidate()
+        report.created += len(users)
+        return
+    except IntegrityError:
+        pass
+    for line, user in zip(lines, users):
+        try:
+            with transaction.atomic():
+                user.save(force_insert=True)
+            report.created += 1
+        except IntegrityError:
+            report.add_error(line, user.username, ['username already exists'])
+
+
+def import_users(stream, dry_run=False, chunk_size=CHUNK_SIZE, workers=None):
+    """
+    Import users from a text stream of CSV with an IMPORT_COLUMNS header
+    (only username is required; role defaults to student). department is a
+    department code, semester a number (the active one unless academic_year
+    is given) and section a section name. Returns an ImportReport.
+    """
+    workers = workers or getattr(settings, 'USER_IMPORT_HASH_WORKERS', None) or os.cpu_count() or 1
+    reader = csv.DictReader(stream)
+    columns = {name.strip().lower() for name in reader.fieldnames or [] if name}
+    missing = REQUIRED_COLUMNS - columns
+    if missing:
+        raise UserImportError(f'CSV is missing required columns: {sorted(missing)}')
+    unknown = columns - set(IMPORT_COLUMNS)
+    if unknown:
+        raise UserImportError(f'CSV has unknown columns: {sorted(unknown)}')
+
+    lookup = _Lookup()
+    report = ImportReport(dry_run=dry_run)
+    seen = set()
+    rows = enumerate(reader, start=2)  # line 1 is the header
+
+    with ExitStack() as stack:
+        pool = None
+        while True:
+            chunk = [(line, _clean(row)) for line, row in islice(rows, chunk_size)]
+            if not chunk:
+                break
+            report.rows += len(chunk)
+            existing = set(
+                User.objects.filter(username__in=[row.get('username') for _, row in chunk])
+                .values_list('username', flat=True)
+            )
+
+            users = []
+            lines, passwords = [], []
+            for line, row in chunk:
+                errors = []
+                user = _build_user(row, lookup, errors)
+                if user.username in existing or user.username in seen:
+                    errors.append('username already exists')
+                if errors:
+                    report.add_error(line, row.get('username'), errors)
+                    continue
+                seen.add(user.username)
+                users.append(user)
+                lines.append(line)
+                passwords.append(row.get('password'))
+
+            to_hash = [password for password in passwords if password]
+            if to_hash and not dry_run:
+                if workers > 1 and len(to_hash) > 1:
+                    if pool is None:
+                        pool = stack.enter_context(_hash_pool(workers))
+                    hashed = iter(pool.map(make_password, to_hash, chunksize=max(1, len(to_hash) // (workers * 4))))
+                else:
+                    hashed = iter([make_password(password) for password in to_hash])
+                for user, password in zip(users, passwords):
+                    user.password = next(hashed) if password else make_password(None)
+            else:
+                for user in users:
+                    user.password = make_password(None)
+
+            if dry_run:
+                report.created += len(users)
+            elif users:
+                _insert(users, lines, report)
+
+    return report
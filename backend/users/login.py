@@ -0,0 +1,179 @@
+"""
+Password verification for the login endpoint, off the request thread.
+
+PBKDF2 runs for hundreds of milliseconds per attempt. Verification is
+submitted to a small bounded thread pool (hashlib releases the GIL while
+hashing), so a login storm can use at most LOGIN_HASH_WORKERS cores and the
+remaining capacity keeps serving other endpoints. When the pool and its queue
+are full, logins fail fast with 503 and Retry-After instead of piling up. A
+per-process guard caps how many attempts for one username or one client IP
+may be in flight at once, so repeated wrong passwords cannot monopolize the
+pool.
+
+The login view is async and awaits the verification coroutine. While a hash
+runs in the pool, no thread is held for the request: the event loop serves
+other requests, and a login waiting its turn costs a pending future.
+
+Only the hash runs in the pool; the user lookup, signals and any hash upgrade
+run through sync_to_async on the request's thread and database connection.
+The pool stands in for ModelBackend, so it is only used when that is the
+sole entry in AUTHENTICATION_BACKENDS; with any other backends configured,
+credentials go through authenticate() on the request's thread, still under
+the guard.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import authenticate, get_user_model, user_login_failed
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import check_password, get_hasher, identify_hasher, make_password
+from rest_framework import status
+from rest_framework.exceptions import APIException, Throttled
+
+MODEL_BACKEND = 'django.contrib.auth.backends.ModelBackend'
+
+
+class LoginBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many logins in progress, retry shortly.'
+    default_code = 'login_busy'
+
+    def __init__(self, detail=None, code=None, wait=1):
+        super().__init__(detail, code)
+        # Sent as Retry-After, as DRF's exception handler does for Throttled.
+        self.wait = wait
+
+
+class HashPool:
+    """
+    Thread pool that refuses work, rather than queueing it, once `workers`
+    tasks are running and `queue_depth` more are waiting.
+    """
+    def __init__(self, workers, queue_depth):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='login-hash') if workers else None
+        self._slots = threading.BoundedSemaphore(workers + queue_depth) if workers else None
+
+    @property
+    def enabled(self):
+        return self._executor is not None
+
+    async def run(self, func, *args, timeout=None):
+        if not self.enabled:
+            # No pool: hash on the request's thread, as a sync view would.
+            return await sync_to_async(func)(*args)
+        if not self._slots.acquire(blocking=False):
+            raise LoginBusy()
+        try:
+            future = self._executor.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            # wait_for cancelled the future; a hash already running finishes.
+            raise LoginBusy()
+
+
+class ConcurrencyGuard:
+    """
+    Counts in-flight attempts per key and refuses an attempt when any of its
+    keys is at its limit.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active = {}
+
+    @contextmanager
+    def hold(self, limits):
+        with self._lock:
+            if any(self._active.get(key, 0) >= limit for key, limit in limits.items()):
+                raise Throttled(detail='Another login attempt for this account is in progress.', wait=1)
+            for key in limits:
+                self._active[key] = self._active.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                for key in limits:
+                    if self._active[key] <= 1:
+                        del self._active[key]
+                    else:
+                        self._active[key] -= 1
+
+
+hash_pool = HashPool(
+    workers=getattr(settings, 'LOGIN_HASH_WORKERS', 2),
+    queue_depth=getattr(settings, 'LOGIN_HASH_QUEUE', 16),
+)
+guard = ConcurrencyGuard()
+
+
+def client_ip(request):
+    return request.META.get('REMOTE_ADDR', '') if request is not None else ''
+
+
+def _pooled():
+    return list(settings.AUTHENTICATION_BACKENDS) == [MODEL_BACKEND]
+
+
+def _lookup(username):
+    UserModel = get_user_model()
+    try:
+        return UserModel._default_manager.get_by_natural_key(username)
+    except UserModel.DoesNotExist:
+        return None
+
+
+def _upgrade_hash(user, password):
+    preferred = get_hasher('default')
+    if identify_hasher(user.password).algorithm != preferred.algorithm or preferred.must_update(user.password):
+        # Same upgrade check_password's setter performs, done here so the
+        # write uses the request's connection.
+        user.set_password(password)
+        user.save(update_fields=['password'])
+
+
+async def averify_credentials(request, username, password):
+    """
+    Return the User for `username` if `password` matches and the user may
+    authenticate (see ModelBackend.user_can_authenticate), else None.
+    Mirrors ModelBackend.authenticate: a hash is computed for unknown
+    usernames too, so timing does not reveal which accounts exist. Raises
+    LoginBusy (503) when the hash pool is saturated and Throttled (429) when
+    the username or client IP already has too many attempts in flight.
+    """
+    limits = {
+        f'username:{username.lower()}': getattr(settings, 'LOGIN_MAX_CONCURRENT_PER_USERNAME', 2),
+        f'ip:{client_ip(request)}': getattr(settings, 'LOGIN_MAX_CONCURRENT_PER_IP', 20),
+    }
+    timeout = getattr(settings, 'LOGIN_HASH_TIMEOUT', 10)
+
+    if not _pooled():
+        with guard.hold(limits):
+            return await sync_to_async(authenticate)(request, username=username, password=password)
+
+    with guard.hold(limits):
+        user = await sync_to_async(_lookup)(username)
+        if user is None:
+            await hash_pool.run(make_password, password, timeout=timeout)
+        elif not await hash_pool.run(check_password, password, user.password, timeout=timeout):
+            user = None
+        elif not ModelBackend().user_can_authenticate(user):
+            user = None
+
+    if user is None:
+        await sync_to_async(user_login_failed.send)(
+            sender=__name__, credentials={'username': username}, request=request,
+        )
+        return None
+
+    await sync_to_async(_upgrade_hash)(user, password)
+    user.backend = MODEL_BACKEND
+    return user
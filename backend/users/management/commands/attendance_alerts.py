@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from users.alerts import run_attendance_alerts
+from users.models import User, Semester
+
+
+class Command(BaseCommand):
+    help = 'Compute low-attendance alerts for a department semester and notify flagged students.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('semester_id', type=int)
+        parser.add_argument('--sender', required=True, help='Username the notifications are sent as.')
+        parser.add_argument('--threshold', type=float)
+        parser.add_argument('--term-classes', type=int, help='Classes planned per subject this term.')
+        parser.add_argument('--source', choices=['rollup', 'raw'], default='rollup')
+        parser.add_argument('--dry-run', action='store_true', help='Report only, do not create notifications.')
+
+    def handle(self, *args, **options):
+        try:
+            semester = Semester.objects.select_related('department').get(id=options['semester_id'])
+            sender = User.objects.get(username=options['sender'])
+        except (Semester.DoesNotExist, User.DoesNotExist) as e:
+            raise CommandError(str(e))
+
+        report = run_attendance_alerts(
+            semester.department, semester, sender,
+            threshold=options['threshold'], term_classes=options['term_classes'],
+            dry_run=options['dry_run'], source=options['source'],
+        )
+        for entry in report:
+            subjects = ', '.join(
+                f"{subject['subject']} {subject['attendance_percentage']}%" for subject in entry['subjects']
+            )
+            self.stdout.write(f"student {entry['student_id']}: {subjects}")
+        action = 'would be notified' if options['dry_run'] else 'notified'
+        self.stdout.write(self.style.SUCCESS(f'{len(report)} students {action}.'))
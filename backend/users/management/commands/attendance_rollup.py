@@ -0,0 +1,87 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Max, Q
+
+from users.attendance import session_rollup_counts, uses_session_storage
+from users.models import User, Attendance, AttendanceRollup
+
+
+class Command(BaseCommand):
+    help = 'Verify (default) or rebuild the AttendanceRollup table from raw attendance, in batches of students.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Rewrite rollup rows that do not match the raw attendance.')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of students processed per batch.')
+
+    def handle(self, *args, **options):
+        rebuild = options['rebuild']
+        batch_size = options['batch_size']
+        checked = mismatched = 0
+        last_id = 0
+        # Sessions are not indexed by student, so in session storage mode the
+        # expected totals are accumulated in one streaming pass up front.
+        session_counts = None
+        if uses_session_storage():
+            session_counts = defaultdict(dict)
+            for (student_id, subject_id), counts in session_rollup_counts().items():
+                session_counts[student_id][subject_id] = counts
+
+        while True:
+            student_ids = list(
+                User.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not student_ids:
+                break
+            last_id = student_ids[-1]
+
+            if session_counts is not None:
+                expected = {
+                    (student_id, subject_id): counts
+                    for student_id in student_ids
+                    for subject_id, counts in session_counts.get(student_id, {}).items()
+                }
+            else:
+                expected = {
+                    (row['student_id'], row['subject_id']): (row['total'], row['present'], row['last_date'])
+                    for row in Attendance.objects.filter(student_id__in=student_ids)
+                    .order_by()
+                    .values('student_id', 'subject_id')
+                    .annotate(total=Count('id'), present=Count('id', filter=Q(is_present=True)), last_date=Max('date'))
+                }
+            actual = {
+                (row['student_id'], row['subject_id']): (row['total'], row['present'], row['last_date'])
+                for row in AttendanceRollup.objects.filter(student_id__in=student_ids)
+                .values('student_id', 'subject_id', 'total', 'present', 'last_date')
+            }
+
+            stale = {key for key in expected.keys() | actual.keys() if expected.get(key) != actual.get(key)}
+            checked += len(expected.keys() | actual.keys())
+            mismatched += len(stale)
+
+            if rebuild and stale:
+                with transaction.atomic():
+                    AttendanceRollup.objects.filter(student_id__in=student_ids).delete()
+                    AttendanceRollup.objects.bulk_create([
+                        AttendanceRollup(
+                            student_id=student_id, subject_id=subject_id,
+                            total=total, present=present, last_date=last_date,
+                        )
+                        for (student_id, subject_id), (total, present, last_date) in expected.items()
+                    ])
+
+        if rebuild:
+            self.stdout.write(self.style.SUCCESS(
+                f'Checked {checked} rollup rows, rebuilt {mismatched} stale rows.'
+            ))
+        elif mismatched:
+            raise CommandError(
+                f'{mismatched} of {checked} rollup rows are stale. Run with --rebuild to repair.'
+            )
+        else:
+            self.stdout.write(self.style.SUCCESS(f'All {checked} rollup rows match raw attendance.'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from users.models import Subject
+from users.trends import rebuild_buckets
+
+
+class Command(BaseCommand):
+    help = 'Rebuild attendance trend buckets from stored attendance, a batch of subjects at a time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20, help='Subjects per batch.')
+        parser.add_argument('--subject-id', type=int, action='append', dest='subject_ids',
+                            help='Only rebuild these subjects (repeatable).')
+
+    def handle(self, *args, **options):
+        subjects = Subject.objects.order_by('id')
+        if options['subject_ids']:
+            subjects = subjects.filter(id__in=options['subject_ids'])
+        subject_ids = list(subjects.values_list('id', flat=True))
+
+        written = 0
+        batch_size = options['batch_size']
+        for start in range(0, len(subject_ids), batch_size):
+            batch = subject_ids[start:start + batch_size]
+            written += rebuild_buckets(batch)
+            self.stdout.write(f'Rebuilt subjects {batch[0]}..{batch[-1]}')
+
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} bucket rows for {len(subject_ids)} subjects.'))
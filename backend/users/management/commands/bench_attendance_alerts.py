@@ -0,0 +1,62 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from users.alerts import compute_alerts
+
+
+def loop_alerts(total, present, term_classes, threshold):
+    """
+    Per-student Python loop computing the same flags, as the baseline.
+    """
+    below = []
+    ineligible = []
+    for student_total, student_present in zip(total.tolist(), present.tolist()):
+        below_row, ineligible_row = [], []
+        for held, attended in zip(student_total, student_present):
+            planned = max(term_classes, held)
+            percentage = attended * 100 / held if held else 0
+            below_row.append(held > 0 and percentage < threshold)
+            ineligible_row.append((attended + planned - held) * 100 / planned < threshold)
+        below.append(below_row)
+        ineligible.append(ineligible_row)
+    return below, ineligible
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the vectorized alert computation against a per-student Python loop.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=10000)
+        parser.add_argument('--subjects', type=int, default=8)
+        parser.add_argument('--days', type=int, default=90, help='Classes held so far per subject.')
+        parser.add_argument('--term-classes', type=int, default=120)
+        parser.add_argument('--threshold', type=float, default=75)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        shape = (options['students'], options['subjects'])
+        total = np.full(shape, options['days'], dtype=np.int32)
+        # Attendance rates skewed towards high attendance (mean around 84%)
+        rates = 1 - rng.beta(1.5, 8, size=shape)
+        present = rng.binomial(total, rates).astype(np.int32)
+
+        start = time.perf_counter()
+        result = compute_alerts(total, present, options['term_classes'], options['threshold'])
+        vectorized = time.perf_counter() - start
+
+        start = time.perf_counter()
+        below, ineligible = loop_alerts(total, present, options['term_classes'], options['threshold'])
+        looped = time.perf_counter() - start
+
+        assert (np.array(below) == result.below).all()
+        assert (np.array(ineligible) == result.ineligible).all()
+
+        marks = options['students'] * options['subjects'] * options['days']
+        self.stdout.write(f"{options['students']} students x {options['subjects']} subjects x "
+                          f"{options['days']} classes ({marks:,} marks)")
+        self.stdout.write(f"flagged students: {int(result.below.any(axis=1).sum())}, "
+                          f"ineligible: {int(result.ineligible.any(axis=1).sum())}")
+        self.stdout.write(f"vectorized: {vectorized * 1000:.1f} ms")
+        self.stdout.write(f"python loop: {looped * 1000:.1f} ms ({looped / vectorized:.0f}x slower)")
@@ -0,0 +1,46 @@
+import datetime
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from users.benchmarking import rolled_back, seed_section
+from users.exports import iter_attendance_rows, iter_export
+from users.models import Attendance
+
+
+class Command(BaseCommand):
+    help = 'Show that streaming export memory stays flat as the number of exported rows grows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=200)
+        parser.add_argument('--days', default='10,100,500',
+                            help='Comma separated numbers of class days to seed.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'rows':>9} {'peak KiB':>9} {'bytes out':>11}")
+        for days in (int(day) for day in options['days'].split(',')):
+            with rolled_back():
+                seeded = seed_section(options['students'], prefix=f'bench-export-{days}')
+                start = datetime.date(2000, 1, 1)
+                Attendance.objects.bulk_create(
+                    (
+                        Attendance(
+                            student_id=student_id, subject=seeded.subject,
+                            date=start + datetime.timedelta(days=day),
+                            is_present=(student_id + day) % 4 != 0, marked_by=seeded.faculty,
+                        )
+                        for day in range(days)
+                        for student_id in seeded.student_ids
+                    ),
+                    batch_size=5000,
+                )
+
+                tracemalloc.start()
+                written = 0
+                for chunk in iter_export('csv', iter_attendance_rows(department_id=seeded.department.id)):
+                    written += len(chunk)
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                rows = days * len(seeded.student_ids)
+                self.stdout.write(f"{rows:>9} {peak // 1024:>9} {written:>11}")
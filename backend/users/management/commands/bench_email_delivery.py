@@ -0,0 +1,69 @@
+import time
+
+from django.core.mail import EmailMessage
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from users import email_delivery
+from users.benchmarking import rolled_back, seed_section
+from users.models import User
+from users.notifications import send
+from users.smtp_sink import SMTPSink
+
+
+class Command(BaseCommand):
+    help = ('Mail a notification to a seeded department through a local SMTP sink, once with one '
+            'connection per recipient inside the sending request and once through the delivery '
+            'queue, and report request time and throughput.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=1000,
+                            help='Students in the seeded department.')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='EMAIL_DELIVERY_BATCH_SIZE for the queued run.')
+        parser.add_argument('--rate', type=float, default=0,
+                            help='EMAIL_DELIVERY_RATE for the queued run (0 for no limit).')
+        parser.add_argument('--latency', type=float, default=0.001,
+                            help='Seconds the sink waits before each reply, standing in for a remote server.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'mode':>8} {'emails':>7} {'request ms':>11} {'delivery s':>11} {'emails/s':>9} {'connections':>12}"
+        )
+        for mode in ('inline', 'queued'):
+            with SMTPSink(latency=options['latency'], keep=False) as sink:
+                with override_settings(
+                    EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                    EMAIL_HOST=sink.host, EMAIL_PORT=sink.port, EMAIL_USE_TLS=False, EMAIL_USE_SSL=False,
+                    EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='',
+                    NOTIFICATION_EMAIL=mode == 'queued',
+                    EMAIL_DELIVERY_BATCH_SIZE=options['batch_size'], EMAIL_DELIVERY_RATE=options['rate'],
+                ):
+                    # The queue worker is only woken on commit, which a
+                    # rolled back run never reaches; it is run here instead.
+                    with rolled_back():
+                        request_ms, delivery_s = self._run(mode, options['recipients'])
+                        emails = sink.received
+            self.stdout.write(
+                f"{mode:>8} {emails:>7} {request_ms:>11.1f} {delivery_s:>11.2f} "
+                f"{emails / delivery_s if delivery_s else 0:>9.0f} {sink.connections:>12}"
+            )
+
+    def _run(self, mode, size):
+        seeded = seed_section(size, prefix='bench-email')
+        students = list(User.objects.filter(id__in=seeded.student_ids).only('id', 'username'))
+        for student in students:
+            student.email = f'{student.username}@example.com'
+        User.objects.bulk_update(students, ['email'], batch_size=500)
+        start = time.perf_counter()
+        notification = send(seeded.faculty, 'Benchmark', 'Delivery benchmark', 'student', department=seeded.department)
+        if mode == 'inline':
+            # What the sending request would do without the queue.
+            for email in email_delivery.recipients(notification).values_list('email', flat=True):
+                EmailMessage(notification.title, notification.message, to=[email]).send()
+        request_ms = (time.perf_counter() - start) * 1000
+        if mode == 'inline':
+            return request_ms, request_ms / 1000
+        start = time.perf_counter()
+        email_delivery.run_pending()
+        return request_ms, time.perf_counter() - start
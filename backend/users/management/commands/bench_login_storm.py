@@ -0,0 +1,166 @@
+import json
+import logging
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+
+from users import login
+from users.benchmarking import percentile, seed_section
+from users.models import User, Department
+from users.tokens import ClaimsRefreshToken
+
+PASSWORD = 'storm-password-1'
+
+
+class Command(BaseCommand):
+    help = ('Flood the login endpoint from many clients while others call a regular endpoint, '
+            'and report login and non-login latency with hashing inline and in the bounded pool.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--login-clients', type=int, default=16,
+                            help='Concurrent clients logging in back to back.')
+        parser.add_argument('--other-clients', type=int, default=4,
+                            help='Concurrent clients calling the profile endpoint.')
+        parser.add_argument('--duration', type=float, default=10.0,
+                            help='Seconds each mode runs.')
+        parser.add_argument('--wrong-password-ratio', type=float, default=0.5,
+                            help='Share of login attempts made with a wrong password.')
+        parser.add_argument('--url', default='',
+                            help='Base URL of a running server (e.g. an ASGI server on this database) to '
+                                 'send the requests to, instead of the in-process test client. The '
+                                 "server's own LOGIN_HASH_* settings then apply.")
+
+    def handle(self, *args, **options):
+        prefix = 'bench-login'
+        # Client threads use their own connections, so the data is committed
+        # and removed afterwards rather than rolled back.
+        with transaction.atomic():
+            seeded = seed_section(options['login_clients'] + options['other_clients'], prefix=prefix)
+            User.objects.filter(id__in=seeded.student_ids).update(password=make_password(PASSWORD))
+        try:
+            students = list(User.objects.filter(id__in=seeded.student_ids).order_by('id'))
+            self.stdout.write(
+                f"{'mode':>8} {'logins':>7} {'ok':>5} {'401/400':>8} {'429':>5} {'503':>5} "
+                f"{'login p50':>10} {'login p99':>10} {'other p50':>10} {'other p99':>10}"
+            )
+            configured = login.hash_pool
+            # Every refused or failed login would otherwise be logged.
+            logging.getLogger('django.request').setLevel(logging.CRITICAL)
+            modes = (('server', configured),) if options['url'] else (
+                ('inline', login.HashPool(0, 0)), ('pool', configured),
+            )
+            for mode, pool in modes:
+                login.hash_pool = pool
+                try:
+                    self._run(mode, students, options)
+                finally:
+                    login.hash_pool = configured
+        finally:
+            with transaction.atomic():
+                User.objects.filter(username__startswith=prefix).delete()
+                Department.objects.filter(pk=seeded.department.pk).delete()
+
+    def _run(self, mode, students, options):
+        login_users = students[:options['login_clients']]
+        other_users = students[options['login_clients']:]
+        stop = time.monotonic() + options['duration']
+        wrong_every = round(1 / options['wrong_password_ratio']) if options['wrong_password_ratio'] else 0
+        statuses = Counter()
+        login_ms, other_ms = [], []
+        lock = threading.Lock()
+
+        def login_client(index, user):
+            client = _client(
+                options['url'], HTTP_HOST='localhost', REMOTE_ADDR=f'10.0.{index // 250}.{index % 250 + 1}',
+            )
+            attempt = 0
+            try:
+                while time.monotonic() < stop:
+                    attempt += 1
+                    wrong = wrong_every and attempt % wrong_every == 0
+                    start = time.perf_counter()
+                    response = client.post('/api/v1/auth/login/', {
+                        'username': user.username,
+                        'password': 'wrong' if wrong else PASSWORD,
+                    }, content_type='application/json')
+                    elapsed = (time.perf_counter() - start) * 1000
+                    with lock:
+                        statuses[response.status_code] += 1
+                        login_ms.append(elapsed)
+                    if response.status_code in (429, 503):
+                        time.sleep(0.05)
+            finally:
+                connection.close()
+
+        def other_client(user):
+            token = ClaimsRefreshToken.for_user(user).access_token
+            client = _client(options['url'], HTTP_HOST='localhost', HTTP_AUTHORIZATION=f'Bearer {token}')
+            try:
+                while time.monotonic() < stop:
+                    start = time.perf_counter()
+                    client.get('/api/v1/profile/')
+                    elapsed = (time.perf_counter() - start) * 1000
+                    with lock:
+                        other_ms.append(elapsed)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=login_client, args=(i, user)) for i, user in enumerate(login_users)]
+        threads += [threading.Thread(target=other_client, args=(user,)) for user in other_users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.stdout.write(
+            f"{mode:>8} {len(login_ms):>7} {statuses[200]:>5} {statuses[400] + statuses[401]:>8} "
+            f"{statuses[429]:>5} {statuses[503]:>5} "
+            f"{percentile(login_ms, 50):>10.1f} {percentile(login_ms, 99):>10.1f} "
+            f"{percentile(other_ms, 50):>10.1f} {percentile(other_ms, 99):>10.1f}"
+        )
+
+
+class _Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class _HTTPClient:
+    """
+    The part of the test client the benchmark uses, over HTTP to `base_url`.
+    """
+    def __init__(self, base_url, **headers):
+        self.base_url = base_url.rstrip('/')
+        self.headers = {
+            name[len('HTTP_'):].replace('_', '-').title(): value
+            for name, value in headers.items() if name.startswith('HTTP_') and name != 'HTTP_HOST'
+        }
+
+    def _send(self, request):
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return _Response(response.status)
+        except urllib.error.HTTPError as e:
+            e.read()
+            return _Response(e.code)
+
+    def post(self, path, data, content_type):
+        return self._send(urllib.request.Request(
+            self.base_url + path, data=json.dumps(data).encode(), method='POST',
+            headers={**self.headers, 'Content-Type': content_type},
+        ))
+
+    def get(self, path):
+        return self._send(urllib.request.Request(self.base_url + path, headers=self.headers))
+
+
+def _client(url, **defaults):
+    return _HTTPClient(url, **defaults) if url else Client(**defaults)
@@ -0,0 +1,59 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from users.attendance import bulk_mark_attendance
+from users.benchmarking import measure, rolled_back, seed_section
+from users.models import User, Attendance
+
+
+def legacy_mark_attendance(subject, section, date, present_student_ids, marked_by):
+    """
+    The original per-student loop, kept here as the benchmark baseline.
+    """
+    students = User.objects.filter(section=section, role='student')
+    for student in students:
+        is_present = student.id in present_student_ids
+        attendance, created = Attendance.objects.get_or_create(
+            student=student,
+            subject=subject,
+            date=date,
+            defaults={'is_present': is_present, 'marked_by': marked_by}
+        )
+        if not created:
+            attendance.is_present = is_present
+            attendance.marked_by = marked_by
+            attendance.save()
+    return len(students)
+
+
+class Command(BaseCommand):
+    help = 'Compare statement count and latency of the legacy and bulk attendance write paths.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='30,120,500',
+                            help='Comma separated section sizes to benchmark.')
+        parser.add_argument('--storage', choices=['rows', 'sessions'], default='rows',
+                            help='ATTENDANCE_STORAGE mode used by the bulk path.')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        self.stdout.write(f"{'students':>8} {'path':>7} {'pass':>7} {'queries':>8} {'ms':>9}")
+
+        for size in sizes:
+            for path, func in (('legacy', legacy_mark_attendance), ('bulk', bulk_mark_attendance)):
+                with override_settings(ATTENDANCE_STORAGE=options['storage']), rolled_back():
+                    seeded = seed_section(size, prefix=f'bench-{path}-{size}')
+                    date = datetime.date(2099, 1, 1)
+                    everyone = set(seeded.student_ids)
+                    half = set(seeded.student_ids[::2])
+
+                    # First pass creates every row, second flips half the roster.
+                    for label, present in (('insert', everyone), ('flip', half)):
+                        _, elapsed, queries = measure(
+                            func, seeded.subject, seeded.section, date, present, seeded.faculty
+                        )
+                        self.stdout.write(
+                            f"{size:>8} {path:>7} {label:>7} {queries:>8} {elapsed * 1000:>9.1f}"
+                        )
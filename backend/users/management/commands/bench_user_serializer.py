@@ -0,0 +1,56 @@
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework import serializers
+
+from users.benchmarking import measure, rolled_back, seed_section
+from users.models import User
+from users.serializers import UserSerializer, UserValuesSerializer
+
+
+def legacy_serialize(queryset):
+    """
+    UserSerializer(many=True) as it ran before list serializers added joins:
+    one query for the users and one per related name per user.
+    """
+    return serializers.ListSerializer(child=UserSerializer(), instance=queryset).data
+
+
+def select_related_serialize(queryset):
+    return UserSerializer(queryset, many=True).data
+
+
+def values_serialize(queryset):
+    return UserValuesSerializer(queryset).data
+
+
+class Command(BaseCommand):
+    help = 'Compare query count and throughput of the user list serialization paths.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5000, help='Number of users seeded.')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per path; the best is reported.')
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            seeded = seed_section(options['users'], prefix='bench-serializer')
+            queryset = User.objects.filter(id__in=seeded.student_ids).order_by('id')
+
+            self.stdout.write(f"{'path':>15} {'queries':>8} {'ms':>9} {'users/s':>10}")
+            expected = None
+            for name, func in (
+                ('legacy', legacy_serialize),
+                ('select_related', select_related_serialize),
+                ('values', values_serialize),
+            ):
+                best = None
+                for _ in range(options['repeat']):
+                    data, elapsed, queries = measure(func, queryset.all())
+                    best = elapsed if best is None else min(best, elapsed)
+                data = [dict(item) for item in data]
+                if expected is None:
+                    expected = data
+                elif data != expected:
+                    raise CommandError(f'{name} output differs from the legacy serializer')
+                self.stdout.write(
+                    f"{name:>15} {queries:>8} {best * 1000:>9.1f} {len(data) / best:>10.0f}"
+                )
@@ -0,0 +1,51 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.attendance import bulk_mark_attendance
+from users.benchmarking import rolled_back, seed_section
+from users.models import Notification, AuditLog
+from users.queryplans import explain_endpoint_queries
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the endpoint queries against a seeded dataset and fail on full scans of large tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=200)
+        parser.add_argument('--days', type=int, default=20)
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every plan, not only failures.')
+
+    def handle(self, *args, **options):
+        failures = []
+        with rolled_back():
+            seed = seed_section(options['students'], prefix='plan-check')
+            for day in range(options['days']):
+                bulk_mark_attendance(
+                    seed.subject, seed.section, datetime.date(2000, 1, 1) + datetime.timedelta(days=day),
+                    seed.student_ids[day % 3::3], seed.faculty,
+                )
+            Notification.objects.bulk_create(
+                Notification(title=f'Notice {i}', message='', sender=seed.faculty,
+                             recipient_role='student', department=seed.department,
+                             expires_at=datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+                             + datetime.timedelta(days=i) if i % 2 else None)
+                for i in range(options['days'])
+            )
+            AuditLog.objects.bulk_create(
+                AuditLog(user=seed.faculty, action='mark_attendance', resource_type='subject',
+                         resource_id=seed.subject.id)
+                for _ in range(options['days'])
+            )
+
+            for name, plan, scanned in explain_endpoint_queries(seed):
+                if scanned:
+                    failures.append(name)
+                    self.stdout.write(self.style.ERROR(f'FULL SCAN {name}: {", ".join(sorted(scanned))}'))
+                else:
+                    self.stdout.write(self.style.SUCCESS(f'ok        {name}'))
+                if scanned or options['verbose_plans']:
+                    self.stdout.write('    ' + plan.replace('\n', '\n    '))
+
+        if failures:
+            raise CommandError(f'{len(failures)} endpoint queries use full table scans.')
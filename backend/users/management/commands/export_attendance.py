@@ -0,0 +1,46 @@
+import resource
+import sys
+
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+
+from users.exports import EXPORT_FORMATS, iter_attendance_rows, iter_export
+
+
+class Command(BaseCommand):
+    help = 'Stream attendance to a CSV or NDJSON file (or stdout) in constant memory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='-', help='Output file path, "-" for stdout.')
+        parser.add_argument('--format', dest='export_format', choices=sorted(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--department-id', type=int)
+        parser.add_argument('--semester-id', type=int)
+        parser.add_argument('--section-id', type=int)
+        parser.add_argument('--subject-id', type=int)
+        parser.add_argument('--date-from', type=parse_date)
+        parser.add_argument('--date-to', type=parse_date)
+
+    def handle(self, *args, **options):
+        rows = iter_attendance_rows(
+            department_id=options['department_id'],
+            semester_id=options['semester_id'],
+            section_id=options['section_id'],
+            subject_id=options['subject_id'],
+            date_from=options['date_from'],
+            date_to=options['date_to'],
+        )
+
+        count = 0
+        out = sys.stdout if options['output'] == '-' else open(options['output'], 'w', newline='')
+        try:
+            for chunk in iter_export(options['export_format'], rows):
+                out.write(chunk)
+                count += 1
+        finally:
+            if out is not sys.stdout:
+                out.close()
+
+        if options['export_format'] == 'csv':
+            count -= 1  # header line
+        peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.stderr.write(f'Exported {count} rows, peak RSS {peak_kb // 1024} MiB.')
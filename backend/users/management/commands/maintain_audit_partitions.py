@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from users import audit_partitions
+
+
+class Command(BaseCommand):
+    help = ('Move finished months of audit logs into their month tables (SQLite) or create upcoming '
+            'month partitions (PostgreSQL), then drop, after archiving, months past retention. '
+            'Run it daily.')
+
+    def handle(self, *args, **options):
+        result = audit_partitions.maintain()
+        for table in result['rotated']:
+            self.stdout.write(f'Rotated rows into {table}')
+        for table in result['created']:
+            self.stdout.write(f'Created partition {table}')
+        for table in result['dropped']:
+            self.stdout.write(f'Dropped {table}')
+        self.stdout.write(self.style.SUCCESS('Audit log partitions maintained'))
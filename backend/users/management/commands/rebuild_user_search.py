@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from users.directory import rebuild_index
+
+
+class Command(BaseCommand):
+    help = ('Repopulate the SQLite user search table from the users table, after writes that '
+            'bypassed the User signals (QuerySet.update, raw SQL). PostgreSQL needs no rebuild.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            self.stdout.write('The search index is maintained by the database on this backend.')
+            return
+        with transaction.atomic():
+            rebuild_index()
+        self.stdout.write(self.style.SUCCESS('User search index rebuilt'))
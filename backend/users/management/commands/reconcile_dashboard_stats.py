@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from users import dashboard
+
+
+class Command(BaseCommand):
+    help = 'Recount the cached dashboard counters from the database and report any drift.'
+
+    def handle(self, *args, **options):
+        drift = dashboard.reconcile()
+        for name, (cached, actual) in sorted(drift.items()):
+            self.stdout.write(f'{name}: cached {cached}, actual {actual}')
+        self.stdout.write(self.style.SUCCESS(f'Dashboard counters reconciled, {len(drift)} had drifted'))
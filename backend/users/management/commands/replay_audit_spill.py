@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from users.audit import audit_writer
+
+
+class Command(BaseCommand):
+    help = ('Write audit entries spilled to disk while the database was slow into the audit log. '
+            'Workers replay their own spill files once writes are fast again; this picks up the '
+            'files of workers that have stopped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orphan-age', type=float, default=None,
+                            help='Replay spill files not written for this many seconds '
+                                 '(default AUDIT_SPILL_ORPHAN_AGE). Use 0 only when no worker is running.')
+
+    def handle(self, *args, **options):
+        replayed = audit_writer.replay(orphan_age=options['orphan_age'])
+        self.stdout.write(self.style.SUCCESS(f'Replayed {replayed} audit entries'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from users.deletion import requeue_failed, run_pending
+
+
+class Command(BaseCommand):
+    help = ('Run pending department and user deletion jobs, and take over running jobs whose worker '
+            'stopped (no heartbeat for DELETION_STALE_AFTER seconds).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Queue failed jobs again, with their attempts reset, before running.')
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            retried = requeue_failed()
+            self.stdout.write(f'Queued {retried} failed jobs again')
+        ran = run_pending()
+        self.stdout.write(self.style.SUCCESS(f'Ran {ran} deletion jobs'))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from users.email_delivery import run_pending
+from users.models import EmailDelivery
+
+
+class Command(BaseCommand):
+    help = ('Resolve the recipients of queued notification emails and send the deliveries that are due, '
+            'over one connection to EMAIL_BACKEND.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Queue failed deliveries again, with their attempts reset, before sending.')
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            retried = EmailDelivery.objects.filter(status='failed').update(
+                status='pending', attempts=0, next_attempt_at=timezone.now(), error='',
+            )
+            self.stdout.write(f'Queued {retried} failed deliveries again')
+        outcomes = run_pending()
+        self.stdout.write(self.style.SUCCESS(
+            f"Sent {outcomes['sent']} emails, {outcomes['retry']} to retry, {outcomes['failed']} failed"
+        ))
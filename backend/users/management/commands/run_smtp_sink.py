@@ -0,0 +1,35 @@
+from email import message_from_bytes
+
+from django.core.management.base import BaseCommand
+
+from users.smtp_sink import SMTPSink
+
+
+class Command(BaseCommand):
+    help = ('Run a local SMTP server that accepts every message and prints its envelope and subject. '
+            'Point EMAIL_BACKEND at django.core.mail.backends.smtp.EmailBackend and EMAIL_PORT at it.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=1025)
+        parser.add_argument('--refuse', nargs='*', default=[],
+                            help='Recipient addresses to answer with 550.')
+        parser.add_argument('--latency', type=float, default=0,
+                            help='Seconds to wait before every reply.')
+
+    def handle(self, *args, **options):
+        def show(mail_from, rcpt_to, data):
+            subject = message_from_bytes(data).get('Subject', '')
+            self.stdout.write(f"{mail_from} -> {', '.join(rcpt_to)}: {subject}")
+
+        sink = SMTPSink(options['host'], options['port'], refuse=options['refuse'],
+                        latency=options['latency'], keep=False, on_message=show)
+        sink.start()
+        self.stdout.write(self.style.SUCCESS(f'SMTP sink listening on {sink.host}:{sink.port}'))
+        try:
+            sink.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sink.stop()
+            self.stdout.write(f'Received {sink.received} messages over {sink.connections} connections')
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from users.expiry import sweep_expired
+
+
+class Command(BaseCommand):
+    help = ('Archive and delete expired notifications in short batches, stopping after '
+            'NOTIFICATION_SWEEP_MAX_SECONDS. Run it every few minutes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Notifications deleted per transaction (default NOTIFICATION_SWEEP_BATCH_SIZE).')
+        parser.add_argument('--max-seconds', type=float, default=None,
+                            help='Stop after this long (default NOTIFICATION_SWEEP_MAX_SECONDS, 0 for no limit).')
+        parser.add_argument('--no-archive', action='store_true',
+                            help='Delete without writing NOTIFICATION_ARCHIVE_DIR.')
+
+    def handle(self, *args, **options):
+        result = sweep_expired(
+            batch_size=options['batch_size'], max_seconds=options['max_seconds'],
+            archive_dir='' if options['no_archive'] else None,
+        )
+        message = (f"Swept {result['swept']} expired notifications in {result['batches']} batches "
+                   f"in {result['seconds']:.2f}s")
+        if result['complete']:
+            self.stdout.write(self.style.SUCCESS(message))
+        else:
+            self.stdout.write(self.style.WARNING(message + '; stopped at the time limit, more remain'))
@@ -0,0 +1,465 @@
+"""
+Per-endpoint request metrics.
+
+MetricsMiddleware records every request under (view name, role): latency in
+a log-linear histogram, SQL statement count and time (through an
+execute_wrapper on every connection), response bytes and status codes. It
+runs in async mode under ASGI, so async views hold no thread for it.
+
+Recording is lock-free. Each thread writes only to its own aggregate, keyed
+by thread ident, and readers merge the aggregates. Every
+METRICS_FLUSH_INTERVAL seconds a request thread writes the process's merged
+totals to its own file in METRICS_DIR, replacing the previous one. The
+metrics endpoint merges every file there, which covers all workers on the
+host. Totals are cumulative per process. Files not rewritten for
+METRICS_RETENTION seconds (processes that have exited) are removed.
+
+The histogram follows HDR histograms: values below 32 microseconds get a
+bucket each, and every power of two above that is split into 16 linear
+sub-buckets. Any latency is then reported to within about 3%, in at most a
+few hundred buckets.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.utils.functional import SimpleLazyObject, empty
+
+logger = logging.getLogger(__name__)
+
+SUB_BUCKETS = 32
+HALF = SUB_BUCKETS // 2
+SUB_BITS = SUB_BUCKETS.bit_length() - 1
+PERCENTILES = (50, 95, 99)
+UNRESOLVED = '<unresolved>'
+
+_query_timer = contextvars.ContextVar('metrics_query_timer', default=None)
+
+
+def bucket_index(value):
+    """
+    Histogram bucket of a non-negative integer value.
+    """
+    if value < SUB_BUCKETS:
+        return max(0, value)
+    exponent = value.bit_length() - SUB_BITS
+    return SUB_BUCKETS + (exponent - 1) * HALF + (value >> exponent) - HALF
+
+
+def bucket_bounds(index):
+    """
+    [lower, upper) of the values falling into bucket `index`.
+    """
+    if index < SUB_BUCKETS:
+        return index, index + 1
+    exponent, offset = divmod(index - SUB_BUCKETS, HALF)
+    mantissa = offset + HALF
+    return mantissa << (exponent + 1), (mantissa + 1) << (exponent + 1)
+
+
+def histogram_percentile(buckets, pct):
+    """
+    Nearest-rank percentile of a {bucket index: count} histogram, as the
+    midpoint of the bucket holding that rank.
+    """
+    total = sum(buckets.values())
+    if not total:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * total))
+    seen = 0
+    for index in sorted(buckets):
+        seen += buckets[index]
+        if seen >= rank:
+            lower, upper = bucket_bounds(index)
+            return (lower + upper - 1) / 2.0
+    return 0.0
+
+
+class Series:
+    """
+    Totals for one (view, role) pair. Durations are in microseconds.
+    """
+    __slots__ = ('count', 'latency_us', 'buckets', 'queries', 'query_us', 'bytes', 'statuses')
+
+    def __init__(self):
+        self.count = 0
+        self.latency_us = 0
+        self.buckets = {}
+        self.queries = 0
+        self.query_us = 0
+        self.bytes = 0
+        self.statuses = {}
+
+    def record(self, latency_us, queries, query_us, size, status):
+        index = bucket_index(latency_us)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.count += 1
+        self.latency_us += latency_us
+        self.queries += queries
+        self.query_us += query_us
+        if size is not None:
+            self.bytes += size
+
+    def merge(self, other):
+        self.count += other.count
+        self.latency_us += other.latency_us
+        self.queries += other.queries
+        self.query_us += other.query_us
+        self.bytes += other.bytes
+        # dict() copies are atomic under the GIL, so a writer thread cannot
+        # change the dict mid-iteration.
+        for index, n in dict(other.buckets).items():
+            self.buckets[index] = self.buckets.get(index, 0) + n
+        for code, n in dict(other.statuses).items():
+            self.statuses[code] = self.statuses.get(code, 0) + n
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'latency_us': self.latency_us,
+            'buckets': self.buckets,
+            'queries': self.queries,
+            'query_us': self.query_us,
+            'bytes': self.bytes,
+            'statuses': self.statuses,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        series = cls()
+        series.count = data['count']
+        series.latency_us = data['latency_us']
+        series.buckets = {int(index): n for index, n in data['buckets'].items()}
+        series.queries = data['queries']
+        series.query_us = data['query_us']
+        series.bytes = data['bytes']
+        series.statuses = {int(code): n for code, n in data['statuses'].items()}
+        return series
+
+
+def _key(view, role):
+    return f'{view}|{role}'
+
+
+def _split_key(key):
+    view, _, role = key.rpartition('|')
+    return view, role
+
+
+def merge_snapshots(snapshots):
+    """
+    Merge {key: Series} dicts into a new one.
+    """
+    merged = {}
+    for snapshot in snapshots:
+        for key, series in snapshot.items():
+            merged.setdefault(key, Series()).merge(series)
+    return merged
+
+
+class Recorder:
+    """
+    Per-process metrics: one aggregate per thread, merged on read and
+    flushed to METRICS_DIR.
+    """
+    def __init__(self):
+        self._reset()
+        self._flush_lock = threading.Lock()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._name = f'{self._pid}-{uuid.uuid4().hex[:8]}.json'
+        self._threads = {}
+        self._last_flush = time.monotonic()
+
+    def _aggregate(self):
+        if os.getpid() != self._pid:
+            # Forked from a process that already recorded: start afresh
+            # rather than report the parent's totals twice.
+            self._reset()
+        return self._threads.setdefault(threading.get_ident(), {})
+
+    def record(self, view, role, latency_us, queries, query_us, size, status):
+        aggregate = self._aggregate()
+        key = _key(view, role)
+        series = aggregate.get(key)
+        if series is None:
+            series = aggregate[key] = Series()
+        series.record(latency_us, queries, query_us, size, status)
+
+    def add_bytes(self, view, role, size):
+        aggregate = self._aggregate()
+        key = _key(view, role)
+        series = aggregate.get(key)
+        if series is None:
+            series = aggregate[key] = Series()
+        series.bytes += size
+
+    def snapshot(self):
+        """
+        This process's totals as {key: Series}.
+        """
+        return merge_snapshots(list(self._threads.values()))
+
+    def _directory(self):
+        return getattr(settings, 'METRICS_DIR', None)
+
+    def maybe_flush(self):
+        interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)
+        if time.monotonic() - self._last_flush >= interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Write this process's totals to its file in METRICS_DIR. Skipped if
+        another thread is already flushing.
+        """
+        directory = self._directory()
+        if not directory or not self._flush_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_flush = time.monotonic()
+            os.makedirs(directory, exist_ok=True)
+            data = {key: series.as_dict() for key, series in self.snapshot().items()}
+            path = os.path.join(directory, self._name)
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(tmp, path)
+        except OSError:
+            logger.exception('Could not write request metrics to %s', directory)
+        finally:
+            self._flush_lock.release()
+
+    def collect(self):
+        """
+        Totals of every process sharing METRICS_DIR (just this one when it
+        is not set), as {(view, role): Series}.
+        """
+        directory = self._directory()
+        if not directory:
+            snapshots = [self.snapshot()]
+        else:
+            self.flush()
+            snapshots = self._read_files(directory)
+        return {_split_key(key): series for key, series in merge_snapshots(snapshots).items()}
+
+    def _read_files(self, directory):
+        retention = getattr(settings, 'METRICS_RETENTION', 24 * 60 * 60)
+        now = time.time()
+        snapshots = []
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return snapshots
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                if name != self._name and now - os.path.getmtime(path) > retention:
+                    os.remove(path)
+                    continue
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                # Removed or replaced concurrently; the next read picks it up.
+                continue
+            snapshots.append({key: Series.from_dict(series) for key, series in data.items()})
+        return snapshots
+
+
+recorder = Recorder()
+# Workers that exit keep their last totals in METRICS_DIR until retention.
+atexit.register(recorder.flush)
+
+
+def summarize(collected):
+    """
+    Rows for the metrics endpoint, busiest endpoints first.
+    """
+    rows = []
+    for (view, role), series in sorted(collected.items(), key=lambda item: -item[1].count):
+        count = series.count or 1
+        rows.append({
+            'view': view,
+            'role': role,
+            'count': series.count,
+            **{f'p{pct}_ms': round(histogram_percentile(series.buckets, pct) / 1000, 3) for pct in PERCENTILES},
+            'mean_ms': round(series.latency_us / count / 1000, 3),
+            'mean_queries': round(series.queries / count, 2),
+            'mean_query_ms': round(series.query_us / count / 1000, 3),
+            'mean_bytes': round(series.bytes / count),
+            'statuses': {str(code): n for code, n in sorted(series.statuses.items())},
+        })
+    return rows
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(collected):
+    """
+    Prometheus text exposition (format 0.0.4) of the collected metrics.
+    Latency is a summary with the PERCENTILES as quantiles; the rest are
+    counters.
+    """
+    lines = [
+        '# HELP http_request_duration_seconds Request latency by view and role.',
+        '# TYPE http_request_duration_seconds summary',
+    ]
+    items = sorted(collected.items())
+    for (view, role), series in items:
+        labels = f'view="{_label(view)}",role="{_label(role)}"'
+        for pct in PERCENTILES:
+            value = histogram_percentile(series.buckets, pct) / 1e6
+            lines.append(f'http_request_duration_seconds{{{labels},quantile="{pct / 100:g}"}} {value:.6f}')
+        lines.append(f'http_request_duration_seconds_sum{{{labels}}} {series.latency_us / 1e6:.6f}')
+        lines.append(f'http_request_duration_seconds_count{{{labels}}} {series.count}')
+
+    counters = [
+        ('http_requests_total', 'Requests by view, role and status code.', None),
+        ('db_queries_total', 'SQL statements run by requests.', lambda s: s.queries),
+        ('db_query_duration_seconds_total', 'Time spent in SQL by requests.', lambda s: f'{s.query_us / 1e6:.6f}'),
+        ('http_response_bytes_total', 'Response body bytes sent.', lambda s: s.bytes),
+    ]
+    for name, help_text, value in counters:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for (view, role), series in items:
+            labels = f'view="{_label(view)}",role="{_label(role)}"'
+            if value is None:
+                for code, n in sorted(series.statuses.items()):
+                    lines.append(f'{name}{{{labels},status="{code}"}} {n}')
+            else:
+                lines.append(f'{name}{{{labels}}} {value(series)}')
+    return '\n'.join(lines) + '\n'
+
+
+class _QueryTimer:
+    """
+    Counts and times the statements of one request.
+    """
+    def __init__(self):
+        self.count = 0
+        self.elapsed = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.elapsed += time.perf_counter() - start
+            self.count += 1
+
+
+def _time_queries(execute, sql, params, many, context):
+    timer = _query_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer(execute, sql, params, many, context)
+
+
+def _install_query_timer(sender=None, connection=None, **kwargs):
+    """
+    Add _time_queries to `connection` for good. It finds the request's timer
+    through a context variable, which sync_to_async carries to the thread a
+    sync view runs in, so async requests are timed too.
+    """
+    if _time_queries not in connection.execute_wrappers:
+        # First, so execute_wrapper() blocks popping theirs leave it alone.
+        connection.execute_wrappers.insert(0, _time_queries)
+
+
+connection_created.connect(_install_query_timer, dispatch_uid='metrics_query_timer')
+
+
+def _role(request):
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return 'anonymous'
+    return getattr(user, 'role', None) or 'unknown'
+
+
+def _counting(chunks, view, role):
+    size = 0
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+    finally:
+        recorder.add_bytes(view, role, size)
+
+
+class MetricsMiddleware:
+    """
+    Record latency, SQL and response size of every request; see the module
+    docstring. Streaming responses have their bytes added once the stream
+    has been sent.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        _install_query_timer(connection=connection)
+        timer = _QueryTimer()
+        token = _query_timer.set(timer)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _query_timer.reset(token)
+        self._record(request, response, time.perf_counter() - start, timer, _role(request))
+        return response
+
+    async def __acall__(self, request):
+        timer = _QueryTimer()
+        token = _query_timer.set(timer)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _query_timer.reset(token)
+        latency = time.perf_counter() - start
+        user = getattr(request, 'user', None)
+        if isinstance(user, SimpleLazyObject) and user._wrapped is empty:
+            # The session user has not been loaded yet; that is a query.
+            role = await sync_to_async(_role)(request)
+        else:
+            role = _role(request)
+        self._record(request, response, latency, timer, role)
+        return response
+
+    def _record(self, request, response, latency, timer, role):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else UNRESOLVED
+        size = None
+        if response.streaming:
+            if not response.is_async:
+                response.streaming_content = _counting(response.streaming_content, view, role)
+        else:
+            size = len(response.content)
+        recorder.record(view, role, int(latency * 1e6), timer.count, int(timer.elapsed * 1e6),
+                        size, response.status_code)
+        recorder.maybe_flush()
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:36
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_attendance_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('marked_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('roster', models.BinaryField()),
+                ('presence', models.BinaryField()),
+                ('marked_by', models.ForeignKey(default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='attendance_sessions_marked', to=settings.AUTH_USER_MODEL)),
+                ('section', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attendance_sessions', to='users.section')),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attendance_sessions', to='users.subject')),
+            ],
+            options={
+                'verbose_name_plural': 'Attendance Sessions',
+                'ordering': ['-date', '-marked_at'],
+                'unique_together': {('subject', 'section', 'date')},
+            },
+        ),
+    ]
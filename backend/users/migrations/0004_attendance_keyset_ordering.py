@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:38
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_attendance_session'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='attendance',
+            options={'ordering': ['-date', '-marked_at', '-id'], 'verbose_name_plural': 'Attendances'},
+        ),
+        migrations.AlterModelOptions(
+            name='attendancesession',
+            options={'ordering': ['-date', '-marked_at', '-id'], 'verbose_name_plural': 'Attendance Sessions'},
+        ),
+    ]
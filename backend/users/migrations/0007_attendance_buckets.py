@@ -0,0 +1,47 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:42
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_notification_recipient'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StudentMonthlyAttendance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('present', models.PositiveIntegerField(default=0)),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_attendance', to=settings.AUTH_USER_MODEL)),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_attendance', to='users.subject')),
+            ],
+            options={
+                'verbose_name_plural': 'Student Monthly Attendance',
+                'unique_together': {('student', 'subject', 'month')},
+            },
+        ),
+        migrations.CreateModel(
+            name='SectionAttendanceBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('day', 'Day'), ('month', 'Month')], max_length=10)),
+                ('period_start', models.DateField()),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('present', models.PositiveIntegerField(default=0)),
+                ('section', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attendance_buckets', to='users.section')),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attendance_buckets', to='users.subject')),
+            ],
+            options={
+                'verbose_name_plural': 'Section Attendance Buckets',
+                'indexes': [models.Index(fields=['subject', 'granularity', 'period_start'], name='sectbucket_subj_gran_idx')],
+                'unique_together': {('section', 'subject', 'granularity', 'period_start')},
+            },
+        ),
+    ]
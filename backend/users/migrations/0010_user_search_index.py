@@ -0,0 +1,42 @@
+from django.db import migrations
+
+SEARCH_TABLE = 'users_user_search'
+PG_INDEX = 'users_user_search_trgm'
+PG_SEARCH_EXPRESSION = "(username || ' ' || first_name || ' ' || last_name || ' ' || email)"
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5('
+            'username, first_name, last_name, email, tokenize="unicode61", prefix="2 3")'
+        )
+        schema_editor.execute(
+            f'INSERT INTO {SEARCH_TABLE} (rowid, username, first_name, last_name, email) '
+            'SELECT id, username, first_name, last_name, email FROM users_user'
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute(
+            f'CREATE INDEX {PG_INDEX} ON users_user USING gin ({PG_SEARCH_EXPRESSION} gin_trgm_ops)'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+    elif vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {PG_INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0009_claims_token_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
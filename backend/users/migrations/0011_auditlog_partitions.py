@@ -0,0 +1,123 @@
+import datetime
+
+from django.db import migrations, models
+import django.utils.timezone
+
+TABLE = 'users_auditlog'
+LEGACY = 'users_auditlog_legacy'
+DEFAULT_PARTITION = 'users_auditlog_default'
+PARTITIONS_AHEAD = 3
+
+
+def _month(value):
+    return datetime.datetime(value.year, value.month, 1, tzinfo=datetime.timezone.utc)
+
+
+def _next_month(start):
+    return _month(start + datetime.timedelta(days=32))
+
+
+def partition_auditlog(apps, schema_editor):
+    """
+    On PostgreSQL, rebuild users_auditlog as a table partitioned by month on
+    timestamp. The primary key becomes (id, timestamp), as PostgreSQL
+    requires the partition key in it. SQLite keeps a plain live table that
+    users/audit_partitions.py rotates into month tables.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    AuditLogPartition = apps.get_model('users', 'AuditLogPartition')
+    execute = schema_editor.execute
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass', [TABLE])
+        if cursor.fetchone():
+            # Partitioned by an earlier run of this migration; only the
+            # catalog needs filling again.
+            cursor.execute(
+                'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+                'WHERE i.inhparent = %s::regclass', [TABLE],
+            )
+            for (name,) in cursor.fetchall():
+                if name != DEFAULT_PARTITION:
+                    start = datetime.datetime.strptime(name[-6:], '%Y%m').replace(tzinfo=datetime.timezone.utc)
+                    AuditLogPartition.objects.get_or_create(
+                        table_name=name, defaults={'period_start': start, 'period_end': _next_month(start)},
+                    )
+            return
+        cursor.execute(
+            "SELECT indexname FROM pg_indexes WHERE tablename = %s AND indexname <> %s",
+            [TABLE, f'{TABLE}_pkey'],
+        )
+        indexes = [name for (name,) in cursor.fetchall()]
+        cursor.execute(f'SELECT min("timestamp"), max("timestamp") FROM {TABLE}')
+        oldest, newest = cursor.fetchone()
+
+    # Index and primary key names are schema-wide, so free them up.
+    execute(f'ALTER TABLE {TABLE} RENAME TO {LEGACY}')
+    for name in indexes:
+        execute(f'DROP INDEX "{name}"')
+    execute(f'ALTER TABLE {LEGACY} RENAME CONSTRAINT {TABLE}_pkey TO {LEGACY}_pkey')
+    execute(f'ALTER TABLE {LEGACY} ALTER COLUMN id DROP DEFAULT')
+    execute(f'ALTER TABLE {LEGACY} ALTER COLUMN id DROP IDENTITY IF EXISTS')
+    execute(f'DROP SEQUENCE IF EXISTS {TABLE}_id_seq')
+
+    # Identity columns are not allowed on partitioned tables before
+    # PostgreSQL 17, so ids come from a sequence default instead.
+    execute(f'CREATE TABLE {TABLE} (LIKE {LEGACY} INCLUDING DEFAULTS) PARTITION BY RANGE ("timestamp")')
+    execute(f'CREATE SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id')
+    execute(f"ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{TABLE}_id_seq')")
+    execute(f"SELECT setval('{TABLE}_id_seq', COALESCE((SELECT max(id) FROM {LEGACY}), 0) + 1, false)")
+    execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY (id, "timestamp")')
+    execute(
+        f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_user_id_fk FOREIGN KEY (user_id) '
+        'REFERENCES users_user (id) DEFERRABLE INITIALLY DEFERRED'
+    )
+    execute(f'CREATE INDEX auditlog_timestamp_idx ON {TABLE} ("timestamp")')
+    execute(f'CREATE INDEX {TABLE}_user_id_idx ON {TABLE} (user_id)')
+    execute(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT')
+
+    now = django.utils.timezone.now()
+    start = _month(oldest or now)
+    end = _month(now)
+    for _ in range(PARTITIONS_AHEAD):
+        end = _next_month(end)
+    if newest and _month(newest) > end:
+        end = _month(newest)
+    while start <= end:
+        stop = _next_month(start)
+        name = f'{TABLE}_{start:%Y%m}'
+        execute(
+            f'CREATE TABLE {name} PARTITION OF {TABLE} '
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{stop.isoformat()}')"
+        )
+        AuditLogPartition.objects.create(table_name=name, period_start=start, period_end=stop)
+        start = stop
+
+    execute(f'INSERT INTO {TABLE} SELECT * FROM {LEGACY}')
+    execute(f'DROP TABLE {LEGACY}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0010_user_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditLogPartition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table_name', models.CharField(max_length=63, unique=True)),
+                ('period_start', models.DateTimeField()),
+                ('period_end', models.DateTimeField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name_plural': 'Audit Log Partitions',
+                'ordering': ['-period_start'],
+            },
+        ),
+        # Left partitioned when unapplied: the model works on either layout.
+        migrations.RunPython(partition_auditlog, migrations.RunPython.noop),
+    ]
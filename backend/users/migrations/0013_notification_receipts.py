@@ -0,0 +1,71 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+from users.bitsets import pack_ids
+
+
+def carry_read_flags(apps, schema_editor):
+    """
+    Keep the read flags of personal notifications as read receipts. The
+    flag on a broadcast row was shared by everyone it reached and is
+    dropped.
+    """
+    Notification = apps.get_model('users', 'Notification')
+    NotificationReceipt = apps.get_model('users', 'NotificationReceipt')
+    read = {}
+    for notification_id, user_id in (
+        Notification.objects.filter(is_read=True, recipient__isnull=False)
+        .order_by('id').values_list('id', 'recipient_id').iterator()
+    ):
+        read.setdefault(user_id, []).append(notification_id)
+    NotificationReceipt.objects.bulk_create(
+        [NotificationReceipt(user_id=user_id, read_ids=pack_ids(ids)) for user_id, ids in read.items()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0012_deletion_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationReceipt',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='notification_receipt', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('read_through', models.DateTimeField(blank=True, null=True)),
+                ('read_ids', models.BinaryField(default=bytes)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Notification Receipts',
+            },
+        ),
+        migrations.RunPython(carry_read_flags, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='notification',
+            name='notif_role_dept_sent_idx',
+        ),
+        migrations.RemoveField(
+            model_name='notification',
+            name='is_read',
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='recipient',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['recipient_role', 'department', 'recipient', 'sent_at'], name='notif_audience_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['recipient', 'sent_at'], name='notif_recipient_sent_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:17
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_notifications(apps, schema_editor):
+    """
+    Fill the audience counters from the notifications already sent. Receipts
+    are left uncounted and are counted on first read.
+    """
+    Notification = apps.get_model('users', 'Notification')
+    NotificationCounter = apps.get_model('users', 'NotificationCounter')
+    totals = {}
+    for role, department_id, recipient_id, count in (
+        Notification.objects.order_by().values_list('recipient_role', 'department_id', 'recipient_id')
+        .annotate(count=Count('id'))
+    ):
+        if recipient_id is not None:
+            key = f'user:{recipient_id}'
+        else:
+            key = f"{role}:{'-' if department_id is None else department_id}"
+        totals[key] = totals.get(key, 0) + count
+    NotificationCounter.objects.bulk_create(
+        [NotificationCounter(key=key, value=value) for key, value in totals.items()], batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0013_notification_receipts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Notification Counters',
+            },
+        ),
+        migrations.AddField(
+            model_name='notificationreceipt',
+            name='counted_for',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='notificationreceipt',
+            name='read_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_notifications, migrations.RunPython.noop),
+    ]
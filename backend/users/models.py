@@ -1,7 +1,10 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, models, transaction
 from django.utils import timezone
 
+from . import claims
+from .bitsets import pack_bits, pack_ids, popcount, test_bit, unpack_bits, unpack_ids
+
 
 class User(AbstractUser):
     """
@@ -19,9 +22,108 @@ class User(AbstractUser):
     department = models.ForeignKey('Department', on_delete=models.SET_NULL, null=True, blank=True)
     semester = models.ForeignKey('Semester', on_delete=models.SET_NULL, null=True, blank=True)
     section = models.ForeignKey('Section', on_delete=models.SET_NULL, null=True, blank=True)
+    # Bumped whenever a field signed into access tokens changes; tokens
+    # carrying an older version are refused.
+    token_version = models.PositiveIntegerField(default=0, editable=False)
+    # Set while a deletion job removes the user's dependents; such users are
+    # inactive and hidden from listings (see users/deletion.py).
+    pending_delete = models.BooleanField(default=False, editable=False)
+    
+    # Fields whose change revokes issued tokens.
+    TOKEN_STATE_FIELDS = ('role', 'department_id', 'semester_id', 'section_id', 'is_active')
+    
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Section rosters: filter(section=..., role='student')
+            models.Index(fields=['section', 'role'], name='user_section_role_idx'),
+        ]
     
     def __str__(self):
         return f"{self.username} ({self.get_role_display()})"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._token_state = instance._loaded_token_state()
+        return instance
+    
+    def _loaded_token_state(self):
+        # Read __dict__ directly so deferred fields are not loaded.
+        return {name: self.__dict__[name] for name in self.TOKEN_STATE_FIELDS if name in self.__dict__}
+    
+    def save(self, *args, **kwargs):
+        previous = getattr(self, '_token_state', None)
+        current = self._loaded_token_state()
+        changed = previous is not None and any(
+            previous[name] != current[name] for name in previous.keys() & current.keys()
+        )
+        if changed:
+            self.token_version += 1
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'token_version'}
+        super().save(*args, **kwargs)
+        self._token_state = current
+        if changed:
+            transaction.on_commit(lambda: claims.publish_token_state(self), using=kwargs.get('using'))
+    
+    @property
+    def is_admin(self):
+        return self.role == 'admin'
+    
+    @property
+    def is_hod(self):
+        return self.role == 'hod'
+    
+    @property
+    def is_faculty(self):
+        return self.role == 'faculty'
+    
+    @property
+    def is_student(self):
+        return self.role == 'student'
+
+
+class ClaimsUser(User):
+    """
+    A User rebuilt from the claims of a validated access token, without a
+    database read. Only id, username, role, the department/semester/section
+    ids and token_version are loaded; touching any other field fills all of
+    them at once from claims.cached_user(), which may be up to
+    CLAIMS_USER_CACHE_TTL seconds old. Code that writes a user should load it
+    with User.objects.get() rather than saving request.user.
+    """
+    CLAIM_FIELDS = {
+        'id': None,
+        'username': claims.USERNAME_CLAIM,
+        'role': claims.ROLE_CLAIM,
+        'department_id': claims.DEPARTMENT_CLAIM,
+        'semester_id': claims.SEMESTER_CLAIM,
+        'section_id': claims.SECTION_CLAIM,
+        'token_version': claims.TOKEN_VERSION_CLAIM,
+    }
+    
+    class Meta:
+        proxy = True
+    
+    @classmethod
+    def from_claims(cls, user_id, token):
+        values = {
+            attname: int(user_id) if claim is None else token[claim]
+            for attname, claim in cls.CLAIM_FIELDS.items()
+        }
+        field_names = [f.attname for f in cls._meta.concrete_fields if f.attname in values]
+        return cls.from_db(DEFAULT_DB_ALIAS, field_names, [values[name] for name in field_names])
+    
+    def refresh_from_db(self, using=None, fields=None):
+        deferred = self.get_deferred_fields()
+        if fields is not None and deferred and set(fields) <= deferred:
+            user = claims.cached_user(self.pk)
+            if user is not None:
+                for attname in deferred:
+                    setattr(self, attname, getattr(user, attname))
+                return
+        super().refresh_from_db(using=using, fields=fields)
 
 
 class Department(models.Model):
@@ -40,6 +142,8 @@ class Department(models.Model):
     )
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
+    # Set while a deletion job removes the department's dependents.
+    pending_delete = models.BooleanField(default=False, editable=False)
     
     class Meta:
         verbose_name_plural = "Departments"
@@ -120,7 +224,9 @@ class Subject(models.Model):
 
 class Notification(models.Model):
     """
-    Notification model for system notifications.
+    Notification model for system notifications. One row per notice,
+    however many users it reaches; audiences are resolved and read state is
+    kept per user by users/notifications.py.
     """
     title = models.CharField(max_length=200)
     message = models.TextField()
@@ -136,18 +242,128 @@ class Notification(models.Model):
     
     recipient_role = models.CharField(max_length=20, choices=RECIPIENT_ROLE_CHOICES)
     department = models.ForeignKey(Department, on_delete=models.CASCADE, null=True, blank=True)
-    is_read = models.BooleanField(default=False)
+    # Set for notices addressed to a single user (e.g. low-attendance alerts)
+    # Indexed by notif_recipient_sent_idx.
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='notifications', db_index=False)
     sent_at = models.DateTimeField(default=timezone.now)
     expires_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
         verbose_name_plural = "Notifications"
         ordering = ['-sent_at']
+        indexes = [
+            # Broadcast inboxes: filter(recipient_role__in=..., department=..., recipient=None)
+            # newest first, answered from the index alone (id is the rowid).
+            # expires_at trails sent_at so expired rows are skipped in the
+            # index without giving up its sent_at order.
+            models.Index(fields=['recipient_role', 'department', 'recipient', 'sent_at', 'expires_at'], name='notif_audience_idx'),
+            # Personal notices: filter(recipient=...) newest first
+            models.Index(fields=['recipient', 'sent_at', 'expires_at'], name='notif_recipient_sent_idx'),
+            # Expiry sweep: filter(expires_at__lte=now), over the notices
+            # that expire at all.
+            models.Index(fields=['expires_at'], name='notif_expiry_idx', condition=models.Q(expires_at__isnull=False)),
+        ]
     
     def __str__(self):
         return f"{self.title} - {self.recipient_role}"
 
 
+class NotificationReceipt(models.Model):
+    """
+    What a user has read of their inbox: every notification sent at or
+    before read_through, plus the ones in read_ids sent after it.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='notification_receipt')
+    read_through = models.DateTimeField(null=True, blank=True)
+    read_ids = models.BinaryField(default=bytes)  # packed int64 notification ids, see users.bitsets
+    # How many notifications of the inbox are read, valid for the audience
+    # and deletion epoch in counted_for (see notifications.unread()).
+    read_count = models.IntegerField(default=0)
+    counted_for = models.CharField(max_length=64, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = "Notification Receipts"
+    
+    @property
+    def read_id_set(self):
+        return set(unpack_ids(self.read_ids))
+    
+    def __str__(self):
+        return f"{self.user_id} read through {self.read_through}"
+
+
+class NotificationCounter(models.Model):
+    """
+    Number of notifications sent to one audience key: a role within a
+    department ('student:3'), a role everywhere ('student:-'), a single
+    user ('user:42'), or 'epoch', the number of notifications deleted.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    value = models.BigIntegerField(default=0)
+    
+    class Meta:
+        verbose_name_plural = "Notification Counters"
+    
+    def __str__(self):
+        return f"{self.key} = {self.value}"
+
+
+class EmailFanout(models.Model):
+    """
+    A notification waiting to have its email recipients resolved by
+    users/email_delivery.py, which walks its audience in user id order.
+    """
+    notification = models.OneToOneField(Notification, on_delete=models.CASCADE, primary_key=True, related_name='email_fanout')
+    resolved_through = models.BigIntegerField(default=0)  # last user id queued
+    resolved = models.BooleanField(default=False)
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        verbose_name_plural = "Email Fanouts"
+        indexes = [
+            # Worker polling: filter(resolved=False) oldest first
+            models.Index(fields=['resolved', 'created_at'], name='emailfanout_pending_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.notification_id} through user {self.resolved_through}"
+
+
+class EmailDelivery(models.Model):
+    """
+    One notification email to one recipient, with its delivery state.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+    
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE, related_name='email_deliveries')
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='email_deliveries')
+    email = models.EmailField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        unique_together = ['notification', 'recipient']
+        verbose_name_plural = "Email Deliveries"
+        indexes = [
+            # Worker polling: filter(status='pending', next_attempt_at__lte=now)
+            models.Index(fields=['status', 'next_attempt_at'], name='emaildelivery_due_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.notification_id} to {self.email} - {self.status}"
+
+
 class AuditLog(models.Model):
     """
     AuditLog model for tracking user actions.
@@ -163,11 +379,32 @@ class AuditLog(models.Model):
     class Meta:
         verbose_name_plural = "Audit Logs"
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['timestamp'], name='auditlog_timestamp_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.action}"
 
 
+class AuditLogPartition(models.Model):
+    """
+    Catalog of the monthly audit log tables: rolling tables on SQLite, native
+    partitions on PostgreSQL (see users/audit_partitions.py).
+    """
+    table_name = models.CharField(max_length=63, unique=True)
+    period_start = models.DateTimeField()
+    period_end = models.DateTimeField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-period_start']
+        verbose_name_plural = "Audit Log Partitions"
+
+    def __str__(self):
+        return self.table_name
+
+
 class Attendance(models.Model):
     """
     Attendance model for tracking student attendance.
@@ -182,7 +419,211 @@ class Attendance(models.Model):
     class Meta:
         unique_together = ['student', 'subject', 'date']
         verbose_name_plural = "Attendances"
-        ordering = ['-date', '-marked_at']
+        ordering = ['-date', '-marked_at', '-id']
+        indexes = [
+            # Per-student percentages: filter(student=..., subject=..., is_present=True)
+            models.Index(fields=['student', 'subject', 'is_present'], name='attendance_stu_subj_pres_idx'),
+            # Per-class reads and faculty/export listings by subject and date
+            models.Index(fields=['subject', 'date'], name='attendance_subject_date_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.student.username} - {self.subject.code} - {self.date}"
+
+
+class AttendanceRollup(models.Model):
+    """
+    Running attendance totals per student and subject, maintained by the
+    attendance write path so percentage endpoints never scan raw rows.
+    """
+    student = models.ForeignKey(User, on_delete=models.CASCADE, related_name='attendance_rollups')
+    subject = models.ForeignKey('Subject', on_delete=models.CASCADE, related_name='attendance_rollups')
+    total = models.PositiveIntegerField(default=0)
+    present = models.PositiveIntegerField(default=0)
+    last_date = models.DateField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ['student', 'subject']
+        verbose_name_plural = "Attendance Rollups"
+    
+    @property
+    def absent(self):
+        return self.total - self.present
+    
+    @property
+    def percentage(self):
+        return round(self.present / self.total * 100, 2) if self.total else 0
+    
+    def __str__(self):
+        return f"{self.student_id} - {self.subject_id}: {self.present}/{self.total}"
+
+
+class AttendanceSession(models.Model):
+    """
+    Compact attendance storage: one row per class session holding the roster
+    as it was when attendance was taken and a packed presence bitmap.
+    Used instead of per-student Attendance rows when
+    settings.ATTENDANCE_STORAGE is 'sessions'.
+    """
+    subject = models.ForeignKey('Subject', on_delete=models.CASCADE, related_name='attendance_sessions')
+    section = models.ForeignKey('Section', on_delete=models.CASCADE, related_name='attendance_sessions')
+    date = models.DateField()
+    marked_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='attendance_sessions_marked', default=None)
+    marked_at = models.DateTimeField(default=timezone.now)
+    roster = models.BinaryField()  # packed int64 student ids, see users.bitsets
+    presence = models.BinaryField()  # bit i is set when roster[i] was present
+    
+    class Meta:
+        unique_together = ['subject', 'section', 'date']
+        verbose_name_plural = "Attendance Sessions"
+        ordering = ['-date', '-marked_at', '-id']
+    
+    @classmethod
+    def build(cls, student_ids, present_ids, **kwargs):
+        return cls(
+            roster=pack_ids(student_ids),
+            presence=pack_bits(student_id in present_ids for student_id in student_ids),
+            **kwargs
+        )
+    
+    @property
+    def student_ids(self):
+        return unpack_ids(self.roster)
+    
+    @property
+    def roster_size(self):
+        return len(self.roster) // 8
+    
+    @property
+    def present_count(self):
+        return popcount(self.presence)
+    
+    @property
+    def percentage(self):
+        size = self.roster_size
+        return round(self.present_count / size * 100, 2) if size else 0
+    
+    def is_present(self, student_id):
+        """
+        Presence of one student, or None if they were not on the roster.
+        """
+        student_ids = self.student_ids
+        if student_id not in student_ids:
+            return None
+        return test_bit(self.presence, student_ids.index(student_id))
+    
+    def student_view(self):
+        """
+        Map of student id to presence for everyone on the frozen roster.
+        """
+        student_ids = self.student_ids
+        return dict(zip(student_ids, unpack_bits(self.presence, len(student_ids))))
+    
+    def __str__(self):
+        return f"{self.subject_id} - {self.section_id} - {self.date}"
+
+
+class SectionAttendanceBucket(models.Model):
+    """
+    Attendance marks per section and subject, aggregated by day or by month,
+    for trend charts. Kept current by the attendance write path.
+    """
+    GRANULARITY_CHOICES = [
+        ('day', 'Day'),
+        ('month', 'Month'),
+    ]
+    
+    section = models.ForeignKey('Section', on_delete=models.CASCADE, related_name='attendance_buckets')
+    subject = models.ForeignKey('Subject', on_delete=models.CASCADE, related_name='attendance_buckets')
+    granularity = models.CharField(max_length=10, choices=GRANULARITY_CHOICES)
+    period_start = models.DateField()  # the day, or the first day of the month
+    total = models.PositiveIntegerField(default=0)
+    present = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['section', 'subject', 'granularity', 'period_start']
+        verbose_name_plural = "Section Attendance Buckets"
+        indexes = [
+            models.Index(fields=['subject', 'granularity', 'period_start'], name='sectbucket_subj_gran_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.section_id} - {self.subject_id} - {self.granularity} {self.period_start}"
+
+
+class StudentMonthlyAttendance(models.Model):
+    """
+    Attendance marks per student and subject for one month.
+    """
+    student = models.ForeignKey(User, on_delete=models.CASCADE, related_name='monthly_attendance')
+    subject = models.ForeignKey('Subject', on_delete=models.CASCADE, related_name='monthly_attendance')
+    month = models.DateField()  # first day of the month
+    total = models.PositiveIntegerField(default=0)
+    present = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['student', 'subject', 'month']
+        verbose_name_plural = "Student Monthly Attendance"
+    
+    def __str__(self):
+        return f"{self.student_id} - {self.subject_id} - {self.month:%Y-%m}"
+
+
+class AttendanceSyncReceipt(models.Model):
+    """
+    Result of one attendance session applied through the batch sync endpoint,
+    keyed by the client's idempotency key so replays are answered from here.
+    """
+    faculty = models.ForeignKey(User, on_delete=models.CASCADE, related_name='attendance_sync_receipts')
+    idempotency_key = models.CharField(max_length=100)
+    payload_hash = models.CharField(max_length=64)
+    result = models.JSONField()
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        unique_together = ['faculty', 'idempotency_key']
+        verbose_name_plural = "Attendance Sync Receipts"
+    
+    def __str__(self):
+        return f"{self.faculty_id} - {self.idempotency_key}"
+
+
+class DeletionJob(models.Model):
+    """
+    Background deletion of a department or user and everything that cascades
+    from it, removed in chunks by users/deletion.py.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    model = models.CharField(max_length=100)  # app_label.ModelName
+    object_id = models.BigIntegerField()
+    object_repr = models.CharField(max_length=200)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='deletion_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    total_rows = models.IntegerField(default=0)
+    rows_done = models.IntegerField(default=0)
+    current_step = models.CharField(max_length=200, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    retry_at = models.DateTimeField(null=True, blank=True)  # failed jobs with attempts left
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name_plural = "Deletion Jobs"
+        indexes = [
+            # Worker polling: filter(status__in=['pending', 'running'])
+            models.Index(fields=['status', 'created_at'], name='deletionjob_status_idx'),
+        ]
     
     def __str__(self):
-        return f"{self.student.username} - {self.subject.code} - {self.date}"
\ No newline at end of file
+        return f"{self.model} {self.object_id} - {self.status}"
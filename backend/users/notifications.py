@@ -0,0 +1,453 @@
+"""
+Notification delivery, fanned out on read.
+
+A notice is stored once, as one Notification row addressed to a role ('all'
+for everyone), optionally narrowed to a department, or to a single
+recipient. Sending it to every student of a department is one INSERT.
+Nothing is written per recipient; a user's inbox is resolved when it is
+read:
+
+    broadcasts:  recipient_role IN (role, 'all')
+                 AND department IN (NULL, user's department)
+                 AND recipient IS NULL
+    personal:    recipient = user
+
+The first is answered from notif_audience_idx, the second from
+notif_recipient_sent_idx, both in sent_at order. A page of ids is read from
+the indexes alone and only that page's rows are loaded.
+
+Read state is one NotificationReceipt per user: read_through, a high-water
+mark below which everything is read, and read_ids, the notices after it
+that were read one at a time. Once read_ids holds more than
+NOTIFICATION_READ_EXCEPTIONS ids, the mark moves up to just before the
+oldest unread notice and the ids it now covers are dropped. Marking
+everything read moves the mark to the newest notice and empties read_ids.
+
+Unread counts are kept without a write per recipient either.
+NotificationCounter holds the number of notices sent to each audience key
+('student:3', 'student:-', 'all:3', 'all:-', 'user:42'). A user's inbox
+total is the sum of their five keys. Their receipt holds read_count, how
+many of those they have read. unread() is total minus read_count, served
+from the cache (NOTIFICATION_COUNTER_TTL) with the database behind it.
+
+A read_count only holds for the audience and deletion epoch it was
+counted for, stored in counted_for. It goes stale when the user changes
+role or department, or when notifications they may have read are deleted,
+which bumps the 'epoch' counter. A stale count is repaired the next time it
+is read, with one exact count of the unread notices.
+
+Expired notifications (expires_at in the past) drop out of inboxes at once;
+the indexes carry expires_at so they are skipped without reading the rows.
+They stay in the counters until users/expiry.py sweeps them, so an unread
+count may include notices that expired since it was last repaired, for at
+most the sweep interval.
+"""
+import contextvars
+import datetime
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max, Q
+from django.utils import timezone
+
+from . import push
+from .bitsets import pack_ids
+from .models import Notification, NotificationCounter, NotificationReceipt
+from .pagination import paginate_keyset
+
+ORDERING = ['-sent_at', '-id']
+BROADCAST_ROLE = push.BROADCAST_ROLE
+FIELDS = (
+    'id', 'title', 'message', 'recipient_role', 'department_id', 'recipient_id', 'sent_at', 'expires_at',
+    'sender__username', 'sender__first_name', 'sender__last_name',
+)
+
+
+def audience(user):
+    """
+    Q matching the notifications addressed to `user`.
+    """
+    # One equality term per (role, department) pair, so each branch of the
+    # OR seeks the full index prefix instead of filtering on department.
+    departments = [None] if user.department_id is None else [None, user.department_id]
+    condition = Q(recipient_id=user.pk)
+    for role in (user.role, BROADCAST_ROLE):
+        for department_id in departments:
+            condition |= Q(recipient_role=role, department_id=department_id, recipient__isnull=True)
+    return condition
+
+
+def unexpired(now=None):
+    """
+    Q matching the notifications that have not expired by `now`.
+    """
+    return Q(expires_at__isnull=True) | Q(expires_at__gt=now or timezone.now())
+
+
+def inbox(user, now=None):
+    return Notification.objects.filter(audience(user), unexpired(now))
+
+
+def send(sender, title, message, recipient_role, department=None, recipient=None, expires_at=None):
+    """
+    Store one notice for its whole audience and return it.
+    """
+    return Notification.objects.create(
+        sender=sender, title=title, message=message, recipient_role=recipient_role,
+        department=department, recipient=recipient, expires_at=expires_at,
+    )
+
+
+class ReadState:
+    """
+    A user's receipt unpacked for checking many notifications.
+    """
+    def __init__(self, receipt=None):
+        self.read_through = receipt.read_through if receipt else None
+        self.read_ids = receipt.read_id_set if receipt else set()
+
+    @classmethod
+    def of(cls, user):
+        return cls(NotificationReceipt.objects.filter(user_id=user.pk).first())
+
+    def is_read(self, notification_id, sent_at):
+        if self.read_through is not None and sent_at <= self.read_through:
+            return True
+        return notification_id in self.read_ids
+
+
+def _row(notification, state):
+    names = (notification['sender__first_name'], notification['sender__last_name'])
+    return {
+        'id': notification['id'],
+        'title': notification['title'],
+        'message': notification['message'],
+        'recipient_role': notification['recipient_role'],
+        'department': notification['department_id'],
+        'personal': notification['recipient_id'] is not None,
+        'sender': ' '.join(name for name in names if name) or notification['sender__username'],
+        'sent_at': notification['sent_at'],
+        'expires_at': notification['expires_at'],
+        'is_read': state.is_read(notification['id'], notification['sent_at']),
+    }
+
+
+def inbox_keys(user):
+    """
+    (id, sent_at) of the notifications in `user`'s inbox, the keys an inbox
+    page is read by.
+    """
+    return inbox(user).values('id', 'sent_at')
+
+
+def inbox_page(user, cursor=None, page_size=50):
+    """
+    Return (notifications, next_cursor) for one page of `user`'s inbox,
+    newest first, each with its is_read flag.
+    """
+    keys, next_cursor = paginate_keyset(inbox_keys(user), ORDERING, cursor, page_size)
+    return inbox_rows(user, [key['id'] for key in keys]), next_cursor
+
+
+def inbox_rows(user, ids):
+    """
+    Inbox rows for the notifications `ids`, in that order.
+    """
+    rows = {row['id']: row for row in Notification.objects.filter(id__in=ids).values(*FIELDS)}
+    state = ReadState.of(user)
+    return [_row(rows[notification_id], state) for notification_id in ids if notification_id in rows]
+
+
+def count_unread(user, receipt=None):
+    """
+    Number of notifications in `user`'s inbox they have not read, counted
+    from the notifications themselves. unread() is the cheap way.
+    """
+    if receipt is None:
+        receipt = NotificationReceipt.objects.filter(user_id=user.pk).first()
+    unread = inbox(user)
+    if receipt is not None:
+        if receipt.read_through is not None:
+            unread = unread.filter(sent_at__gt=receipt.read_through)
+        unread = unread.exclude(id__in=receipt.read_id_set)
+    return unread.count()
+
+
+# Unread counters
+
+EPOCH = 'epoch'
+
+
+def audience_key(recipient_role, department_id=None, recipient_id=None):
+    if recipient_id is not None:
+        return f'user:{recipient_id}'
+    return f"{recipient_role}:{'-' if department_id is None else department_id}"
+
+
+def audience_keys(user):
+    departments = [None] if user.department_id is None else [None, user.department_id]
+    return [audience_key(None, recipient_id=user.pk)] + [
+        audience_key(role, department_id) for role in (user.role, BROADCAST_ROLE) for department_id in departments
+    ]
+
+
+def _total_key(key):
+    return f'notifications:total:{key}'
+
+
+def _read_key(user_id):
+    return f'notifications:read:{user_id}'
+
+
+def _ttl():
+    return getattr(settings, 'NOTIFICATION_COUNTER_TTL', 300)
+
+
+def _totals(keys):
+    """
+    {key: value} for the counters `keys`, through the cache.
+    """
+    cached = cache.get_many([_total_key(key) for key in keys])
+    totals = {key: cached[_total_key(key)] for key in keys if _total_key(key) in cached}
+    missing = [key for key in keys if key not in totals]
+    if missing:
+        loaded = dict(NotificationCounter.objects.filter(key__in=missing).values_list('key', 'value'))
+        loaded = {key: loaded.get(key, 0) for key in missing}
+        cache.set_many({_total_key(key): value for key, value in loaded.items()}, _ttl())
+        totals.update(loaded)
+    return totals
+
+
+_deferred = contextvars.ContextVar('notification_counter_deltas', default=None)
+
+
+@contextmanager
+def deferred_counts():
+    """
+    Collect the counter changes made in the block, e.g. by deleting many
+    notifications, and apply them once, summed, when it ends.
+    """
+    deltas = {}
+    token = _deferred.set(deltas)
+    try:
+        yield
+    finally:
+        _deferred.reset(token)
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if deltas:
+        _adjust(deltas)
+
+
+def _adjust(deltas):
+    """
+    Add `deltas` ({key: delta}) to the counters in the current transaction;
+    the cached values are dropped once it commits.
+    """
+    pending = _deferred.get()
+    if pending is not None:
+        for key, delta in deltas.items():
+            pending[key] = pending.get(key, 0) + delta
+        return
+    for key, delta in deltas.items():
+        if not NotificationCounter.objects.filter(key=key).update(value=F('value') + delta):
+            try:
+                with transaction.atomic():
+                    NotificationCounter.objects.create(key=key, value=delta)
+            except IntegrityError:
+                # Created by a concurrent first notice to the same audience.
+                NotificationCounter.objects.filter(key=key).update(value=F('value') + delta)
+    keys = [_total_key(key) for key in deltas]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def count_sent(notifications):
+    """
+    Count new notifications into their audience counters. Saved ones are
+    counted by a post_save signal; bulk_create callers call this.
+    """
+    deltas = {}
+    for notification in notifications:
+        key = audience_key(notification.recipient_role, notification.department_id, notification.recipient_id)
+        deltas[key] = deltas.get(key, 0) + 1
+    if deltas:
+        _adjust(deltas)
+
+
+def count_deleted(notification):
+    """
+    Uncount a deleted notification. It may have been read, so every
+    read_count is due for repair.
+    """
+    key = audience_key(notification.recipient_role, notification.department_id, notification.recipient_id)
+    _adjust({key: -1, EPOCH: 1})
+
+
+def _signature(user, epoch):
+    return f'{user.role}:{user.department_id}:{epoch}'
+
+
+def _cache_read_count(user_id, counted_for, read_count):
+    transaction.on_commit(lambda: cache.set(_read_key(user_id), (counted_for, read_count), _ttl()))
+
+
+def _recount(user, receipt):
+    """
+    Bring `receipt` (locked) up to date with the user's audience and the
+    deletion epoch, from the counters in the database.
+    """
+    keys = audience_keys(user)
+    totals = dict(NotificationCounter.objects.filter(key__in=keys + [EPOCH]).values_list('key', 'value'))
+    signature = _signature(user, totals.get(EPOCH, 0))
+    if receipt.counted_for != signature:
+        receipt.read_count = sum(totals.get(key, 0) for key in keys) - count_unread(user, receipt)
+        receipt.counted_for = signature
+        receipt.save(update_fields=['read_count', 'counted_for', 'updated_at'])
+    _cache_read_count(user.pk, receipt.counted_for, receipt.read_count)
+
+
+def unread(user):
+    """
+    Number of notifications in `user`'s inbox they have not read: two cache
+    reads while the counts are current.
+    """
+    keys = audience_keys(user)
+    totals = _totals(keys + [EPOCH])
+    signature = _signature(user, totals[EPOCH])
+    state = cache.get(_read_key(user.pk))
+    if state is None or state[0] != signature:
+        receipt = NotificationReceipt.objects.filter(user_id=user.pk).values_list('counted_for', 'read_count').first()
+        if receipt is not None and receipt[0] == signature:
+            state = receipt
+            cache.set(_read_key(user.pk), state, _ttl())
+        else:
+            with transaction.atomic():
+                receipt = _locked_receipt(user)
+                _recount(user, receipt)
+            state = (receipt.counted_for, receipt.read_count)
+            # Counted against the database; drop the cached totals too if
+            # they were behind it.
+            if state[0] != signature:
+                cache.delete_many([_total_key(key) for key in keys + [EPOCH]])
+                totals = _totals(keys + [EPOCH])
+    return max(0, sum(totals[key] for key in keys) - state[1])
+
+
+# Push events (see users/push.py)
+
+def notification_event(notification):
+    """
+    The 'notification' event for a new notification. Clients add one to
+    their unread count for it.
+    """
+    sender = notification.sender
+    return {
+        'type': 'notification',
+        'recipient_role': notification.recipient_role,
+        'department': notification.department_id,
+        'recipient': notification.recipient_id,
+        'data': _row({
+            'id': notification.id,
+            'title': notification.title,
+            'message': notification.message,
+            'recipient_role': notification.recipient_role,
+            'department_id': notification.department_id,
+            'recipient_id': notification.recipient_id,
+            'sent_at': notification.sent_at,
+            'expires_at': notification.expires_at,
+            'sender__username': sender.username,
+            'sender__first_name': sender.first_name,
+            'sender__last_name': sender.last_name,
+        }, ReadState()),
+    }
+
+
+def unread_event(user):
+    """
+    The 'unread' event carrying `user`'s unread count after their read
+    state changed.
+    """
+    return {'type': 'unread', 'user': user.pk, 'data': {'unread': unread(user)}}
+
+
+def _locked_receipt(user):
+    NotificationReceipt.objects.get_or_create(user_id=user.pk)
+    return NotificationReceipt.objects.select_for_update().get(user_id=user.pk)
+
+
+def _compact(user, receipt, read_ids):
+    """
+    Move read_through up to just before the oldest unread notification and
+    return the ids in `read_ids` it does not cover.
+    """
+    newer = inbox(user).order_by('sent_at', 'id').values_list('id', 'sent_at')
+    if receipt.read_through is not None:
+        newer = newer.filter(sent_at__gt=receipt.read_through)
+    covered, oldest_unread, latest = set(), None, None
+    # Every row before the first unread one is in read_ids, so this reads at
+    # most len(read_ids) + 1 rows.
+    for notification_id, sent_at in newer.iterator():
+        if notification_id not in read_ids:
+            oldest_unread = sent_at
+            break
+        covered.add((notification_id, sent_at))
+        latest = sent_at
+    if oldest_unread is None:
+        if latest is not None:
+            receipt.read_through = latest
+        return set()
+    mark = oldest_unread - datetime.timedelta(microseconds=1)
+    if receipt.read_through is None or mark > receipt.read_through:
+        receipt.read_through = mark
+    return read_ids - {notification_id for notification_id, sent_at in covered if sent_at <= mark}
+
+
+def mark_read(user, notification_ids):
+    """
+    Mark notifications of `user`'s inbox read. Returns the ids that were
+    found in the inbox.
+    """
+    found = dict(inbox(user).filter(id__in=list(notification_ids)).values_list('id', 'sent_at'))
+    if not found:
+        return []
+    with transaction.atomic():
+        receipt = _locked_receipt(user)
+        _recount(user, receipt)
+        state = ReadState(receipt)
+        newly_read = {
+            notification_id for notification_id, sent_at in found.items() if not state.is_read(notification_id, sent_at)
+        }
+        if newly_read:
+            read_ids = state.read_ids | newly_read
+            if len(read_ids) > getattr(settings, 'NOTIFICATION_READ_EXCEPTIONS', 64):
+                read_ids = _compact(user, receipt, read_ids)
+            receipt.read_ids = pack_ids(sorted(read_ids))
+            receipt.read_count += len(newly_read)
+            receipt.save(update_fields=['read_through', 'read_ids', 'read_count', 'updated_at'])
+            _cache_read_count(user.pk, receipt.counted_for, receipt.read_count)
+    if newly_read:
+        # Built after the commit, from the counts it wrote.
+        push.publish(unread_event(user))
+    return sorted(found)
+
+
+def mark_all_read(user):
+    """
+    Mark everything in `user`'s inbox read, up to the newest notification.
+    """
+    latest = inbox(user).aggregate(latest=Max('sent_at'))['latest']
+    if latest is None:
+        return
+    with transaction.atomic():
+        receipt = _locked_receipt(user)
+        if receipt.read_through is not None and receipt.read_through >= latest:
+            return
+        receipt.read_through = latest
+        receipt.read_ids = b''
+        # Uncounted now, so _recount() counts it in full: only notices sent
+        # after `latest` are left unread.
+        receipt.counted_for = ''
+        _recount(user, receipt)
+        receipt.save(update_fields=['read_through', 'read_ids', 'updated_at'])
+    push.publish(unread_event(user))
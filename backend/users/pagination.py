@@ -0,0 +1,97 @@
+"""
+Keyset (cursor) pagination helpers.
+
+A cursor is the ordering-key values of the last row on a page, encoded as
+URL-safe base64 JSON. The next page is fetched with a WHERE clause on those
+values, so every page costs the same no matter how deep the client pages.
+"""
+import base64
+import datetime
+import json
+
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _encode_value(value):
+    # Full isoformat; DjangoJSONEncoder would drop microseconds and break
+    # equality comparisons on timestamps.
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f'Cannot encode {type(value).__name__} in a cursor')
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), default=_encode_value, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, length):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise InvalidCursor('Invalid cursor')
+    if not isinstance(values, list) or len(values) != length:
+        raise InvalidCursor('Invalid cursor')
+    return values
+
+
+def keyset_after(ordering, values):
+    """
+    Q matching rows that come strictly after `values` in `ordering`, e.g.
+    ordering ['-date', '-marked_at', '-id'] gives
+    date < d OR (date = d AND marked_at < m) OR (date = d AND marked_at = m AND id < i).
+    """
+    condition = Q()
+    for index, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        clause = Q(**{f'{name}__{lookup}': values[index]})
+        for previous, value in zip(ordering[:index], values[:index]):
+            clause &= Q(**{previous.lstrip('-'): value})
+        condition |= clause
+    return condition
+
+
+def keyset_values(obj, ordering):
+    if isinstance(obj, dict):
+        return [obj[field.lstrip('-')] for field in ordering]
+    return [getattr(obj, field.lstrip('-')) for field in ordering]
+
+
+def keyset_page(queryset, ordering, after=None, page_size=50):
+    """
+    The query for the page of `queryset` in `ordering` that follows the
+    key values `after`: page_size + 1 rows, the extra one showing whether
+    another page follows.
+    """
+    queryset = queryset.order_by(*ordering)
+    if after is not None:
+        queryset = queryset.filter(keyset_after(ordering, after))
+    return queryset[:page_size + 1]
+
+
+def paginate_keyset(queryset, ordering, cursor=None, page_size=50):
+    """
+    Return (rows, next_cursor) for one page of `queryset` ordered by
+    `ordering`, which must end in a unique field. next_cursor is None on the
+    last page.
+    """
+    after = decode_cursor(cursor, len(ordering)) if cursor else None
+    rows = list(keyset_page(queryset, ordering, after, page_size))
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, encode_cursor(keyset_values(rows[-1], ordering))
+
+
+def page_size_param(request, default=50, maximum=200):
+    try:
+        size = int(request.query_params.get('page_size', default))
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, maximum))
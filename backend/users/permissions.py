@@ -38,11 +38,11 @@ class IsSameDepartment(permissions.BasePermission):
     Permission class to check if requesting user belongs to same department as the resource.
     """
     def has_object_permission(self, request, view, obj):
-        if hasattr(obj, 'department'):
-            return obj.department == request.user.department
-        elif hasattr(request.user, 'department'):
+        if hasattr(obj, 'department_id'):
+            return obj.department_id == request.user.department_id
+        elif hasattr(request.user, 'department_id'):
             # For cases where we're checking against the user's own department
-            return obj == request.user.department
+            return obj.pk == request.user.department_id
         return False
 
 
@@ -61,7 +61,7 @@ class CanModifyUser(permissions.BasePermission):
         
         # HODs can modify faculty and students in their department
         if request.user.role == 'hod':
-            if obj.department == request.user.department:
+            if obj.department_id == request.user.department_id:
                 return obj.role in ['faculty', 'student']
         
         # Faculty can modify students in their assigned classes
@@ -70,6 +70,6 @@ class CanModifyUser(permissions.BasePermission):
             if obj.role == 'student':
                 # Check if the student is in a class the faculty teaches
                 # This would require additional checks based on the subject/section relationship
-                return obj.department == request.user.department
+                return obj.department_id == request.user.department_id
         
         return False
\ No newline at end of file
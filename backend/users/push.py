@@ -0,0 +1,266 @@
+"""
+In-process publish/subscribe hub for pushing events to connected clients.
+
+Streams (users/streams.py) subscribe to the hub of their ASGI process. Each
+subscription is an asyncio queue on the event loop, so an idle connection
+costs a coroutine and a queue, not a thread. Code that changes something
+calls publish() from any thread or process. Once the transaction commits,
+the event goes to the PUSH_BACKEND, which brings it to the hub of every
+process:
+
+- LocalBackend hands it to this process's hub directly. It is enough when a
+  single ASGI process serves both the API and the streams.
+- FileBackend appends it to a JSON-lines segment file in PUSH_DIR, one per
+  hour. Every process with subscribers tails the current segment every
+  PUSH_POLL_INTERVAL seconds. A publisher that starts a new segment deletes
+  the ones older than PUSH_RETENTION seconds. It needs PUSH_DIR to be shared
+  by the processes, which a single host gives for free.
+
+Events are dicts with a 'type':
+
+- 'notification' carries recipient_role, department and recipient, the
+  same audience fields as the Notification, and is routed by them.
+- 'unread' carries 'user' and goes to that user's streams only.
+
+A subscriber whose queue (PUSH_QUEUE_SIZE events) fills up is flagged as
+overflowed instead of blocking the hub; its stream tells the client to
+resync.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_ROLE = 'all'
+SEGMENT_SECONDS = 3600
+SEGMENT_SUFFIX = '.jsonl'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class Subscriber:
+    __slots__ = ('user_id', 'role', 'department_id', 'queue', 'overflowed')
+
+    def __init__(self, user_id, role, department_id):
+        self.user_id = user_id
+        self.role = role
+        self.department_id = department_id
+        self.queue = asyncio.Queue(maxsize=_setting('PUSH_QUEUE_SIZE', 100))
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class Hub:
+    """
+    Subscribers of this process, indexed by user and by (role, department)
+    so an event reaches its audience without a pass over every connection.
+    """
+    def __init__(self):
+        self._loop = None
+        self._listener = None
+        self._users = defaultdict(set)
+        self._roles = defaultdict(lambda: defaultdict(set))
+
+    @property
+    def connections(self):
+        return sum(len(subscribers) for subscribers in self._users.values())
+
+    def subscribe(self, user_id, role, department_id):
+        """
+        Register a subscriber; must be called on the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._listener = loop, None
+        if self._listener is None or self._listener.done():
+            self._listener = loop.create_task(get_backend().listen(self.dispatch))
+        subscriber = Subscriber(user_id, role, department_id)
+        self._users[user_id].add(subscriber)
+        self._roles[role][department_id].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self._discard(self._users, subscriber.user_id, subscriber)
+        departments = self._roles[subscriber.role]
+        self._discard(departments, subscriber.department_id, subscriber)
+        if not departments:
+            del self._roles[subscriber.role]
+
+    @staticmethod
+    def _discard(index, key, subscriber):
+        subscribers = index.get(key)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del index[key]
+
+    def dispatch(self, event):
+        """
+        Deliver `event` to the matching subscribers. Safe to call from any
+        thread; a no-op in a process that has never had a subscriber.
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._deliver(event)
+        else:
+            loop.call_soon_threadsafe(self._deliver, event)
+
+    def _targets(self, event):
+        if event['type'] == 'unread':
+            return self._users.get(event['user'], ())
+        if event['type'] != 'notification':
+            return ()
+        if event.get('recipient') is not None:
+            return self._users.get(event['recipient'], ())
+        roles = list(self._roles) if event['recipient_role'] == BROADCAST_ROLE else [event['recipient_role']]
+        targets = []
+        for role in roles:
+            departments = self._roles.get(role, {})
+            if event.get('department') is None:
+                for subscribers in departments.values():
+                    targets.extend(subscribers)
+            else:
+                targets.extend(departments.get(event['department'], ()))
+        return targets
+
+    def _deliver(self, event):
+        for subscriber in list(self._targets(event)):
+            subscriber.put(event)
+
+
+hub = Hub()
+
+
+# Backends
+
+class LocalBackend:
+    """
+    Delivers to the publishing process's own hub.
+    """
+    def publish(self, event):
+        hub.dispatch(event)
+
+    async def listen(self, dispatch):
+        return
+
+
+class FileBackend:
+    """
+    Cross-process delivery through append-only segment files.
+    """
+    def __init__(self, directory=None):
+        self.directory = str(directory or _setting('PUSH_DIR', 'push'))
+
+    def _segment(self, now=None):
+        index = int((time.time() if now is None else now) // SEGMENT_SECONDS)
+        return os.path.join(self.directory, f'{index:012d}{SEGMENT_SUFFIX}')
+
+    def _segments(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(os.path.join(self.directory, name) for name in names if name.endswith(SEGMENT_SUFFIX))
+
+    def publish(self, event):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._segment()
+        starting = not os.path.exists(path)
+        data = (json.dumps(event, cls=DjangoJSONEncoder, separators=(',', ':')) + '\n').encode()
+        # One write() with O_APPEND, so lines from concurrent publishers do
+        # not interleave.
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        if starting:
+            self.prune()
+
+    def prune(self, now=None):
+        cutoff = self._segment((time.time() if now is None else now) - _setting('PUSH_RETENTION', 3600))
+        for path in self._segments():
+            if path < cutoff:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    async def listen(self, dispatch):
+        interval = _setting('PUSH_POLL_INTERVAL', 0.25)
+        # Start at the end: a new listener only wants what comes next.
+        segments = self._segments()
+        path = segments[-1] if segments else self._segment()
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+        pending = b''
+        while True:
+            try:
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    chunk = f.read()
+            except FileNotFoundError:
+                chunk = b''
+            offset += len(chunk)
+            # A line is only complete once its newline has been written.
+            *lines, pending = (pending + chunk).split(b'\n')
+            for line in lines:
+                if line:
+                    dispatch(json.loads(line))
+            if not chunk:
+                later = [segment for segment in self._segments() if segment > path]
+                if later:
+                    path, offset, pending = later[0], 0, b''
+                    continue
+                await asyncio.sleep(interval)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = import_string(_setting('PUSH_BACKEND', 'users.push.LocalBackend'))()
+    return _backend
+
+
+def publish(event):
+    """
+    Push `event` to the connected clients it is addressed to, once the
+    current transaction commits.
+    """
+    transaction.on_commit(lambda: _publish_now(event))
+
+
+def _publish_now(event):
+    # Runs after the commit: a failure here loses the push, not the change.
+    try:
+        get_backend().publish(event)
+    except Exception:
+        logger.exception('Could not publish %s event', event.get('type'))
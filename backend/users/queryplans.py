@@ -0,0 +1,151 @@
+"""
+Query-plan regression checks.
+
+ENDPOINT_QUERIES lists the queries the API endpoints run against large
+tables, built by the same functions the views call, so a change to a view's
+query is what gets explained. `manage.py check_query_plans` seeds a dataset,
+runs EXPLAIN on each one and fails if any of them falls back to a full table
+scan.
+"""
+import datetime
+import re
+
+from django.db import connection
+
+from . import notifications
+from .attendance import (
+    ATTENDANCE_ORDERING, existing_marks, faculty_records, faculty_rollup_rows, roster_ids,
+    student_records, student_rollups,
+)
+from .audit_partitions import audit_page_query
+from .directory import DIRECTORY_ORDERING, directory_rows
+from .expiry import expired
+from .exports import export_rows
+from .models import User, Attendance, AttendanceRollup, AttendanceSession, Notification, AuditLog
+from .pagination import keyset_page
+
+# Tables that grow with the number of students, classes or events.
+LARGE_TABLES = {
+    User._meta.db_table,
+    Attendance._meta.db_table,
+    AttendanceRollup._meta.db_table,
+    AttendanceSession._meta.db_table,
+    Notification._meta.db_table,
+    AuditLog._meta.db_table,
+}
+
+ENDPOINT_QUERIES = {}
+
+
+def endpoint_query(name):
+    """
+    Register a function building a queryset, or raw (sql, params), from the
+    seeded dataset.
+    """
+    def decorator(func):
+        ENDPOINT_QUERIES[name] = func
+        return func
+    return decorator
+
+
+def _student(seed):
+    return User.objects.get(pk=seed.student_ids[0])
+
+
+@endpoint_query('faculty.mark_attendance roster')
+def _roster(seed):
+    return roster_ids(seed.section)
+
+
+@endpoint_query('faculty.mark_attendance existing rows')
+def _existing_rows(seed):
+    return existing_marks(seed.subject, seed.section, datetime.date(2000, 1, 1))
+
+
+@endpoint_query('faculty.get_attendance_records page')
+def _faculty_records(seed):
+    return keyset_page(faculty_records(seed.faculty), ATTENDANCE_ORDERING)
+
+
+@endpoint_query('faculty.attendance_summary')
+def _faculty_summary(seed):
+    return faculty_rollup_rows(seed.faculty)
+
+
+@endpoint_query('student.my_attendance records')
+def _student_records(seed):
+    return student_records(_student(seed))
+
+
+@endpoint_query('student.my_subjects rollups')
+def _student_rollups(seed):
+    return student_rollups(_student(seed))
+
+
+@endpoint_query('hod.export_attendance by subject and dates')
+def _export(seed):
+    return export_rows({'subject_id': seed.subject.id, 'date_from': datetime.date(2000, 1, 1)})
+
+
+@endpoint_query('admin.manage_users directory search')
+def _directory(seed):
+    users = directory_rows(User.objects.filter(pending_delete=False), {'q': 'student', 'role': 'student'})
+    return keyset_page(users, DIRECTORY_ORDERING)
+
+
+@endpoint_query('notifications inbox')
+def _inbox(seed):
+    return keyset_page(notifications.inbox_keys(_student(seed)), notifications.ORDERING)
+
+
+@endpoint_query('expired notification sweep')
+def _expired(seed):
+    return expired(datetime.datetime(2000, 2, 1, tzinfo=datetime.timezone.utc), 500)
+
+
+@endpoint_query('audit log recent')
+def _audit(seed):
+    return audit_page_query({'date_from': datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)})
+
+
+def full_scans(plan, vendor=None):
+    """
+    Names of large tables that `plan` (EXPLAIN output) reads with a full scan.
+    SQLite reports "SCAN <table>" without a "USING ... INDEX" clause;
+    PostgreSQL reports "Seq Scan on <table>".
+    """
+    vendor = vendor or connection.vendor
+    tables = set()
+    for line in plan.splitlines():
+        if vendor == 'postgresql':
+            match = re.search(r'Seq Scan on (\w+)', line)
+        else:
+            match = re.search(r'\bSCAN (\w+)', line)
+            if match and 'USING' in line[match.end():]:
+                match = None
+        if match and match.group(1) in LARGE_TABLES:
+            tables.add(match.group(1))
+    return tables
+
+
+def explain_endpoint_queries(seed):
+    """
+    Yield (name, plan, full-scanned tables) for every registered query.
+    On PostgreSQL sequential scans are disabled for the check so the planner
+    only picks one when no usable index exists, whatever the seeded row counts.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+    for name, build in ENDPOINT_QUERIES.items():
+        plan = _explain(build(seed))
+        yield name, plan, full_scans(plan)
+
+
+def _explain(query):
+    if not isinstance(query, tuple):
+        return query.explain()
+    sql, params = query
+    with connection.cursor() as cursor:
+        cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+        return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
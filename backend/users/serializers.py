@@ -1,7 +1,26 @@
 from rest_framework import serializers
-from django.contrib.auth import authenticate
+from rest_framework.settings import api_settings as rest_settings
 from django.contrib.auth.hashers import make_password
-from .models import User, Department, Semester, Section
+from django.db.models import QuerySet
+from django.db.models.manager import BaseManager
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from .claims import TOKEN_VERSION_CLAIM, token_state
+from .login import averify_credentials
+from .models import User, Department, Semester, Section, Notification
+from .tokens import ClaimsRefreshToken
+
+
+class SelectRelatedListSerializer(serializers.ListSerializer):
+    """
+    List serializer that adds the child's Meta.select_related joins to the
+    queryset it is given, so related names are read without a query per row.
+    """
+    def to_representation(self, data):
+        if isinstance(data, (QuerySet, BaseManager)):
+            data = data.all().select_related(*getattr(self.child.Meta, 'select_related', ()))
+        return super().to_representation(data)
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -30,31 +49,115 @@ class UserSerializer(serializers.ModelSerializer):
             'department_name', 'semester_number', 'section_name'
         ]
         read_only_fields = ['id', 'date_joined', 'last_login']
+        list_serializer_class = SelectRelatedListSerializer
+        select_related = ['department', 'semester', 'section']
+
+
+class DepartmentSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the Department model.
+    """
+    class Meta:
+        model = Department
+        fields = ['id', 'name', 'code', 'hod', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'created_at', 'updated_at']
+
+
+class NotificationSerializer(serializers.ModelSerializer):
+    """
+    Serializer for sending a notification to a role, optionally within a
+    department.
+    """
+    class Meta:
+        model = Notification
+        fields = ['id', 'title', 'message', 'recipient_role', 'department', 'sent_at', 'expires_at']
+        read_only_fields = ['id', 'sent_at']
+
+
+class UserValuesSerializer:
+    """
+    Read-only equivalent of UserSerializer(queryset, many=True) for list
+    endpoints: one values() query joining the related names, with no model
+    instances built. `data` matches UserSerializer's output field for field.
+    """
+    columns = {
+        'id': 'id',
+        'username': 'username',
+        'email': 'email',
+        'first_name': 'first_name',
+        'last_name': 'last_name',
+        'role': 'role',
+        'department': 'department_id',
+        'semester': 'semester_id',
+        'section': 'section_id',
+        'is_active': 'is_active',
+        'date_joined': 'date_joined',
+        'last_login': 'last_login',
+        'department_name': 'department__name',
+        'semester_number': 'semester__number',
+        'section_name': 'section__name',
+    }
+    
+    def __init__(self, rows):
+        # A User queryset, or rows already fetched through values().
+        self.rows = rows
+    
+    @classmethod
+    def values(cls, queryset):
+        return queryset.values(*cls.columns.values())
+    
+    @property
+    def data(self):
+        datetime_field = serializers.DateTimeField()
+        rows = self.values(self.rows) if isinstance(self.rows, QuerySet) else self.rows
+        data = []
+        for row in rows:
+            item = {name: row[column] for name, column in self.columns.items()}
+            for key in ('date_joined', 'last_login'):
+                if item[key] is not None:
+                    item[key] = datetime_field.to_representation(item[key])
+            data.append(item)
+        return data
 
 
 class LoginSerializer(serializers.Serializer):
     """
-    Serializer for user login.
+    Serializer for user login. is_valid() checks the fields; the credentials
+    are checked by awaiting check_credentials(), so the password hash holds
+    no thread (see users/login.py).
     """
     username = serializers.CharField()
     password = serializers.CharField(write_only=True)
 
-    def validate(self, attrs):
-        username = attrs.get('username')
-        password = attrs.get('password')
+    async def check_credentials(self):
+        """
+        The user the validated credentials belong to; raises ValidationError
+        when they do not match.
+        """
+        user = await averify_credentials(
+            self.context.get('request'), self.validated_data['username'], self.validated_data['password'],
+        )
+        if not user:
+            raise serializers.ValidationError({rest_settings.NON_FIELD_ERRORS_KEY: ['Invalid credentials.']})
+        if not user.is_active:
+            raise serializers.ValidationError({rest_settings.NON_FIELD_ERRORS_KEY: ['User account is disabled.']})
+        return user
 
-        if username and password:
-            user = authenticate(username=username, password=password)
-            if user:
-                if not user.is_active:
-                    raise serializers.ValidationError('User account is disabled.')
-                attrs['user'] = user
-            else:
-                raise serializers.ValidationError('Invalid credentials.')
-        else:
-            raise serializers.ValidationError('Must include username and password.')
 
-        return attrs
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Token refresh that refuses refresh tokens issued before the user's last
+    role or placement change, since the access token would carry stale claims.
+    """
+    token_class = ClaimsRefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        if TOKEN_VERSION_CLAIM in refresh:
+            state = token_state(refresh.get(api_settings.USER_ID_CLAIM), refresh=True)
+            if state is None or state[0] != refresh[TOKEN_VERSION_CLAIM]:
+                raise InvalidToken('Token has been revoked')
+        return super().validate(attrs)
 
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -0,0 +1,137 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+
+from . import audit_partitions, dashboard, email_delivery, push
+from .audit import current_actor, record_action
+from .directory import SEARCH_FIELDS, index_users, unindex_users
+from .models import User, ClaimsUser, Department, Semester, Section, Subject, Notification
+from .notifications import count_deleted, count_sent, notification_event
+
+
+def _index_user(sender, instance, created, update_fields=None, **kwargs):
+    # Saves that only touch other fields (last_login on every login, for
+    # one) leave the search row as it is.
+    if update_fields is not None and not set(update_fields) & set(SEARCH_FIELDS):
+        return
+    index_users([instance.pk])
+
+
+def _unindex_user(sender, instance, **kwargs):
+    unindex_users([instance.pk])
+
+
+def _count_user(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        dashboard.adjust('user_count', instance.department_id, f'{instance.role}_count', 1)
+        return
+    if update_fields is not None and not {'role', 'department', 'department_id'} & set(update_fields):
+        return
+    # User.save() replaces its snapshot of role and department only after
+    # post_save, so here it still holds the values before this save.
+    previous = getattr(instance, '_token_state', None) or {}
+    if 'role' not in previous or 'department_id' not in previous:
+        dashboard.invalidate_departments()
+    elif (previous['role'], previous['department_id']) != (instance.role, instance.department_id):
+        dashboard.adjust(department_id=previous['department_id'], counter=f"{previous['role']}_count", delta=-1)
+        dashboard.adjust(department_id=instance.department_id, counter=f'{instance.role}_count', delta=1)
+
+
+def _uncount_user(sender, instance, **kwargs):
+    dashboard.adjust('user_count', instance.department_id, f'{instance.role}_count', -1)
+
+
+def _delete_user_audit_months(sender, instance, **kwargs):
+    # SQLite month tables keep the live table's foreign key to users_user
+    # but are outside the ORM's cascade. Background deletion has emptied
+    # them already; this covers user.delete() from the admin or a shell.
+    audit_partitions.delete_for_users([instance.pk])
+
+
+def _count_department(sender, instance, created, **kwargs):
+    if created:
+        dashboard.adjust('department_count')
+
+
+def _uncount_department(sender, instance, **kwargs):
+    dashboard.adjust('department_count', delta=-1)
+    # Its users are SET_NULL without signals.
+    dashboard.invalidate_departments()
+
+
+def _push_notification(sender, instance, created, **kwargs):
+    if created:
+        count_sent([instance])
+        push.publish(notification_event(instance))
+        email_delivery.queue([instance])
+
+
+def _uncount_notification(sender, instance, **kwargs):
+    count_deleted(instance)
+
+
+def _section_department(section):
+    return Semester.objects.filter(pk=section.semester_id).values_list('department_id', flat=True).first()
+
+
+def _counter(total, department_of):
+    def on_save(sender, instance, created, **kwargs):
+        if created:
+            dashboard.adjust(total, department_of(instance), total, 1)
+        else:
+            # The department may have changed; recount breakdowns lazily.
+            dashboard.invalidate_departments()
+
+    def on_delete(sender, instance, **kwargs):
+        department_id = department_of(instance)
+        dashboard.adjust(total, department_id, total, -1)
+        if department_id is None:
+            dashboard.invalidate_departments()
+    return on_save, on_delete
+
+
+def _audit(resource_type):
+    def on_save(sender, instance, created, update_fields=None, **kwargs):
+        # last_login is saved on every login by the user logging in.
+        if update_fields is not None and set(update_fields) <= {'last_login'}:
+            return
+        user, request = current_actor()
+        if user is not None:
+            details = {'fields': sorted(update_fields)} if update_fields else ''
+            record_action(user, f"{'create' if created else 'update'}_{resource_type}", resource_type,
+                          instance.pk, request=request, details=details)
+
+    def on_delete(sender, instance, **kwargs):
+        user, request = current_actor()
+        if user is not None:
+            record_action(user, f'delete_{resource_type}', resource_type, instance.pk,
+                          request=request, details=str(instance))
+    return on_save, on_delete
+
+
+for model in (User, ClaimsUser):
+    post_save.connect(_index_user, sender=model, dispatch_uid=f'index_user_{model.__name__}')
+    post_delete.connect(_unindex_user, sender=model, dispatch_uid=f'unindex_user_{model.__name__}')
+    post_save.connect(_count_user, sender=model, dispatch_uid=f'count_user_{model.__name__}')
+    post_delete.connect(_uncount_user, sender=model, dispatch_uid=f'uncount_user_{model.__name__}')
+    pre_delete.connect(_delete_user_audit_months, sender=model, dispatch_uid=f'delete_user_audit_months_{model.__name__}')
+
+post_save.connect(_push_notification, sender=Notification, dispatch_uid='push_notification')
+post_delete.connect(_uncount_notification, sender=Notification, dispatch_uid='uncount_notification')
+post_save.connect(_count_department, sender=Department, dispatch_uid='count_department')
+post_delete.connect(_uncount_department, sender=Department, dispatch_uid='uncount_department')
+
+for model, total, department_of in (
+    (Semester, 'semester_count', lambda semester: semester.department_id),
+    (Section, 'section_count', _section_department),
+    (Subject, 'subject_count', lambda subject: subject.department_id),
+):
+    on_save, on_delete = _counter(total, department_of)
+    post_save.connect(on_save, sender=model, dispatch_uid=f'count_{total}', weak=False)
+    post_delete.connect(on_delete, sender=model, dispatch_uid=f'uncount_{total}', weak=False)
+
+for model, resource_type in (
+    (User, 'user'), (ClaimsUser, 'user'), (Department, 'department'),
+    (Semester, 'semester'), (Section, 'section'), (Subject, 'subject'),
+):
+    on_save, on_delete = _audit(resource_type)
+    post_save.connect(on_save, sender=model, dispatch_uid=f'audit_save_{model.__name__}', weak=False)
+    post_delete.connect(on_delete, sender=model, dispatch_uid=f'audit_delete_{model.__name__}', weak=False)
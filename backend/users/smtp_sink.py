@@ -0,0 +1,168 @@
+"""
+A local SMTP server that accepts mail and keeps it in memory, standing in
+for a real mail server in development and benchmarks:
+
+    with SMTPSink() as sink:
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                               EMAIL_HOST=sink.host, EMAIL_PORT=sink.port):
+            ...
+        sink.messages  # [(mail_from, [rcpt_to, ...], data), ...]
+
+It speaks the part of SMTP that smtplib uses to send (HELO/EHLO, MAIL,
+RCPT, DATA, RSET, NOOP, QUIT), without TLS or authentication. Recipients in
+`refuse` are answered 550, and `latency` seconds are waited before every
+reply to stand in for the round trips to a remote server. It runs on an
+asyncio loop in a thread of its own, so connections cost no thread each.
+"""
+import asyncio
+import threading
+
+
+class SMTPSink:
+    def __init__(self, host='127.0.0.1', port=0, refuse=(), latency=0, keep=True, on_message=None):
+        self.host = host
+        self.port = port
+        self.refuse = {address.lower() for address in refuse}
+        self.latency = latency
+        self.keep = keep
+        self.on_message = on_message
+        self.messages = []
+        self.received = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        started = threading.Event()
+        errors = []
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            try:
+                self._server = self._loop.run_until_complete(
+                    asyncio.start_server(self._session, self.host, self.port)
+                )
+                self.port = self._server.sockets[0].getsockname()[1]
+            except OSError as e:
+                errors.append(e)
+                started.set()
+                self._loop.close()
+                return
+            started.set()
+            try:
+                self._loop.run_forever()
+            finally:
+                self._server.close()
+                self._loop.run_until_complete(self._server.wait_closed())
+                self._loop.close()
+
+        self._thread = threading.Thread(target=run, name='smtp-sink', daemon=True)
+        self._thread.start()
+        started.wait()
+        if errors:
+            raise errors[0]
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+
+    def serve_forever(self):
+        if self._thread is None:
+            self.start()
+        try:
+            self._thread.join()
+        finally:
+            self.stop()
+
+    def _accept(self, mail_from, rcpt_to, data):
+        with self._lock:
+            self.received += 1
+            if self.keep:
+                self.messages.append((mail_from, rcpt_to, data))
+        if self.on_message is not None:
+            self.on_message(mail_from, rcpt_to, data)
+
+    async def _session(self, reader, writer):
+        with self._lock:
+            self.connections += 1
+
+        async def reply(line):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            writer.write(line.encode() + b'\r\n')
+            await writer.drain()
+
+        mail_from, rcpt_to = None, []
+        try:
+            await reply('220 localhost SMTP sink ready')
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command, _, argument = line.decode('latin-1').rstrip('\r\n').partition(' ')
+                command = command.upper()
+                if command == 'EHLO':
+                    await reply('250-localhost')
+                    await reply('250 8BITMIME')
+                elif command == 'HELO':
+                    await reply('250 localhost')
+                elif command == 'MAIL':
+                    mail_from, rcpt_to = _address(argument), []
+                    await reply('250 OK')
+                elif command == 'RCPT':
+                    address = _address(argument)
+                    if address.lower() in self.refuse:
+                        await reply('550 No such user')
+                    else:
+                        rcpt_to.append(address)
+                        await reply('250 OK')
+                elif command == 'DATA':
+                    if mail_from is None or not rcpt_to:
+                        await reply('503 Bad sequence of commands')
+                        continue
+                    await reply('354 End data with <CR><LF>.<CR><LF>')
+                    lines = []
+                    while True:
+                        data_line = await reader.readline()
+                        if not data_line or data_line in (b'.\r\n', b'.\n'):
+                            break
+                        lines.append(data_line[1:] if data_line.startswith(b'..') else data_line)
+                    self._accept(mail_from, rcpt_to, b''.join(lines))
+                    mail_from, rcpt_to = None, []
+                    await reply('250 OK')
+                elif command == 'RSET':
+                    mail_from, rcpt_to = None, []
+                    await reply('250 OK')
+                elif command == 'NOOP':
+                    await reply('250 OK')
+                elif command == 'QUIT':
+                    await reply('221 Bye')
+                    break
+                else:
+                    await reply('502 Command not implemented')
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def _address(argument):
+    """
+    The address of a 'FROM:<a@b> SIZE=...' or 'TO:<a@b>' argument.
+    """
+    value = argument.partition(':')[2].strip()
+    if value.startswith('<'):
+        value = value[1:].partition('>')[0]
+    return value.split(' ')[0]
@@ -0,0 +1,186 @@
+"""
+Server-Sent Events stream of a user's notifications.
+
+GET PUSH_PATH (default /api/v1/notifications/stream/) answers with
+text/event-stream and keeps the connection open:
+
+    event: unread          data: {"unread": 3}     on connect and after reads
+    event: notification    data: {...inbox row}    id: <notification id>
+    event: resync          data: {}                events were dropped; refetch
+
+A comment line is sent every PUSH_KEEPALIVE seconds to keep proxies from
+closing an idle stream. The stream ends when the access token expires, and
+EventSource reconnects with a new one. On reconnect, the Last-Event-ID
+header brings the notifications sent since then, up to PUSH_REPLAY_LIMIT.
+
+It is a plain ASGI app mounted in front of Django by route() in
+learning_platform/asgi.py, because it has to notice the client going away
+(http.disconnect), which Django 4.2 does not report to streaming responses.
+Browsers' EventSource cannot set headers, so the access token may also be
+given as ?access_token=.
+"""
+import asyncio
+import json
+import time
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+
+from .authentication import ClaimsJWTAuthentication
+from .notifications import inbox, inbox_rows, unread
+from .push import hub
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _headers(scope):
+    return {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope.get('headers', [])}
+
+
+def _raw_token(scope, headers):
+    authorization = headers.get('authorization', '')
+    if authorization.startswith('Bearer '):
+        return authorization[len('Bearer '):]
+    values = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('access_token')
+    return values[0] if values else None
+
+
+def _authenticate(raw_token):
+    """
+    (user, expiry timestamp) for a valid access token, else (None, None).
+    """
+    authentication = ClaimsJWTAuthentication()
+    try:
+        token = authentication.get_validated_token(raw_token)
+        return authentication.get_user(token), token['exp']
+    except (InvalidToken, AuthenticationFailed, TokenError, KeyError):
+        return None, None
+
+
+def _replay(user, last_event_id):
+    """
+    Inbox rows newer than notification `last_event_id`, oldest first.
+    """
+    limit = _setting('PUSH_REPLAY_LIMIT', 100)
+    ids = list(inbox(user).filter(id__gt=last_event_id).order_by('-id').values_list('id', flat=True)[:limit])
+    return inbox_rows(user, ids[::-1])
+
+
+def _message(event, data, event_id=None):
+    lines = [f'event: {event}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append('data: ' + json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':')))
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+def _cors_headers(headers):
+    origin = headers.get('origin')
+    if origin and origin in getattr(settings, 'CORS_ALLOWED_ORIGINS', ()):
+        return [(b'access-control-allow-origin', origin.encode('latin-1')), (b'vary', b'Origin')]
+    return []
+
+
+async def _respond(send, status, body, headers=()):
+    await send({
+        'type': 'http.response.start', 'status': status,
+        'headers': [(b'content-type', b'application/json'), *headers],
+    })
+    await send({'type': 'http.response.body', 'body': json.dumps(body).encode()})
+
+
+async def _disconnected(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def notification_stream(scope, receive, send):
+    headers = _headers(scope)
+    cors = _cors_headers(headers)
+    if scope['method'] != 'GET':
+        await _respond(send, 405, {'error': 'Method not allowed'}, cors)
+        return
+    raw_token = _raw_token(scope, headers)
+    user, expires = (None, None) if raw_token is None else await sync_to_async(_authenticate)(raw_token)
+    if user is None:
+        await _respond(send, 401, {'error': 'Authentication credentials were not provided or are invalid'}, cors)
+        return
+
+    subscriber = hub.subscribe(user.pk, user.role, user.department_id)
+    disconnect = asyncio.ensure_future(_disconnected(receive))
+    try:
+        await send({
+            'type': 'http.response.start', 'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+                *cors,
+            ],
+        })
+        # Subscribed first, so nothing falls between the replay and the queue.
+        replayed = 0
+        last_event_id = headers.get('last-event-id', '')
+        opening = [b'retry: 3000\n\n']
+        if last_event_id.isdigit():
+            for row in await sync_to_async(_replay)(user, int(last_event_id)):
+                opening.append(_message('notification', row, row['id']))
+                replayed = row['id']
+        opening.append(_message('unread', {'unread': await sync_to_async(unread)(user)}))
+        await send({'type': 'http.response.body', 'body': b''.join(opening), 'more_body': True})
+
+        keepalive = _setting('PUSH_KEEPALIVE', 15)
+        while True:
+            timeout = min(keepalive, expires - time.time())
+            if timeout <= 0:
+                break
+            getter = asyncio.ensure_future(subscriber.queue.get())
+            done, _ = await asyncio.wait({getter, disconnect}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if disconnect in done:
+                getter.cancel()
+                break
+            if subscriber.overflowed:
+                getter.cancel()
+                while not subscriber.queue.empty():
+                    subscriber.queue.get_nowait()
+                subscriber.overflowed = False
+                body = _message('resync', {})
+            elif getter in done:
+                event = getter.result()
+                if event['type'] == 'notification':
+                    if event['data']['id'] <= replayed:
+                        continue
+                    body = _message('notification', event['data'], event['data']['id'])
+                else:
+                    body = _message(event['type'], event['data'])
+            else:
+                getter.cancel()
+                body = b': keepalive\n\n'
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+        if not disconnect.done():
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    finally:
+        hub.unsubscribe(subscriber)
+        disconnect.cancel()
+
+
+def route(application):
+    """
+    Wrap the Django ASGI application so PUSH_PATH is served by
+    notification_stream().
+    """
+    path = _setting('PUSH_PATH', '/api/v1/notifications/stream/')
+
+    async def router(scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == path:
+            await notification_stream(scope, receive, send)
+        else:
+            await application(scope, receive, send)
+    return router
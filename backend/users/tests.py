@@ -0,0 +1,73 @@
+import json
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
+
+from .audit import AuditWriter, QUARANTINE_SUFFIX, _STOP
+from .audit_partitions import audit_log_page
+from .models import User, AuditLog
+from .pagination import InvalidCursor, encode_cursor
+
+
+class AuditSpillReplayTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='audit-admin', password=None, role='admin')
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        override = override_settings(AUDIT_SPILL_DIR=self.directory)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def _entry(self, action):
+        return {
+            'user_id': self.user.pk, 'action': action, 'resource_type': 'user', 'resource_id': self.user.pk,
+            'timestamp': '2024-01-01T00:00:00+00:00', 'ip_address': None, 'details': '',
+        }
+
+    def test_replay_quarantines_a_torn_line(self):
+        path = os.path.join(self.directory, '1-deadbeef.jsonl')
+        with open(path, 'w') as f:
+            f.write(json.dumps(self._entry('first')) + '\n')
+            # A process killed mid-spill leaves half a line behind.
+            f.write(json.dumps(self._entry('second'))[:40])
+
+        self.assertEqual(AuditWriter().replay(orphan_age=-1), 1)
+
+        self.assertEqual(list(AuditLog.objects.values_list('action', flat=True)), ['first'])
+        self.assertEqual(os.listdir(self.directory), ['1-deadbeef.jsonl' + QUARANTINE_SUFFIX])
+        with open(path + QUARANTINE_SUFFIX) as f:
+            self.assertEqual(f.read(), json.dumps(self._entry('second'))[:40] + '\n')
+
+    def test_dead_flusher_is_restarted_with_its_queue(self):
+        writer = AuditWriter()
+        writer._ensure_started()
+        entries = writer._queue
+        # The thread exits as if it had died.
+        entries.put(_STOP)
+        writer._thread.join(5)
+
+        writer._ensure_started()
+
+        self.assertTrue(writer._thread.is_alive())
+        self.assertIs(writer._queue, entries)
+        writer.close(timeout=5)
+
+
+class AuditLogPageCursorTests(TestCase):
+    def test_cursor_of_the_wrong_types_is_invalid(self):
+        for values in ([1, 2], ['2024-01-01T00:00:00+00:00', '2'], ['not a date', 2], [None, None]):
+            with self.subTest(values=values), self.assertRaises(InvalidCursor):
+                audit_log_page({}, cursor=encode_cursor(values))
+
+    def test_next_cursor_pages_on(self):
+        user = User.objects.create_user(username='audit-hod', password=None, role='hod')
+        AuditLog.objects.bulk_create([
+            AuditLog(user=user, action=f'action-{n}', resource_type='user', resource_id=user.pk, details='')
+            for n in range(3)
+        ])
+        rows, cursor = audit_log_page({}, page_size=2)
+        more, end = audit_log_page({}, cursor=cursor, page_size=2)
+        self.assertEqual(len(rows) + len(more), 3)
+        self.assertIsNone(end)
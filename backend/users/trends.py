@@ -0,0 +1,135 @@
+"""
+Attendance trend series read from the precomputed buckets, plus the backfill
+that rebuilds those buckets from stored attendance.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDay, TruncMonth
+
+from .attendance import uses_session_storage
+from .bitsets import unpack_bits, unpack_ids
+from .models import Attendance, AttendanceSession, SectionAttendanceBucket, StudentMonthlyAttendance
+
+
+def _series(rows, period_field):
+    return [
+        {
+            'period': row[period_field],
+            'total': row['total'],
+            'present': row['present'],
+            'attendance_percentage': round(row['present'] / row['total'] * 100, 2) if row['total'] else 0,
+        }
+        for row in rows
+    ]
+
+
+def section_trend(subjects, granularity='day', section_id=None, date_from=None, date_to=None):
+    """
+    Attendance per period for `subjects` (a Subject queryset), summed over
+    sections unless `section_id` is given. Reads one bucket row per section,
+    subject and period.
+    """
+    buckets = SectionAttendanceBucket.objects.filter(subject__in=subjects, granularity=granularity)
+    if section_id:
+        buckets = buckets.filter(section_id=section_id)
+    if date_from:
+        buckets = buckets.filter(period_start__gte=date_from)
+    if date_to:
+        buckets = buckets.filter(period_start__lte=date_to)
+    rows = (
+        buckets.order_by('period_start')
+        .values('period_start')
+        .annotate(total=Sum('total'), present=Sum('present'))
+    )
+    return _series(rows, 'period_start')
+
+
+def student_trend(student, subject_id=None, date_from=None, date_to=None):
+    """
+    Monthly attendance for one student, summed over subjects unless
+    `subject_id` is given.
+    """
+    months = StudentMonthlyAttendance.objects.filter(student=student)
+    if subject_id:
+        months = months.filter(subject_id=subject_id)
+    if date_from:
+        months = months.filter(month__gte=date_from.replace(day=1))
+    if date_to:
+        months = months.filter(month__lte=date_to)
+    rows = months.order_by('month').values('month').annotate(total=Sum('total'), present=Sum('present'))
+    return _series(rows, 'month')
+
+
+def _counts_from_rows(subject_ids):
+    present = Count('id', filter=Q(is_present=True))
+    rows = Attendance.objects.filter(subject_id__in=subject_ids, student__section__isnull=False).order_by()
+    section = defaultdict(lambda: [0, 0])
+    for granularity, trunc in (('day', TruncDay('date')), ('month', TruncMonth('date'))):
+        for row in (rows.annotate(period=trunc)
+                    .values('student__section_id', 'subject_id', 'period')
+                    .annotate(total=Count('id'), present=present)):
+            section[(row['student__section_id'], row['subject_id'], granularity, row['period'])] = [row['total'], row['present']]
+    student = {
+        (row['student_id'], row['subject_id'], row['month']): [row['total'], row['present']]
+        for row in rows.annotate(month=TruncMonth('date'))
+        .values('student_id', 'subject_id', 'month')
+        .annotate(total=Count('id'), present=present)
+    }
+    return section, student
+
+
+def _counts_from_sessions(subject_ids):
+    section = defaultdict(lambda: [0, 0])
+    student = defaultdict(lambda: [0, 0])
+    sessions = AttendanceSession.objects.filter(subject_id__in=subject_ids).order_by().values_list(
+        'section_id', 'subject_id', 'date', 'roster', 'presence'
+    )
+    for section_id, subject_id, date, roster, presence in sessions.iterator():
+        student_ids = unpack_ids(roster)
+        flags = unpack_bits(presence, len(student_ids))
+        month = date.replace(day=1)
+        for key in ((section_id, subject_id, 'day', date), (section_id, subject_id, 'month', month)):
+            section[key][0] += len(student_ids)
+            section[key][1] += sum(flags)
+        for student_id, is_present in zip(student_ids, flags):
+            counts = student[(student_id, subject_id, month)]
+            counts[0] += 1
+            counts[1] += int(is_present)
+    return section, student
+
+
+def rebuild_buckets(subject_ids):
+    """
+    Replace the trend buckets of `subject_ids` with counts recomputed from
+    stored attendance. In row storage a mark is attributed to the student's
+    current section, since Attendance rows do not record one.
+    Returns the number of bucket rows written.
+    """
+    counter = _counts_from_sessions if uses_session_storage() else _counts_from_rows
+    section_counts, student_counts = counter(subject_ids)
+
+    with transaction.atomic():
+        SectionAttendanceBucket.objects.filter(subject_id__in=subject_ids).delete()
+        StudentMonthlyAttendance.objects.filter(subject_id__in=subject_ids).delete()
+        SectionAttendanceBucket.objects.bulk_create(
+            [
+                SectionAttendanceBucket(
+                    section_id=section_id, subject_id=subject_id, granularity=granularity,
+                    period_start=period_start, total=total, present=present,
+                )
+                for (section_id, subject_id, granularity, period_start), (total, present) in section_counts.items()
+            ],
+            batch_size=1000,
+        )
+        StudentMonthlyAttendance.objects.bulk_create(
+            [
+                StudentMonthlyAttendance(
+                    student_id=student_id, subject_id=subject_id, month=month, total=total, present=present,
+                )
+                for (student_id, subject_id, month), (total, present) in student_counts.items()
+            ],
+            batch_size=1000,
+        )
+    return len(section_counts) + len(student_counts)
@@ -14,4 +14,5 @@ urlpatterns = [
     # User management URLs
     path('users/', views.UserListView.as_view(), name='user-list'),
     path('users/<int:pk>/', views.UserDetailView.as_view(), name='user-detail'),
+    path('notifications/unread/', views.UnreadNotificationsView.as_view(), name='unread-notifications'),
 ]
\ No newline at end of file
@@ -1,46 +1,83 @@
+from asgiref.sync import sync_to_async
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.hashers import make_password
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.utils.http import parse_etags
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import generics, status, viewsets
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import APIException
 from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.settings import api_settings as rest_settings
 from rest_framework.views import APIView
-from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenRefreshView
 from .models import User
-from .serializers import UserSerializer, LoginSerializer, RegisterSerializer
+from .serializers import (
+    UserSerializer, LoginSerializer, RegisterSerializer, ClaimsTokenRefreshSerializer,
+)
+from .audit import record_action
+from .deletion import job_status, schedule_deletion
+from .directory import directory_page
+from .notifications import unread
+from .pagination import InvalidCursor, page_size_param
+from .tokens import ClaimsRefreshToken
 from .permissions import IsAdminUser
 
 
-class LoginView(APIView):
+def _error_response(exc):
     """
-    API view for user login with JWT token generation.
+    `exc` answered as DRF's exception handler would.
     """
-    permission_classes = [AllowAny]
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    response = JsonResponse(data, status=exc.status_code, safe=False)
+    if getattr(exc, 'wait', None):
+        response['Retry-After'] = '%d' % float(exc.wait)
+    return response
+
+
+def _login_data(request, user):
+    # Log the user in
+    login(request, user)
     
-    def post(self, request):
-        serializer = LoginSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        user = serializer.validated_data["user"]
-        
-        # Log the user in
-        login(request, user)
-        
-        # Generate JWT tokens
-        refresh = RefreshToken.for_user(user)
-        
-        return Response({
-            'refresh': str(refresh),
-            'access': str(refresh.access_token),
-            'user': {
-                'id': user.id,
-                'username': user.username,
-                'email': user.email,
-                'role': user.role,
-                'department': user.department.name if user.department_id else None,
-                'full_name': f"{user.first_name} {user.last_name}".strip()
-            }
-        }, status=status.HTTP_200_OK)
+    # Generate JWT tokens
+    refresh = ClaimsRefreshToken.for_user(user)
+    
+    return {
+        'refresh': str(refresh),
+        'access': str(refresh.access_token),
+        'user': {
+            'id': user.id,
+            'username': user.username,
+            'email': user.email,
+            'role': user.role,
+            'department': user.department.name if user.department_id else None,
+            'full_name': f"{user.first_name} {user.last_name}".strip()
+        }
+    }
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class LoginView(View):
+    """
+    API view for user login with JWT token generation.
+
+    An async Django view rather than an APIView: while the password is
+    hashed in the login pool the request holds no thread (see
+    users/login.py). Parsing and error responses follow DRF's.
+    """
+    async def post(self, request):
+        try:
+            data = Request(request, parsers=[parser() for parser in rest_settings.DEFAULT_PARSER_CLASSES]).data
+            serializer = LoginSerializer(data=data, context={'request': request})
+            serializer.is_valid(raise_exception=True)
+            user = await serializer.check_credentials()
+        except APIException as exc:
+            return _error_response(exc)
+        return JsonResponse(await sync_to_async(_login_data)(request, user))
 
 
 class LogoutView(APIView):
@@ -51,7 +88,7 @@ class LogoutView(APIView):
         try:
             refresh_token = request.data.get("refresh")
             if refresh_token:
-                token = RefreshToken(refresh_token)
+                token = ClaimsRefreshToken(refresh_token)
                 token.blacklist()
             return Response(status=status.HTTP_204_NO_CONTENT)
         except Exception as e:
@@ -60,9 +97,9 @@ class LogoutView(APIView):
 
 class CustomTokenRefreshView(TokenRefreshView):
     """
-    Override default token refresh view if needed.
+    Token refresh that keeps the user claims and refuses revoked tokens.
     """
-    pass
+    serializer_class = ClaimsTokenRefreshSerializer
 
 
 class RegisterView(APIView):
@@ -76,7 +113,7 @@ class RegisterView(APIView):
         if serializer.is_valid():
             user = serializer.save()
             # Generate JWT tokens after registration
-            refresh = RefreshToken.for_user(user)
+            refresh = ClaimsRefreshToken.for_user(user)
             
             return Response({
                 'refresh': str(refresh),
@@ -95,22 +132,61 @@ class ProfileView(generics.RetrieveUpdateAPIView):
     permission_classes = [IsAuthenticated]
     
     def get_object(self):
-        return self.request.user
+        # request.user is built from token claims; load the row to update it.
+        return User.objects.select_related('department', 'semester', 'section').get(pk=self.request.user.pk)
 
 
 class UserListView(generics.ListCreateAPIView):
     """
-    API view for listing and creating users (admin only).
+    API view for listing and creating users (admin only). The list is one
+    keyset page at a time, with the user directory filters and ?q= search.
     """
-    queryset = User.objects.all()
+    queryset = User.objects.filter(pending_delete=False)
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated, IsAdminUser]
+    
+    def list(self, request, *args, **kwargs):
+        try:
+            users, next_cursor = directory_page(
+                self.get_queryset(), request.query_params,
+                cursor=request.query_params.get('cursor'),
+                page_size=page_size_param(request),
+            )
+        except (InvalidCursor, ValueError):
+            return Response({'error': 'Invalid cursor or filter'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'results': users, 'next_cursor': next_cursor})
 
 
 class UserDetailView(generics.RetrieveUpdateDestroyAPIView):
     """
     API view for retrieving, updating, and deleting a specific user (admin only).
+    Deletion runs in the background (see users/deletion.py).
     """
-    queryset = User.objects.all()
+    queryset = User.objects.filter(pending_delete=False)
     serializer_class = UserSerializer
-    permission_classes = [IsAuthenticated, IsAdminUser]
\ No newline at end of file
+    permission_classes = [IsAuthenticated, IsAdminUser]
+    
+    def destroy(self, request, *args, **kwargs):
+        user = self.get_object()
+        job = schedule_deletion(user, requested_by=request.user)
+        record_action(request.user, 'delete_user', 'user', user.pk, request=request,
+                      details={'job': job.pk, 'name': str(user)})
+        return Response(job_status(job), status=status.HTTP_202_ACCEPTED)
+
+
+class UnreadNotificationsView(APIView):
+    """
+    API view for the unread notification badge. The count is kept by
+    counters (see users/notifications.py) and carries an ETag, so a client
+    polling with If-None-Match gets 304 Not Modified while it is unchanged.
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request):
+        count = unread(request.user)
+        etag = f'"{count}"'
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match and (if_none_match.strip() == '*' or etag in parse_etags(if_none_match)):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response({'unread': count}, headers=headers)